@@ -0,0 +1,82 @@
+# event_log.py
+# Leveled event log for the peer side. Events are kept in a bounded in-memory
+# ring that can be dumped on demand; only those at or above the print level
+# reach stdout. A call below the recording level returns after one comparison,
+# and messages are %-formatted only when printed or dumped.
+import sys
+import time
+from collections import deque
+
+DEBUG = 10  # Per-message traffic: blocks served, HAVEs, bitfields, chokes
+INFO = 20  # Connection and torrent lifecycle
+WARNING = 30  # Failures we recover from
+ERROR = 40
+
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+DEFAULT_CAPACITY = 10000  # events kept in the ring
+
+
+class EventLog:
+    def __init__(self, level=DEBUG, print_level=INFO, capacity=DEFAULT_CAPACITY):
+        """
+        :param level: Events below this level are dropped without a trace
+        :param print_level: Events at or above this level are also printed
+        :param capacity: Events kept in the ring; the oldest go first
+        """
+        self.level = level
+        self.print_level = print_level
+        self.ring = deque(maxlen=capacity)  # (wall time, level, message, args); append is atomic
+
+    def set_level(self, level=None, print_level=None):
+        if level is not None:
+            self.level = level
+        if print_level is not None:
+            self.print_level = print_level
+
+    def quiet(self):
+        """Production mode: only warnings and errors are recorded, and they are printed."""
+        self.set_level(WARNING, WARNING)
+
+    def debug(self, message, *args):
+        if self.level <= DEBUG:
+            self.log(DEBUG, message, *args)
+
+    def info(self, message, *args):
+        if self.level <= INFO:
+            self.log(INFO, message, *args)
+
+    def warning(self, message, *args):
+        if self.level <= WARNING:
+            self.log(WARNING, message, *args)
+
+    def error(self, message, *args):
+        if self.level <= ERROR:
+            self.log(ERROR, message, *args)
+
+    def log(self, level, message, *args):
+        if level < self.level:
+            return
+        self.ring.append((time.time(), level, message, args))
+        if level >= self.print_level:
+            print(message % args if args else message)
+
+    def events(self, level=DEBUG):
+        """Recorded events at or above `level`, oldest first, as dicts."""
+        # list() copies the ring in one step under the GIL, so concurrent appends can't break it
+        return [{'time': ts, 'level': LEVEL_NAMES.get(lvl, str(lvl)), 'message': message % args if args else message}
+                for ts, lvl, message, args in list(self.ring) if lvl >= level]
+
+    def dump(self, file=None, level=DEBUG):
+        """Write the recorded events as text lines to `file` (stdout by default)."""
+        file = file or sys.stdout
+        for event in self.events(level):
+            stamp = time.strftime('%H:%M:%S', time.localtime(event['time']))
+            millis = int(event['time'] % 1 * 1000)
+            file.write(f"{stamp}.{millis:03} {event['level']:<7} {event['message']}\n")
+        file.flush()
+
+    def clear(self):
+        self.ring.clear()
+
+
+EVENT_LOG = EventLog()  # Shared by every torrent and session of the process
@@ -0,0 +1,75 @@
+# peer_score.py
+# How much a connection is worth keeping, so that a torrent or session at its
+# connection cap knows whom to drop for a new candidate.
+import math
+import time
+
+RATE_WINDOW = 20.0  # seconds over which transfer rates are smoothed
+USEFUL_CREDIT = 16 * 1024  # bytes/s a peer is worth for having every piece we still need
+GRACE_PERIOD = 30  # seconds a new connection gets to prove itself before it can be evicted
+EVICT_INTERVAL = 5  # seconds between evictions, so a burst of newcomers can't churn the swarm
+
+
+class PeerScore:
+    """
+    Exponentially smoothed transfer in both directions and the failures of one
+    connection. Only the connection's own thread calls add_*(); the rates and
+    value() are computed without writing anything, so any thread may read them.
+    """
+    __slots__ = ('connected_at', 'updated', 'downloaded', 'uploaded', 'failures')
+
+    def __init__(self, failures=0, now=None):
+        """
+        :param failures: Failures already held against the peer's address from earlier connections
+        """
+        now = time.monotonic() if now is None else now
+        self.connected_at = now
+        self.updated = now
+        self.downloaded = 0.0  # Bytes received, decayed over RATE_WINDOW
+        self.uploaded = 0.0  # Bytes sent, decayed over RATE_WINDOW
+        self.failures = failures
+
+    def _decay(self, now):
+        if now > self.updated:
+            factor = math.exp((self.updated - now) / RATE_WINDOW)
+            self.downloaded *= factor
+            self.uploaded *= factor
+            self.updated = now
+
+    def _decayed(self, amount, now):
+        """`amount` as decay would leave it at `now`, without storing anything."""
+        return amount * math.exp(min(0.0, self.updated - now) / RATE_WINDOW)
+
+    def add_download(self, n, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        self.downloaded += n
+
+    def add_upload(self, n, now=None):
+        self._decay(time.monotonic() if now is None else now)
+        self.uploaded += n
+
+    def add_failure(self):
+        self.failures += 1
+
+    def download_rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._decayed(self.downloaded, now) / RATE_WINDOW
+
+    def upload_rate(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self._decayed(self.uploaded, now) / RATE_WINDOW
+
+    def evictable(self, now=None):
+        now = time.monotonic() if now is None else now
+        return now - self.connected_at >= GRACE_PERIOD
+
+    def value(self, useful=0.0, now=None):
+        """
+        Bytes/s the connection is worth: traffic both ways, plus credit for
+        pieces it could still give us, divided down by its failures.
+
+        :param useful: Fraction of the pieces we still need that the peer has (0..1)
+        """
+        now = time.monotonic() if now is None else now
+        rate = self.download_rate(now) + self.upload_rate(now) + USEFUL_CREDIT * useful
+        return rate / (1 + self.failures)
@@ -1,3 +1,4 @@
+import hashlib
 
 
 class Piece:
@@ -6,14 +7,39 @@ class Piece:
         self.block_size = block_size
         self.blocks = {}  # {offset → bytes}
         self.received_bytes = 0
+        self.leaf_hashes = None  # v2: concatenated SHA-256 of every block, once verified against the piece layer
 
     def store_block(self, begin, data):
-        if begin not in self.blocks:
-            self.blocks[begin] = data
-            self.received_bytes += len(data)
+        """Keep a block. Returns False (and drops it) if it fails its leaf hash."""
+        if begin in self.blocks:
+            return True
+        if self.leaf_hashes is not None and not self._block_matches(begin, data):
+            return False
+        self.blocks[begin] = data
+        self.received_bytes += len(data)
+        return True
+
+    def set_leaf_hashes(self, leaf_hashes):
+        """
+        Start verifying blocks as they arrive. Blocks stored before the hashes
+        came are checked now; the offsets of those that fail are dropped and returned.
+        """
+        self.leaf_hashes = leaf_hashes
+        failed = [begin for begin, data in self.blocks.items() if not self._block_matches(begin, data)]
+        for begin in failed:
+            self.received_bytes -= len(self.blocks.pop(begin))
+        return failed
+
+    def is_verified(self):
+        """True when every stored block was checked against its leaf hash."""
+        return self.leaf_hashes is not None
 
     def is_complete(self):
         return self.received_bytes >= self.total_length
 
     def reassemble(self):
         return b''.join(self.blocks[offset] for offset in sorted(self.blocks))
+
+    def _block_matches(self, begin, data):
+        i = begin // self.block_size * 32
+        return hashlib.sha256(data).digest() == self.leaf_hashes[i:i + 32]
@@ -1,72 +1,340 @@
+# protocolmessage.py
+import hashlib
+import socket
+import struct
+import threading
+
+# Core message IDs
+KEEP_ALIVE = -1  # Pseudo ID returned by parse_message for zero-length messages
+CHOKE = 0
+UNCHOKE = 1
+INTERESTED = 2
+NOT_INTERESTED = 3
+HAVE = 4
+BITFIELD = 5
+REQUEST = 6
+PIECE = 7
+CANCEL = 8
+
+# BEP 6 Fast Extension message IDs
+SUGGEST_PIECE = 0x0D
+HAVE_ALL = 0x0E
+HAVE_NONE = 0x0F
+REJECT_REQUEST = 0x10
+ALLOWED_FAST = 0x11
+
+# BEP 10 Extension Protocol message ID (sub-ID 0 is the extended handshake)
+EXTENDED = 20
+EXTENDED_HANDSHAKE = 0
+
+# BEP 52 (BitTorrent v2) merkle hash message IDs
+HASH_REQUEST = 21
+HASHES = 22
+HASH_REJECT = 23
+
+# Reserved handshake bits (byte index, mask)
+FAST_EXTENSION_BIT = (7, 0x04)
+EXTENSION_PROTOCOL_BIT = (5, 0x10)
+V2_BIT = (7, 0x10)
+
+MAX_REQUEST_LENGTH = 128 * 1024  # Largest block we serve; peers normally ask for 16 KiB
+MAX_MESSAGE_LENGTH = 9 + MAX_REQUEST_LENGTH  # ID, index, begin and the largest block; bitfields may need more
+
+# Precompiled codecs. Full messages include the 4-byte length prefix and the ID.
+LENGTH = struct.Struct('>I')
+HEADER = struct.Struct('>IB')  # length, ID
+INDEX_MESSAGE = struct.Struct('>IBI')  # have, allowed fast, suggest
+BLOCK_MESSAGE = struct.Struct('>IBIII')  # request, cancel, reject
+PIECE_HEADER = struct.Struct('>IBII')  # piece (block follows)
+EXTENDED_HEADER = struct.Struct('>IBB')  # length, ID, extended ID
+HASH_MESSAGE = struct.Struct('>IB32sIIII')  # hash request, hashes (hashes follow), hash reject
+INDEX_PAYLOAD = struct.Struct('>I')
+BLOCK_PAYLOAD = struct.Struct('>III')
+PIECE_PAYLOAD = struct.Struct('>II')
+HASH_PAYLOAD = struct.Struct('>32sIIII')  # pieces root, base layer, index, length, proof layers
+COMPACT_PORT = struct.Struct('>H')
+
+# Messages without a payload never change, so build them once
+_STATIC_MESSAGES = {msg_id: HEADER.pack(1, msg_id) for msg_id in
+                    (CHOKE, UNCHOKE, INTERESTED, NOT_INTERESTED, HAVE_ALL, HAVE_NONE)}
+_KEEP_ALIVE_MESSAGE = LENGTH.pack(0)
+
+# Bits of every byte value, most significant first, for bitfield decoding
+_BYTE_BITS = [tuple(bool((byte >> (7 - i)) & 1) for i in range(8)) for byte in range(256)]
+
+_scratch = threading.local()
+
+
+def _scratch_buffer(size):
+    """Per-thread reusable buffer for messages packed with pack_into."""
+    buf = getattr(_scratch, 'buf', None)
+    if buf is None or len(buf) < size:
+        buf = _scratch.buf = bytearray(size)
+    return buf
+
+
+def _recv_exact(sock, n):
+    """
+    Read n bytes; fewer if the peer closed. A message that arrives in pieces
+    is collected in one preallocated buffer rather than by concatenation.
+    """
+    data = sock.recv(n)  # EncryptedSocket reads exactly n itself
+    if len(data) == n or not data or not hasattr(sock, 'recv_into'):
+        return data
+    buf = bytearray(n)
+    view = memoryview(buf)
+    view[:len(data)] = data
+    received = len(data)
+    while received < n:
+        count = sock.recv_into(view[received:])
+        if not count:
+            break
+        received += count
+    return bytes(view[:received])
+
+
 class ProtocolMessage:
+    @staticmethod
+    def build_keep_alive():
+        return _KEEP_ALIVE_MESSAGE
+
     @staticmethod
     def build_interested():
-        return (1).to_bytes(4, 'big') + b'\x02'
+        return _STATIC_MESSAGES[INTERESTED]
 
     @staticmethod
     def build_not_interested():
-        return (1).to_bytes(4, 'big') + b'\x03'  # ID = 3 = not interested
+        return _STATIC_MESSAGES[NOT_INTERESTED]
 
     @staticmethod
     def build_have(index):
-        return (5).to_bytes(4, 'big') + b'\x04' + index.to_bytes(4, 'big')
+        return INDEX_MESSAGE.pack(5, HAVE, index)
 
     @staticmethod
     def build_choke():
-        return (1).to_bytes(4, 'big') + bytes([0])
+        return _STATIC_MESSAGES[CHOKE]
 
     @staticmethod
     def build_unchoke():
-        return (1).to_bytes(4, 'big') + bytes([1])
+        return _STATIC_MESSAGES[UNCHOKE]
 
     @staticmethod
-    def build_handshake(info_hash, peer_id):
+    def build_handshake(info_hash, peer_id, reserved=None):
         pstr = b"BitTorrent protocol"
-        reserved = b'\x00' * 8
+        if reserved is None:
+            reserved = ProtocolMessage.build_reserved()
         return bytes([len(pstr)]) + pstr + reserved + info_hash + peer_id
 
+    @staticmethod
+    def receive_handshake(sock):
+        """Read a handshake. Returns (info_hash, peer_id, reserved), or None if it isn't one."""
+        data = b''
+        while len(data) < 62:
+            chunk = sock.recv(62 - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        if not data.startswith(b'\x13BitTorrent protocol'):
+            return None
+        return data[28:48], data[48:], data[20:28]
+
+    @staticmethod
+    def build_reserved(fast=True, extended=True, v2=False):
+        reserved = bytearray(8)
+        if fast:
+            byte, mask = FAST_EXTENSION_BIT
+            reserved[byte] |= mask
+        if extended:
+            byte, mask = EXTENSION_PROTOCOL_BIT
+            reserved[byte] |= mask
+        if v2:
+            byte, mask = V2_BIT
+            reserved[byte] |= mask
+        return bytes(reserved)
+
+    @staticmethod
+    def supports_fast(reserved):
+        byte, mask = FAST_EXTENSION_BIT
+        return len(reserved) == 8 and bool(reserved[byte] & mask)
+
+    @staticmethod
+    def supports_extended(reserved):
+        byte, mask = EXTENSION_PROTOCOL_BIT
+        return len(reserved) == 8 and bool(reserved[byte] & mask)
+
+    @staticmethod
+    def supports_v2(reserved):
+        byte, mask = V2_BIT
+        return len(reserved) == 8 and bool(reserved[byte] & mask)
+
+    @staticmethod
+    def build_extended(ext_id, payload):
+        return EXTENDED_HEADER.pack(len(payload) + 2, EXTENDED, ext_id) + payload
+
+    @staticmethod
+    def build_compact_peers(addresses):
+        return b''.join(socket.inet_aton(ip) + COMPACT_PORT.pack(port) for ip, port in addresses)
+
+    @staticmethod
+    def parse_compact_peers(data):
+        peers = []
+        for i in range(0, len(data) - len(data) % 6, 6):
+            ip = socket.inet_ntoa(data[i:i + 4])
+            port, = COMPACT_PORT.unpack_from(data, i + 4)
+            peers.append((ip, port))
+        return peers
+
+    @staticmethod
+    def build_have_all():
+        return _STATIC_MESSAGES[HAVE_ALL]
+
+    @staticmethod
+    def build_have_none():
+        return _STATIC_MESSAGES[HAVE_NONE]
+
+    @staticmethod
+    def build_reject(index, begin, length):
+        return BLOCK_MESSAGE.pack(13, REJECT_REQUEST, index, begin, length)
+
+    @staticmethod
+    def build_allowed_fast(index):
+        return INDEX_MESSAGE.pack(5, ALLOWED_FAST, index)
+
+    @staticmethod
+    def allowed_fast_set(ip, info_hash, num_pieces, k):
+        """
+        Canonical BEP 6 allowed-fast set for an IPv4 peer.
+        Both sides can compute it, so the set is stable across reconnects.
+        """
+        k = min(k, num_pieces)
+        allowed = []
+        x = bytes(a & b for a, b in zip(socket.inet_aton(ip), b'\xff\xff\xff\x00')) + info_hash
+        while len(allowed) < k:
+            x = hashlib.sha1(x).digest()
+            for i in range(0, 20, 4):
+                if len(allowed) >= k:
+                    break
+                index, = INDEX_PAYLOAD.unpack_from(x, i)
+                index %= num_pieces
+                if index not in allowed:
+                    allowed.append(index)
+        return allowed
+
     @staticmethod
     def build_piece(index, begin, length):
-        payload = (
-                index.to_bytes(4, 'big') +
-                begin.to_bytes(4, 'big') +
-                length.to_bytes(4, 'big')
-        )
-        return len(payload + b'\x06').to_bytes(4, 'big') + b'\x06' + payload
+        """Request message for one block (ID 6)."""
+        return BLOCK_MESSAGE.pack(13, REQUEST, index, begin, length)
+
+    @staticmethod
+    def build_requests(index, piece_size, block_size):
+        """
+        Requests for every block of a piece, packed into one reusable per-thread buffer.
+        The returned memoryview is only valid until the next build_requests call on this thread.
+        """
+        count = (piece_size + block_size - 1) // block_size
+        size = BLOCK_MESSAGE.size
+        buf = _scratch_buffer(count * size)
+        pack_into = BLOCK_MESSAGE.pack_into
+        for n, begin in enumerate(range(0, piece_size, block_size)):
+            pack_into(buf, n * size, 13, REQUEST, index, begin, min(block_size, piece_size - begin))
+        return memoryview(buf)[:count * size]
 
     @staticmethod
     def build_response(index, begin, block):
-        payload = (
-                index.to_bytes(4, 'big') +
-                begin.to_bytes(4, 'big') +
-                block
-        )
-        return len(payload + b'\x07').to_bytes(4, 'big') + b'\x07' + payload
+        return PIECE_HEADER.pack(9 + len(block), PIECE, index, begin) + block
+
+    @staticmethod
+    def build_response_frame(index, begin, length):
+        """
+        Piece message with the header packed into a reusable per-thread buffer.
+        Returns (frame, block): fill `block` (e.g. with readinto) and send `frame`.
+        Both views are only valid until the next build_* call on this thread.
+        """
+        if not 0 < length <= MAX_REQUEST_LENGTH:
+            raise ValueError(f"Block length {length} out of range")  # Would grow the scratch buffer for good
+        header = PIECE_HEADER.size
+        buf = _scratch_buffer(header + length)
+        PIECE_HEADER.pack_into(buf, 0, 9 + length, PIECE, index, begin)
+        frame = memoryview(buf)[:header + length]
+        return frame, frame[header:]
+
+    @staticmethod
+    def build_hash_request(pieces_root, base_layer, index, length, proof_layers=0):
+        return HASH_MESSAGE.pack(49, HASH_REQUEST, pieces_root, base_layer, index, length, proof_layers)
+
+    @staticmethod
+    def build_hash_reject(pieces_root, base_layer, index, length, proof_layers):
+        return HASH_MESSAGE.pack(49, HASH_REJECT, pieces_root, base_layer, index, length, proof_layers)
+
+    @staticmethod
+    def build_hashes(pieces_root, base_layer, index, length, proof_layers, hashes):
+        """Hashes message: the requested hashes followed by their uncle hashes, lowest layer first."""
+        return HASH_MESSAGE.pack(49 + len(hashes), HASHES, pieces_root, base_layer, index, length,
+                                 proof_layers) + hashes
+
+    @staticmethod
+    def parse_hash_request(payload):
+        """Payload of hash request / hash reject → (pieces root, base layer, index, length, proof layers)."""
+        return HASH_PAYLOAD.unpack(payload)
+
+    @staticmethod
+    def parse_hashes(payload):
+        """Payload of hashes → (pieces root, base layer, index, length, proof layers, hashes) without copying."""
+        return HASH_PAYLOAD.unpack_from(payload) + (memoryview(payload)[HASH_PAYLOAD.size:],)
+
+    @staticmethod
+    def build_bitfield(bitfield):
+        bits = bytearray((len(bitfield) + 7) // 8)
+        for i, has in enumerate(bitfield):
+            if has:
+                bits[i >> 3] |= 0x80 >> (i & 7)
+        return HEADER.pack(len(bits) + 1, BITFIELD) + bits
 
     @staticmethod
     def parse_bitfield(bitfield_bytes: bytes, num_pieces: int) -> list[bool]:
         bitfield = []
+        extend = bitfield.extend
         for byte in bitfield_bytes:
-            for i in range(8):
-                bit = (byte >> (7 - i)) & 1
-                bitfield.append(bool(bit))
+            extend(_BYTE_BITS[byte])
         return bitfield[:num_pieces]  # Trim any padding
 
     @staticmethod
-    def parse_message(sock):
-        header = sock.recv(4)
+    def parse_index(payload):
+        """Payload of have / allowed fast / suggest → piece index."""
+        return INDEX_PAYLOAD.unpack(payload)[0]
+
+    @staticmethod
+    def parse_block(payload):
+        """Payload of request / cancel / reject → (index, begin, length)."""
+        return BLOCK_PAYLOAD.unpack(payload)
+
+    @staticmethod
+    def parse_piece(payload):
+        """Payload of piece → (index, begin, block) without copying the block."""
+        index, begin = PIECE_PAYLOAD.unpack_from(payload)
+        return index, begin, memoryview(payload)[8:]
+
+    @staticmethod
+    def parse_message(sock, max_length=MAX_MESSAGE_LENGTH):
+        """
+        Read one message → (ID, payload), or (None, None) if the peer closed.
+
+        :param max_length: Longest message accepted; a longer length prefix raises
+                           ValueError before anything is allocated for it
+        """
+        header = _recv_exact(sock, 4)
         if len(header) < 4:
             return None, None
 
-        length = int.from_bytes(header, 'big')
+        length, = LENGTH.unpack(header)
         if length == 0:
-            return -1, b''
+            return KEEP_ALIVE, b''
+        if length > max_length:
+            raise ValueError(f"Message of {length} bytes exceeds the limit of {max_length}")
 
-        msg_id = sock.recv(1)
-        if len(msg_id) < 1:
+        # ID and payload in a single read
+        body = _recv_exact(sock, length)
+        if len(body) < length:
             return None, None
 
-        to_read = length - 1
-        payload = sock.recv(to_read) if to_read > 0 else b''
-
-        return int.from_bytes(msg_id, 'big'), payload
+        return body[0], body[1:]
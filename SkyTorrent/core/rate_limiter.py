@@ -0,0 +1,89 @@
+# rate_limiter.py
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter measured in bytes per second.
+
+    Buckets can be chained (per-peer → per-torrent → global): consume() takes
+    tokens from this bucket and then from each parent. Waiters are served in
+    arrival order, so peers sharing a bucket get its bandwidth in turn instead
+    of whoever polls fastest.
+    """
+
+    def __init__(self, rate=0, burst=None, parent=None):
+        """
+        :param rate: Bytes per second, 0 for unlimited
+        :param burst: Bucket capacity in bytes (defaults to one second of traffic)
+        :param parent: Enclosing bucket that must also grant every consume()
+        """
+        self.parent = parent
+        self.condition = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        self.rate = 0
+        self.burst = 0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        """Change the limit at runtime. Waiting consumers pick it up immediately."""
+        with self.condition:
+            self._refill()
+            self.rate = max(0, rate)
+            self.burst = burst if burst is not None else max(self.rate, 1)
+            self.tokens = min(self.tokens, self.burst)
+            self.condition.notify_all()
+
+    def consume(self, amount):
+        """Block until `amount` bytes may be sent by this bucket and all its parents."""
+        self._take(amount)
+        if self.parent is not None:
+            self.parent.consume(amount)
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _take(self, amount):
+        with self.condition:
+            if not self.rate:
+                return
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            try:
+                while True:
+                    if ticket == self.serving:
+                        if not self.rate:
+                            return
+                        self._refill()
+                        # Amounts above the burst size are granted once the bucket is full and
+                        # paid back as debt, so a single large block can't stall forever.
+                        needed = min(amount, self.burst)
+                        if self.tokens >= needed:
+                            self.tokens -= amount
+                            return
+                        self.condition.wait((needed - self.tokens) / self.rate)
+                    else:
+                        self.condition.wait()
+            finally:
+                self.serving += 1
+                self.condition.notify_all()
+
+
+# Process-wide limits shared by every torrent
+GLOBAL_UPLOAD_LIMITER = TokenBucket()
+GLOBAL_DOWNLOAD_LIMITER = TokenBucket()
+
+
+def set_global_limits(upload=None, download=None):
+    """Set the process-wide limits in bytes per second (0 = unlimited, None = unchanged)."""
+    if upload is not None:
+        GLOBAL_UPLOAD_LIMITER.set_rate(upload)
+    if download is not None:
+        GLOBAL_DOWNLOAD_LIMITER.set_rate(download)
@@ -0,0 +1,260 @@
+# session.py
+# Many torrents behind one listening socket, sharing connection, upload-slot,
+# cache, disk and bandwidth budgets.
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from SkyTorrent.core.event_log import EVENT_LOG
+from SkyTorrent.core.peer_score import EVICT_INTERVAL
+from SkyTorrent.core.protocolmessage import ProtocolMessage
+from SkyTorrent.core.rate_limiter import TokenBucket, GLOBAL_UPLOAD_LIMITER, GLOBAL_DOWNLOAD_LIMITER
+from SkyTorrent.core.stats import StatsServer
+from SkyTorrent.core.timer_wheel import TimerWheel
+
+try:
+    import miniupnpc
+except ImportError:
+    miniupnpc = None
+
+DEFAULT_MAX_CONNECTIONS = 200
+DEFAULT_UPLOAD_SLOTS = 4
+DEFAULT_CACHE_SIZE = 16 * 1024 * 1024  # Bytes of recently served blocks kept in memory
+DEFAULT_DISK_WORKERS = 2
+SEND_WORKERS = 4  # threads sending keep-alives and PEX for the timer wheel
+HANDSHAKE_TIMEOUT = 10  # seconds an incoming connection gets to say which torrent it wants
+
+
+class BlockCache:
+    """Least-recently-used blocks, bounded in bytes, shared by every torrent of a session."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.size = 0
+        self.blocks = OrderedDict()  # (info_hash, index, begin, length) → bytes
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is not None:
+                self.blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block):
+        if len(block) > self.capacity:
+            return
+        block = bytes(block)  # Callers may pass a view of a buffer they reuse
+        with self.lock:
+            old = self.blocks.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.blocks[key] = block
+            self.size += len(block)
+            while self.size > self.capacity:
+                _, evicted = self.blocks.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard_torrent(self, info_hash):
+        with self.lock:
+            for key in [k for k in self.blocks if k[0] == info_hash]:
+                self.size -= len(self.blocks.pop(key))
+
+
+class Session:
+    """
+    Owns the one listening socket of the client and routes each incoming
+    handshake to the TorrentPeer registered for its info_hash. Torrents share
+    the session's timer wheel, upload slots, connection budget, block cache,
+    disk writer pool and rate limits, so adding a torrent adds no port and no
+    listener thread.
+    """
+
+    def __init__(self, peer_id, listen_port=6881, backlog=50, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 upload_slots=DEFAULT_UPLOAD_SLOTS, cache_size=DEFAULT_CACHE_SIZE, disk_workers=DEFAULT_DISK_WORKERS,
+                 upload_rate=0, download_rate=0, stats_port=None):
+        """
+        :param peer_id: 20-byte unique ID for this client, used by every torrent
+        :param max_connections: Peer connections open at once across all torrents
+        :param upload_slots: Peers unchoked at once across all torrents
+        :param cache_size: Bytes of served blocks cached for other peers asking for the same data
+        :param disk_workers: Threads writing verified pieces to disk
+        :param upload_rate: Session-wide upload limit in bytes/s (0 = unlimited)
+        :param download_rate: Session-wide download limit in bytes/s (0 = unlimited)
+        :param stats_port: Local port serving snapshot() as JSON (None = no endpoint)
+        """
+        self.peer_id = peer_id
+        self.listen_port = listen_port
+        self.backlog = backlog
+        self.torrents = {}  # info_hash → TorrentPeer
+        self.lock = threading.Lock()
+
+        self.max_connections = max_connections
+        self.connections = 0
+        self.last_eviction = 0.0
+        self.upload_slots = threading.Semaphore(upload_slots)
+        self.block_cache = BlockCache(cache_size)
+        self.disk_pool = ThreadPoolExecutor(disk_workers, thread_name_prefix='disk')
+        self.timers = TimerWheel()  # Keep-alives, idle disconnects, request timeouts and PEX of every torrent
+        self.send_pool = ThreadPoolExecutor(SEND_WORKERS, thread_name_prefix='send')  # Timer sends, off the wheel
+        self.upload_limiter = TokenBucket(upload_rate, parent=GLOBAL_UPLOAD_LIMITER)
+        self.download_limiter = TokenBucket(download_rate, parent=GLOBAL_DOWNLOAD_LIMITER)
+
+        self.stats_port = stats_port
+        self.stats_server = None
+
+        self.running = False
+        self.server_sock = None
+        self.threads = []
+
+    def add(self, torrent):
+        """Register a TorrentPeer so incoming connections for its info_hash reach it."""
+        with self.lock:
+            if torrent.info_hash in self.torrents:
+                raise ValueError(f"Torrent {torrent.info_hash.hex()} is already in this session")
+            self.torrents[torrent.info_hash] = torrent
+
+    def remove(self, torrent):
+        with self.lock:
+            if self.torrents.get(torrent.info_hash) is torrent:
+                del self.torrents[torrent.info_hash]
+        self.block_cache.discard_torrent(torrent.info_hash)
+
+    def start(self):
+        """Start listening. Safe to call more than once."""
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+        self.timers.start()
+        self.server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server_sock.bind(('', self.listen_port))
+        self.server_sock.listen(self.backlog)
+        self.server_sock.settimeout(1)  # Wake up now and then to notice stop()
+        if self.stats_port is not None:
+            self.stats_server = StatsServer(self, self.stats_port)
+            self.stats_server.start()
+        for target in (self.listen_for_incoming_peers, self.try_upnp_port_forwarding):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        for torrent in list(self.torrents.values()):
+            torrent.stop()
+        self.disk_pool.shutdown(wait=True)
+        self.timers.stop()
+        self.send_pool.shutdown(wait=True)
+        if self.server_sock is not None:
+            self.server_sock.close()
+        if self.stats_server is not None:
+            self.stats_server.stop()
+
+    def reserve_connection(self, evict=False, force=False):
+        """
+        Take one connection from the session budget. When it is used up and
+        `evict` is set, make room by disconnecting the least valuable peer of
+        any torrent. Returns False if there is no room.
+
+        :param force: Count the connection even over budget, because a peer
+                      evicted for it is about to give its slot back
+        """
+        with self.lock:
+            if force or self.connections < self.max_connections:
+                self.connections += 1
+                return True
+        if not evict or not self.evict_peer():
+            return False
+        with self.lock:
+            self.connections += 1  # The evicted connection gives its slot back when its thread ends
+        return True
+
+    def release_connection(self):
+        with self.lock:
+            self.connections -= 1
+
+    def snapshot(self, peers=True):
+        """Statistics of every torrent in the session, as a plain dict (see TorrentPeer.snapshot)."""
+        with self.lock:
+            torrents = list(self.torrents.values())
+            connections = self.connections
+        return dict(connections=connections, max_connections=self.max_connections,
+                    torrents=[torrent.snapshot(peers) for torrent in torrents])
+
+    def evict_peer(self):
+        """Disconnect the least valuable evictable peer across all torrents. Returns False if there was none."""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_eviction < EVICT_INTERVAL:
+                return False
+            torrents = list(self.torrents.values())
+        worst = None
+        for torrent in torrents:
+            candidate = torrent.eviction_candidate(now)
+            if candidate is not None and (worst is None or candidate[0] < worst[0]):
+                worst = candidate + (torrent,)
+        if worst is None:
+            return False
+        value, sock, torrent = worst
+        with self.lock:
+            self.last_eviction = now
+        torrent.evict(sock, value)
+        return True
+
+    def listen_for_incoming_peers(self):
+        """Accept connections for every torrent on the session's port."""
+        EVENT_LOG.info("[*] Listening for incoming peers on port %s", self.listen_port)
+        while self.running:
+            try:
+                conn, addr = self.server_sock.accept()
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if self.running:
+                    EVENT_LOG.warning("[!] Error accepting connection: %s", e)
+                continue
+            if not self.reserve_connection(evict=True):
+                EVENT_LOG.warning("[!] Connection limit reached. Refusing %s", addr)
+                conn.close()
+                continue
+            EVENT_LOG.info("[+] Accepted connection from %s", addr)
+            threading.Thread(target=self._route, args=(conn, addr), daemon=True).start()
+
+    def _route(self, conn, addr):
+        """Read the handshake and hand the connection to the torrent it names."""
+        torrent = None
+        try:
+            conn.settimeout(HANDSHAKE_TIMEOUT)
+            handshake = ProtocolMessage.receive_handshake(conn)
+            if handshake is not None:
+                info_hash, peer_id, reserved = handshake
+                torrent = self.torrents.get(info_hash)
+                if torrent is None:
+                    EVENT_LOG.warning("[!] %s asked for unknown torrent %s", addr, info_hash.hex())
+                elif torrent.accept_connection(conn, peer_id, reserved):
+                    return  # The torrent now owns the reservation
+            else:
+                EVENT_LOG.warning("[!] Invalid handshake from %s", addr)
+        except OSError as e:
+            EVENT_LOG.warning("[!] Handshake from %s failed: %s", addr, e)
+        conn.close()
+        self.release_connection()
+
+    def try_upnp_port_forwarding(self):
+        """Attempt to use UPnP to open the session port on the router."""
+        if miniupnpc is None:
+            EVENT_LOG.warning("[!] miniupnpc not available. Skipping UPnP port forwarding.")
+            return
+
+        try:
+            upnp = miniupnpc.UPnP()
+            upnp.discoverdelay = 200
+            upnp.discover()
+            upnp.selectigd()
+            upnp.addportmapping(self.listen_port, 'TCP', upnp.lanaddr, self.listen_port, 'BitTorrentClient', '')
+            EVENT_LOG.info("[+] UPnP port %s forwarded successfully!", self.listen_port)
+        except Exception as e:
+            EVENT_LOG.warning("[!] UPnP port forwarding failed: %s", e)
@@ -0,0 +1,214 @@
+# stats.py
+# Transfer statistics of running torrents: per connection and per torrent,
+# snapshotted on demand for the GUI, the command line or a local HTTP endpoint.
+#
+#   python -m SkyTorrent.core.stats [--port 6880] [--interval 2]
+import argparse
+import io
+import json
+import math
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from SkyTorrent.core.event_log import EVENT_LOG
+from SkyTorrent.core.peer_score import PeerScore, RATE_WINDOW
+
+DEFAULT_STATS_PORT = 6880
+RTT_WEIGHT = 0.125  # weight of a new sample in the smoothed round-trip time, as in TCP
+
+
+class PeerStats(PeerScore):
+    """
+    Counters of one connection. Only the connection's own thread updates them,
+    so updates take no lock; snapshot() reads them from any thread and may be
+    a block behind.
+    """
+    __slots__ = ('address', 'bytes_down', 'bytes_up', 'rtt', 'outstanding', 'request_sent_at')
+
+    def __init__(self, address, failures=0, now=None):
+        """
+        :param address: (ip, port) of the remote end
+        :param failures: Failures already held against the peer's address from earlier connections
+        """
+        super().__init__(failures, now)
+        self.address = address
+        self.bytes_down = 0
+        self.bytes_up = 0
+        self.rtt = None  # Smoothed seconds from sending requests to the first block back
+        self.outstanding = 0  # Block requests sent and not yet answered
+        self.request_sent_at = None
+
+    def requests_sent(self, count, now=None):
+        if self.request_sent_at is None:
+            self.request_sent_at = time.monotonic() if now is None else now
+        self.outstanding += count
+
+    def request_rejected(self):
+        self.outstanding = max(0, self.outstanding - 1)
+
+    def requests_abandoned(self):
+        self.outstanding = 0
+        self.request_sent_at = None
+
+    def add_download(self, n, now=None):
+        now = time.monotonic() if now is None else now
+        super().add_download(n, now)
+        self.bytes_down += n
+        self.outstanding = max(0, self.outstanding - 1)
+        if self.request_sent_at is not None:
+            sample = now - self.request_sent_at
+            self.rtt = sample if self.rtt is None else self.rtt + RTT_WEIGHT * (sample - self.rtt)
+            self.request_sent_at = None  # Later blocks of the batch only show the transfer rate
+
+    def add_upload(self, n, now=None):
+        super().add_upload(n, now)
+        self.bytes_up += n
+
+    def snapshot(self, now=None, **state):
+        """Plain dict of the counters, plus whatever connection `state` the caller adds."""
+        now = time.monotonic() if now is None else now
+        return dict(address=f"{self.address[0]}:{self.address[1]}", connected=round(now - self.connected_at, 1),
+                    downloaded=self.bytes_down, uploaded=self.bytes_up,
+                    download_rate=round(self.download_rate(now)), upload_rate=round(self.upload_rate(now)),
+                    rtt=None if self.rtt is None else round(self.rtt, 4), outstanding=self.outstanding,
+                    failures=self.failures, **state)
+
+
+class TorrentStats:
+    """
+    What a torrent keeps beyond its live connections: totals of closed
+    connections and the rate at which pieces complete. Totals of live
+    connections are summed in at snapshot time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.downloaded = 0  # Bytes of connections that have closed
+        self.uploaded = 0
+        self.pieces_completed = 0
+        self.recent_pieces = 0.0  # Pieces completed, decayed over RATE_WINDOW
+        self.updated = self.started
+
+    def retire(self, peer):
+        """Fold the totals of a closed connection in."""
+        with self.lock:
+            self.downloaded += peer.bytes_down
+            self.uploaded += peer.bytes_up
+
+    def piece_completed(self, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._decay(now)
+            self.pieces_completed += 1
+            self.recent_pieces += 1
+
+    def piece_rate(self, now=None):
+        """Pieces completed per second, smoothed."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self._decay(now)
+            return self.recent_pieces / RATE_WINDOW
+
+    def _decay(self, now):
+        if now > self.updated:
+            self.recent_pieces *= math.exp((self.updated - now) / RATE_WINDOW)
+            self.updated = now
+
+
+def eta(left, rate):
+    """Seconds to fetch `left` bytes at `rate` bytes/s; None while nothing is coming in."""
+    if left == 0:
+        return 0
+    if rate <= 0:
+        return None
+    return round(left / rate)
+
+
+class StatsServer:
+    """
+    Serves session.snapshot() as JSON on a local port:
+    /stats for everything, /stats/torrents without the per-peer lists.
+    /events dumps the event log ring as text.
+    """
+
+    def __init__(self, session, port=DEFAULT_STATS_PORT, host='127.0.0.1'):
+        self.session = session
+        handler = type('StatsHandler', (_StatsHandler,), {'session': session})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        EVENT_LOG.info("[*] Statistics on http://%s:%s/stats", *self.httpd.server_address[:2])
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _StatsHandler(BaseHTTPRequestHandler):
+    session = None
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/events':
+            text = io.StringIO()
+            EVENT_LOG.dump(text)
+            body, content_type = text.getvalue().encode(), 'text/plain; charset=utf-8'
+        elif path in ('/stats', '/stats/torrents'):
+            body = json.dumps(self.session.snapshot(peers=path == '/stats')).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Polled every second or two; don't flood the console
+
+
+def format_rate(rate):
+    for unit in ('B/s', 'KiB/s', 'MiB/s'):
+        if rate < 1024 or unit == 'MiB/s':
+            return f"{rate:.0f} {unit}" if unit == 'B/s' else f"{rate:.1f} {unit}"
+        rate /= 1024
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return '∞'
+    hours, rest = divmod(int(seconds), 3600)
+    return f"{hours}:{rest // 60:02}:{rest % 60:02}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the statistics of a running SkyTorrent session.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=DEFAULT_STATS_PORT)
+    parser.add_argument("--interval", type=float, default=2, help="Seconds between polls (0 = poll once)")
+    args = parser.parse_args()
+
+    url = f"http://{args.host}:{args.port}/stats/torrents"
+    while True:
+        with urllib.request.urlopen(url) as response:
+            snapshot = json.load(response)
+        print(f"[*] {snapshot['connections']}/{snapshot['max_connections']} connections")
+        for t in snapshot['torrents']:
+            print(f"    {t['name']}: {t['pieces_done']}/{t['num_pieces']} pieces, "
+                  f"↓ {format_rate(t['download_rate'])} ↑ {format_rate(t['upload_rate'])}, "
+                  f"{t['connections']} peers, ETA {format_eta(t['eta'])}")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
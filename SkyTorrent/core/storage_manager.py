@@ -2,16 +2,18 @@
 import os
 import hashlib
 import threading
+from SkyTorrent.utils import merkle
 
 
-# TO DO : THREAD SAFETY
 class StorageManager:
-    def __init__(self, filepath, total_length, piece_length, piece_hashes):
+    def __init__(self, filepath, total_length, piece_length, piece_hashes, pieces_root=None, piece_layer=None):
         """
         :param filepath: Path to the file (from .torrent info['name'])
         :param total_length: Total file size
         :param piece_length: Piece size (usually 256 KB or similar)
-        :param piece_hashes: Concatenated SHA-1 hashes (b''.join(...)) of all pieces
+        :param piece_hashes: Concatenated SHA-1 hashes (b''.join(...)) of all pieces; b'' for a v2-only torrent
+        :param pieces_root: v2 merkle root of the file; pieces are then verified with SHA-256 trees
+        :param piece_layer: v2 piece layer of the file (omitted in the torrent for files of one piece)
         """
         self.filepath = filepath
         self.total_length = total_length
@@ -19,11 +21,25 @@ class StorageManager:
         self.piece_hashes = [piece_hashes[i:i + 20] for i in range(0, len(piece_hashes), 20)]
         self.num_pieces = len(self.piece_hashes)
 
+        self.pieces_root = pieces_root
+        if pieces_root is not None:
+            self.num_pieces = -(-total_length // piece_length)
+            self.piece_roots = merkle.split_hashes(piece_layer) if piece_layer else [pieces_root]
+            if len(self.piece_roots) != self.num_pieces or \
+                    merkle.file_root(self.piece_roots, total_length, piece_length) != pieces_root:
+                raise ValueError("Piece layer does not match the file's pieces root")
+            self.leaf_width = merkle.leaf_width(total_length, piece_length)  # Leaves under one piece
+            self.piece_level = merkle.log2(self.leaf_width)
+            # Tree from the piece layer up; layers below it are rebuilt from piece data on demand
+            self.upper_layers = merkle.merkle_layers(self.piece_roots, merkle.next_power_of_two(self.num_pieces),
+                                                     self.piece_level)
+
         # Ensure the file exists (create if missing)
         self._prepare_file()
 
         # Open the file for read/write in binary mode
         self.file = open(self.filepath, 'r+b')
+        self.io_lock = threading.Lock()  # seek + read/write pairs from upload threads and the disk pool
 
         # Build bitfield (True for valid pieces, False for missing or invalid)
         self.bitfield = self._build_bitfield()
@@ -47,9 +63,7 @@ class StorageManager:
             for i in range(self.num_pieces):
                 f.seek(i * self.piece_length)
                 data = f.read(self.piece_length)
-                expected_hash = self.piece_hashes[i]
-                actual_hash = hashlib.sha1(data).digest()
-                bitfield.append(actual_hash == expected_hash)
+                bitfield.append(self.validate_piece_data(i, data))
         print(f"[+] Bitfield built: {bitfield.count(True)} / {self.num_pieces} pieces valid.")
         return bitfield
 
@@ -58,33 +72,90 @@ class StorageManager:
             raise ValueError(f"Data too large for piece {index} (expected ≤ {self.piece_length}, got {len(data)})")
 
         offset = index * self.piece_length
-        self.file.seek(offset)
-        self.file.write(data)
-        self.file.flush()  # ← flush buffer
-        os.fsync(self.file.fileno())  # ← force write to disk
+        with self.io_lock:
+            self.file.seek(offset)
+            self.file.write(data)
+            self.file.flush()  # ← flush buffer
+        os.fsync(self.file.fileno())  # ← force write to disk, without holding up readers
 
     def read_block(self, index, begin, length):
         offset = index * self.piece_length + begin
-        self.file.seek(offset)
-        return self.file.read(length)
+        with self.io_lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def read_block_into(self, index, begin, buffer):
+        """Read a block directly into a writable buffer. Returns the number of bytes read."""
+        offset = index * self.piece_length + begin
+        with self.io_lock:
+            self.file.seek(offset)
+            return self.file.readinto(buffer)
 
     def validate_piece_data(self, index, data):
         """
-        Validate that the given piece data matches the expected SHA-1 hash.
+        Validate that the given piece data matches the expected SHA-1 hash
+        (or, for v2 torrents, the piece layer hash of its merkle subtree).
         Used before writing the piece to disk.
         """
+        if self.pieces_root is not None:
+            return self.verify_leaves(index, merkle.hash_blocks(data))
         expected_hash = self.piece_hashes[index]
         actual_hash = hashlib.sha1(data).digest()
         return actual_hash == expected_hash
 
+    def verify_leaves(self, index, leaf_hashes):
+        """v2: whether concatenated 16 KiB leaf hashes of a piece hash up to its piece layer entry."""
+        leaves = merkle.split_hashes(leaf_hashes)
+        if len(leaves) > self.leaf_width:
+            return False
+        return merkle.merkle_root(leaves, self.leaf_width) == self.piece_roots[index]
+
+    def get_hashes(self, base_layer, index, length, proof_layers):
+        """
+        v2: answer a hash request for this file's tree, or None to reject it.
+        Hashes at or above the piece layer come from the piece layer; lower
+        ones are rebuilt from one piece we have on disk.
+
+        :return: Concatenated hashes followed by up to `proof_layers` uncle hashes, lowest first
+        """
+        top = self.piece_level + len(self.upper_layers) - 1
+        if length < 1 or length & (length - 1) or index % length or base_layer > top:
+            return None
+        range_level = base_layer + merkle.log2(length)
+        if range_level > top:
+            return None
+
+        lower = None
+        if base_layer < self.piece_level:
+            if range_level > self.piece_level:
+                return None  # Would need several pieces read from disk
+            piece = (index << base_layer) // self.leaf_width
+            if piece >= self.num_pieces or not self.bitfield[piece]:
+                return None
+            data = self.read_block(piece, 0, min(self.piece_length, self.total_length - piece * self.piece_length))
+            lower = merkle.merkle_layers(merkle.split_hashes(merkle.hash_blocks(data)), self.leaf_width)
+
+        def node(level, i):
+            if level >= self.piece_level:
+                layer = self.upper_layers[level - self.piece_level]
+                return layer[i] if i < len(layer) else None
+            return lower[level][i - piece * (self.leaf_width >> level)]
+
+        hashes = [node(base_layer, i) for i in range(index, index + length)]
+        if None in hashes:
+            return None
+        position = index >> (range_level - base_layer)
+        for level in range(range_level, min(top, range_level + proof_layers)):
+            hashes.append(node(level, position ^ 1))
+            position >>= 1
+        return b''.join(hashes)
+
     def get_needed_piece(self, peer_bitfield):
         with self.lock:
             for index, their_has in enumerate(peer_bitfield):
                 if their_has and not self.bitfield[index] and index not in self.requested_pieces:
                     self.requested_pieces.add(index)
                     return index
-            print(self.bitfield)
-            print(self.requested_pieces)
         return None  # Nothing useful to request
 
     def request_piece(self, index):
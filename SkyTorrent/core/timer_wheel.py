@@ -0,0 +1,93 @@
+# timer_wheel.py
+import threading
+import time
+from SkyTorrent.core.event_log import EVENT_LOG
+
+
+class Timer:
+    __slots__ = ('callback', 'args', 'rounds', 'slot', 'cancelled')
+
+    def __init__(self, callback, args, rounds, slot):
+        self.callback = callback
+        self.args = args
+        self.rounds = rounds  # Full wheel revolutions left before it fires
+        self.slot = slot
+        self.cancelled = False
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel: scheduling and cancelling a timer are O(1), and each
+    tick only visits the timers hashed into the current slot.
+
+    Callbacks run on the wheel thread, so they must be short and must not block.
+    """
+
+    def __init__(self, tick=0.5, num_slots=512):
+        """
+        :param tick: Wheel resolution in seconds
+        :param num_slots: Number of slots; delays beyond tick * num_slots take extra rounds
+        """
+        self.tick = tick
+        self.num_slots = num_slots
+        self.slots = [dict() for _ in range(num_slots)]  # Timer → None, insertion ordered
+        self.current = 0
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def schedule(self, delay, callback, *args):
+        """Run callback(*args) after roughly `delay` seconds. Returns a handle for cancel()."""
+        ticks = max(1, int(round(delay / self.tick)))
+        with self.lock:
+            slot = (self.current + ticks) % self.num_slots
+            timer = Timer(callback, args, (ticks - 1) // self.num_slots, slot)
+            self.slots[slot][timer] = None
+        return timer
+
+    def cancel(self, timer):
+        if timer is None:
+            return
+        with self.lock:
+            timer.cancelled = True
+            self.slots[timer.slot].pop(timer, None)
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _advance(self):
+        due = []
+        with self.lock:
+            self.current = (self.current + 1) % self.num_slots
+            slot = self.slots[self.current]
+            for timer in list(slot):
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                else:
+                    del slot[timer]
+                    due.append(timer)
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                EVENT_LOG.warning("[!] Timer callback %s failed: %s",
+                                  getattr(timer.callback, '__name__', timer.callback), e)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.tick
+        while self.running:
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._advance()
+            next_tick += self.tick
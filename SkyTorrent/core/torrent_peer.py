@@ -1,32 +1,67 @@
 # torrent_peer.py
 
+import os
+import queue
 import socket
+import struct
 import threading
 import time
 import urllib.parse
 import urllib.request
-import bencodepy
-from SkyTorrent.core.protocolmessage import ProtocolMessage
+from collections import OrderedDict
+from SkyTorrent.utils import bencode
+from SkyTorrent.core.protocolmessage import (
+    ProtocolMessage, KEEP_ALIVE, CHOKE, UNCHOKE, INTERESTED, NOT_INTERESTED, HAVE, BITFIELD, REQUEST, PIECE,
+    SUGGEST_PIECE, HAVE_ALL, HAVE_NONE, REJECT_REQUEST, ALLOWED_FAST, EXTENDED, EXTENDED_HANDSHAKE,
+    HASH_REQUEST, HASHES, HASH_REJECT, MAX_REQUEST_LENGTH, MAX_MESSAGE_LENGTH
+)
+from SkyTorrent.core.event_log import EVENT_LOG
+from SkyTorrent.core.peer_score import EVICT_INTERVAL
 from SkyTorrent.core.piece import Piece
+from SkyTorrent.core.rate_limiter import TokenBucket
+from SkyTorrent.core.session import Session
+from SkyTorrent.core.stats import PeerStats, TorrentStats, eta
 from SkyTorrent.encrypted_socket import EncryptedSocket
-
-try:
-    import miniupnpc
-except ImportError:
-    miniupnpc = None
+from SkyTorrent.tracker.udp_tracker import UDPTrackerClient
 
 UPLOAD_SLOT_LIMIT = 4
 BLOCK_SIZE = 2 ** 14
+ALLOWED_FAST_COUNT = 10  # BEP 6 recommends 10
+UT_PEX_ID = 1  # Our local extended message ID for ut_pex (BEP 11)
+PEX_INTERVAL = 60  # seconds between PEX messages to the same peer
+PEX_MAX_PEERS = 50  # added/dropped entries per PEX message
+CLIENT_VERSION = b'SkyTorrent'
+KEEPALIVE_INTERVAL = 120  # seconds between keep-alives we send
+IDLE_TIMEOUT = 180  # disconnect peers we haven't heard from in this long
+REQUEST_TIMEOUT = 60  # abandon a piece (and mark the peer snubbed) after this long without a block
+UNCHOKE_TIMEOUT = 30  # disconnect a peer that keeps us choked this long while we wait on it
+SEND_TIMEOUT = 30  # drop a peer whose receive window stays full this long while we send to it
+MAX_CONNECTIONS_PER_TORRENT = 50
+MAX_QUEUED_CANDIDATES = 500  # addresses waiting for the connection scheduler
+FAILURE_HISTORY_SIZE = 1024  # addresses whose past failures we remember
 
 
 class TorrentPeer:
-    def __init__(self, peer_id, torrent_info, storage_manager, listen_port=6881, backlog=50):
+    def __init__(self, peer_id, torrent_info, storage_manager, listen_port=6881, backlog=50,
+                 upload_rate=0, download_rate=0, peer_upload_rate=0, peer_download_rate=0, session=None,
+                 max_connections=MAX_CONNECTIONS_PER_TORRENT):
         """
         :param peer_id: 20-byte unique ID for this client
         :param torrent_info: Parsed .torrent dict from torrent_parser
         :param storage_manager: Instance of StorageManager
-        :param listen_port: Port to listen on for incoming peers
+        :param listen_port: Port to listen on for incoming peers (without a session)
+        :param upload_rate: Torrent-wide upload limit in bytes/s (0 = unlimited)
+        :param download_rate: Torrent-wide download limit in bytes/s (0 = unlimited)
+        :param peer_upload_rate: Upload limit per connection in bytes/s (0 = unlimited)
+        :param peer_download_rate: Download limit per connection in bytes/s (0 = unlimited)
+        :param session: Session whose listening socket and budgets this torrent shares;
+                        without one the torrent gets a private session on listen_port
+        :param max_connections: Peer connections this torrent keeps open at once; past it the
+                                least valuable peer makes room for a new one
         """
+        if session is None:
+            session = Session(peer_id, listen_port, backlog, upload_slots=UPLOAD_SLOT_LIMIT)
+        self.session = session
         self.peer_id = peer_id
         self.info_hash = torrent_info['info_hash']
         self.tracker_url = torrent_info['announce']
@@ -34,234 +69,432 @@ class TorrentPeer:
         self.piece_length = torrent_info['piece_length']
         self.total_length = torrent_info['length']
         self.piece_hashes = [torrent_info['pieces'][i:i + 20] for i in range(0, len(torrent_info['pieces']), 20)]
-        self.num_pieces = len(self.piece_hashes)
+        self.num_pieces = storage_manager.num_pieces
+        self.max_message_length = max(MAX_MESSAGE_LENGTH, 1 + (self.num_pieces + 7) // 8)  # Room for our bitfield
         self.storage = storage_manager
-        self.listen_port = listen_port
-        self.backlog = backlog
+        self.merkle = storage_manager.pieces_root is not None  # v2: blocks are verified as they arrive
+        self.listen_port = session.listen_port
 
         self.threads = []
         self.pending_pieces = {}  # index - Pieces
-        self.connected_peers = []
+        self.max_connections = max_connections
+        self.connections = 0  # Reserved against max_connections, handshakes in progress included
+        self.connection_lock = threading.Lock()
+        self.last_eviction = 0.0
+        self.peer_stats = {}  # sock → PeerStats (transfer, RTT, score) of every established connection
+        self.stats = TorrentStats()
+        self.failure_history = OrderedDict()  # ip → failures over past connections, oldest first
         self.remote_peer_ids = {}
         self.peer_bitfields = {}
         self.sent_interested = set()  # Peers we’ve sent 'interested' to
-        self.upload_slots = threading.Semaphore(UPLOAD_SLOT_LIMIT)
+        self.upload_slots = session.upload_slots  # Shared by every torrent of the session
         self.choked_peers = set()  # Peers who choked us
+        self.unchoked_peers = set()  # Peers we unchoked (each holds an upload slot)
+        self.fast_peers = set()  # Peers that negotiated the Fast Extension (BEP 6)
+        self.allowed_fast_sent = {}  # sock → pieces they may request while choked
+        self.allowed_fast_received = {}  # sock → pieces we may request while choked
+        self.rejected_pieces = {}  # sock → pieces that peer rejected; we don't ask it for them again
+        self.extended_peers = {}  # sock → their extended message IDs, e.g. {b'ut_pex': 1}
+        self.v2_peers = set()  # Peers that can answer BEP 52 hash requests
+        self.hash_failures = {}  # sock → blocks from that peer that failed their leaf hash
+        self.peer_addresses = {}  # sock → (ip, listen port) of the remote peer
+        self.pex_sent = {}  # sock → addresses last advertised to that peer
+        self.known_addresses = set()  # Addresses already queued or connected
+        self.connect_queue = queue.Queue()  # Candidate (ip, port) for the connection scheduler
+        self.timers = session.timers  # Keep-alives, idle disconnects, request timeouts and PEX
+        self.connection_timers = {}  # sock → {name: Timer}
+        self.last_received = {}  # sock → monotonic time of the last message from that peer
+        self.snubbed_peers = set()  # Peers that stopped sending blocks we requested
+        self.upload_limiter = TokenBucket(upload_rate, parent=session.upload_limiter)
+        self.download_limiter = TokenBucket(download_rate, parent=session.download_limiter)
+        self.peer_upload_rate = peer_upload_rate
+        self.peer_download_rate = peer_download_rate
+        self.peer_upload_limiters = {}  # sock → TokenBucket chained to upload_limiter
+        self.peer_download_limiters = {}  # sock → TokenBucket chained to download_limiter
         self.running = True
 
+        # One dispatch table for both the upload and the download side of a connection
+        self.message_handlers = {
+            KEEP_ALIVE: self._handle_keep_alive,
+            CHOKE: self._handle_choke,
+            UNCHOKE: self._handle_unchoke,
+            INTERESTED: self._handle_interested,
+            NOT_INTERESTED: self._handle_not_interested,
+            HAVE: self._handle_have,
+            BITFIELD: self._handle_bitfield,
+            REQUEST: self._handle_request,
+            PIECE: self._handle_piece,
+            SUGGEST_PIECE: self._handle_suggest,
+            HAVE_ALL: self._handle_have_all,
+            HAVE_NONE: self._handle_have_none,
+            REJECT_REQUEST: self._handle_reject,
+            ALLOWED_FAST: self._handle_allowed_fast,
+            EXTENDED: self._handle_extended,
+            HASH_REQUEST: self._handle_hash_request,
+            HASHES: self._handle_hashes,
+            HASH_REJECT: self._handle_hash_reject,
+        }
+        session.add(self)
+
     def start(self):
-        """Start the torrent session."""
-        server_thread = threading.Thread(target=self.listen_for_incoming_peers, args=())
-        upnp_thread = threading.Thread(target=self.try_upnp_port_forwarding)
+        """Start the torrent (and its session's listener, if it isn't running yet)."""
+        self.session.start()
         tracker_thread = threading.Thread(target=self.announce_to_tracker)
-        server_thread.start()
-        upnp_thread.start()
+        scheduler_thread = threading.Thread(target=self.connection_scheduler, daemon=True)
         tracker_thread.start()
-        self.threads.append(server_thread)
-        self.threads.append(upnp_thread)
+        scheduler_thread.start()
         self.threads.append(tracker_thread)
+        self.threads.append(scheduler_thread)
+
+    def stop(self):
+        """Disconnect every peer and leave the session."""
+        self.running = False
+        self.shutdown_all_peers()
+        self.session.remove(self)
 
     def announce_to_tracker(self):
         try:
-            encoded_info_hash = urllib.parse.quote_from_bytes(self.info_hash)
-            encoded_peer_id = urllib.parse.quote_from_bytes(self.peer_id)
-
-            params = (
-                f"info_hash={encoded_info_hash}"
-                f"&peer_id={encoded_peer_id}"
-                f"&port={self.listen_port}"
-                f"&uploaded=0"
-                f"&downloaded=0"
-                f"&left={self.total_length}"
-                f"&compact=1"
-                f"&event=started"
-            )
-
-            url = f"{self.tracker_url}?{params}"
-            print(f"[*] Announcing to tracker: {url}", flush=True)
-
-            with urllib.request.urlopen(url) as response:
-                response_data = response.read()
-                decoded = bencodepy.decode(response_data)
-
-                if b'peers' in decoded:
-                    peers = decoded[b'peers']
-                    if isinstance(peers, bytes):
-                        for i in range(0, len(peers), 6):
-                            ip = '.'.join(str(b) for b in peers[i:i + 4])
-                            port = int.from_bytes(peers[i + 4:i + 6], 'big')
-
-                            if ip == '127.0.0.1' and port == self.listen_port:
-                                print(f"[-] Skipping self ({ip}:{port})", flush=True)
-                                continue
-
-                            print(f"[+] Tracker returned peer: {ip}:{port}", flush=True)
-
-                            sock = self.connect_to_peer(ip, port)
-                            if sock:
-                                self.send_handshake(sock)
-                                peer_id = self.receive_handshake(sock)
-                                if not peer_id:
-                                    print(f"[!] Invalid handshake from {sock.getpeername()}")
-                                    sock.close()
-                                    return
-                                sock = self.secure_socket(sock, is_initiator=True)
-                                print(f"[+] Started encryption of conversation")
-                                self.remote_peer_ids[sock] = peer_id  # SKYLAY
-                                if peer_id:
-                                    print(f"[+] Handshake completed with {ip}:{port}")
-                                    t = threading.Thread(target=self.handle_peer_connection, args=(sock, False))
-                                    t.start()
-                                    self.threads.append(t)
-                                else:
-                                    print(f"[!] Handshake failed with {ip}:{port}")
-                                    sock.close()
-
-                    else:
-                        print("[!] Non-compact peer format not supported yet.", flush=True)
-                else:
-                    print("[!] No peers in tracker response.", flush=True)
+            if self.tracker_url.startswith('udp://'):
+                peers = self._announce_udp()
+            else:
+                peers = self._announce_http()
+
+            if peers is None:
+                return
+            if not peers:
+                EVENT_LOG.warning("[!] No peers in tracker response.")
+            for ip, port in ProtocolMessage.parse_compact_peers(peers):
+                EVENT_LOG.info("[+] Tracker returned peer: %s:%s", ip, port)
+                self.add_peer_candidate(ip, port)
 
         except Exception as e:
-            print(f"[!] Tracker communication failed: {e}", flush=True)
+            EVENT_LOG.warning("[!] Tracker communication failed: %s", e)
+
+    def _announce_http(self):
+        encoded_info_hash = urllib.parse.quote_from_bytes(self.info_hash)
+        encoded_peer_id = urllib.parse.quote_from_bytes(self.peer_id)
+
+        params = (
+            f"info_hash={encoded_info_hash}"
+            f"&peer_id={encoded_peer_id}"
+            f"&port={self.listen_port}"
+            f"&uploaded=0"
+            f"&downloaded=0"
+            f"&left={self.total_length}"
+            f"&compact=1"
+            f"&event=started"
+        )
+
+        url = f"{self.tracker_url}?{params}"
+        EVENT_LOG.info("[*] Announcing to tracker: %s", url)
+
+        with urllib.request.urlopen(url) as response:
+            decoded = bencode.decode(response.read())
+
+        peers = decoded.get(b'peers', b'')
+        if not isinstance(peers, bytes):
+            EVENT_LOG.warning("[!] Non-compact peer format not supported yet.")
+            return None
+        return peers
 
-    def listen_for_incoming_peers(self):
-        """Start a listening socket for incoming peer connections."""
-        server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        server_sock.bind(('', self.listen_port))
-        server_sock.listen(self.backlog)
-        print(f"[*] Listening for incoming peers on port {self.listen_port}")
+    def _announce_udp(self):
+        EVENT_LOG.info("[*] Announcing to UDP tracker: %s", self.tracker_url)
+        client = UDPTrackerClient(self.tracker_url)
+        try:
+            interval, leechers, seeders, peers = client.announce(
+                self.info_hash, self.peer_id, self.listen_port, left=self.total_length, event=b'started')
+        finally:
+            client.close()
+        EVENT_LOG.info("[+] UDP tracker: %s seeders, %s leechers, interval %ss", seeders, leechers, interval)
+        return peers
+
+    def add_peer_candidate(self, ip, port):
+        """Queue an address for the connection scheduler (tracker or PEX sourced)."""
+        if ip == '127.0.0.1' and port == self.listen_port:
+            EVENT_LOG.info("[-] Skipping self (%s:%s)", ip, port)
+            return
+        if (ip, port) in self.known_addresses or self.connect_queue.qsize() >= MAX_QUEUED_CANDIDATES:
+            return
+        self.known_addresses.add((ip, port))
+        self.connect_queue.put((ip, port))
 
+    def connection_scheduler(self):
+        """Dial queued peer candidates one at a time."""
         while self.running:
             try:
-                conn, addr = server_sock.accept()
-                print(f"[+] Accepted connection from {addr}")
-                self.connected_peers.append(conn)
-                t = threading.Thread(target=self.handle_peer_connection, args=(conn, True))
-                t.start()
-                self.threads.append(t)
-            except Exception as e:
-                print(f"[!] Error accepting connection: {e}")
-
-    def try_upnp_port_forwarding(self):
-        """Attempt to use UPnP to open a port on the router."""
-        if miniupnpc is None:
-            print("[!] miniupnpc not available. Skipping UPnP port forwarding.")
+                ip, port = self.connect_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if (ip, port) in self.peer_addresses.values():
+                continue
+            self._connect_and_handshake(ip, port)
+
+    def _connect_and_handshake(self, ip, port):
+        if not self.reserve_connection():
+            EVENT_LOG.warning("[!] Connection limit reached. Not dialing %s:%s", ip, port)
+            self.known_addresses.discard((ip, port))
+            return
+        sock = self.connect_to_peer(ip, port)
+        if not sock:
+            self.known_addresses.discard((ip, port))
+            self.release_connection()
             return
 
         try:
-            upnp = miniupnpc.UPnP()
-            upnp.discoverdelay = 200
-            upnp.discover()
-            upnp.selectigd()
-            upnp.addportmapping(self.listen_port, 'TCP', upnp.lanaddr, self.listen_port, 'BitTorrentClient', '')
-            print(f"[+] UPnP port {self.listen_port} forwarded successfully!")
+            self.send_handshake(sock)
+            handshake = self.receive_handshake(sock)
+            if not handshake:
+                EVENT_LOG.warning("[!] Handshake failed with %s:%s", ip, port)
+                sock.close()
+                self.release_connection()
+                return
+            peer_id, reserved = handshake
+            sock = self.secure_socket(sock, is_initiator=True)
+            EVENT_LOG.info("[+] Started encryption of conversation")
         except Exception as e:
-            print(f"[!] UPnP port forwarding failed: {e}")
+            EVENT_LOG.warning("[!] Handshake failed with %s:%s: %s", ip, port, e)
+            sock.close()
+            self.release_connection()
+            return
+        sock.settimeout(None)  # Idle peers are handled by the timer wheel from here on
+        self._set_send_timeout(sock)
+
+        self.remote_peer_ids[sock] = peer_id  # SKYLAY
+        self.peer_addresses[sock] = (ip, port)
+        self._track_peer(sock, (ip, port))
+        self._register_extensions(sock, reserved)
+        EVENT_LOG.info("[+] Handshake completed with %s:%s", ip, port)
+        self._spawn_connection(sock, False)
+
+    def accept_connection(self, conn, peer_id, reserved):
+        """
+        Take over an incoming connection whose handshake the session already
+        read. Returns False, leaving the connection to the caller, if the torrent
+        is at its cap and no peer can be evicted for it.
+        """
+        if not self._reserve_torrent_connection():
+            EVENT_LOG.warning("[!] Torrent connection limit reached. Refusing %s", conn.getpeername())
+            return False
+        self._spawn_connection(conn, True, (peer_id, reserved))
+        return True
+
+    def _spawn_connection(self, conn, is_incoming, handshake=None):
+        # Drop finished connection threads so a long-running seeder doesn't collect them
+        self.threads = [t for t in self.threads if t.is_alive()]
+        t = threading.Thread(target=self._run_connection, args=(conn, is_incoming, handshake))
+        t.start()
+        self.threads.append(t)
+
+    def _run_connection(self, conn, is_incoming, handshake=None):
+        """Connection thread: its reservation in the torrent and session budgets ends with it."""
+        try:
+            self.handle_peer_connection(conn, is_incoming, handshake)
+        finally:
+            self.release_connection()
+
+    def reserve_connection(self):
+        """
+        Take a connection from the torrent's and the session's budget, evicting
+        the least valuable peer when either is used up. Returns False if there is no room.
+        """
+        with self.connection_lock:
+            room = self.connections < self.max_connections
+            if room:
+                self.connections += 1
+        if room:
+            if self.session.reserve_connection(evict=True):
+                return True
+            with self.connection_lock:
+                self.connections -= 1
+            return False
+        if not self.evict_peer():
+            return False
+        # The evicted peer hands back its torrent and session slots when its thread ends
+        with self.connection_lock:
+            self.connections += 1
+        self.session.reserve_connection(force=True)
+        return True
+
+    def _reserve_torrent_connection(self):
+        """Like reserve_connection, for a connection that already holds a session slot."""
+        with self.connection_lock:
+            if self.connections < self.max_connections:
+                self.connections += 1
+                return True
+        if not self.evict_peer():
+            return False
+        with self.connection_lock:
+            self.connections += 1  # The evicted connection gives its slot back when its thread ends
+        return True
+
+    def release_connection(self):
+        with self.connection_lock:
+            self.connections -= 1
+        self.session.release_connection()
+
+    def evict_peer(self):
+        """Disconnect this torrent's least valuable evictable peer. Returns False if there was none."""
+        now = time.monotonic()
+        if now - self.last_eviction < EVICT_INTERVAL:
+            return False
+        candidate = self.eviction_candidate(now)
+        if candidate is None:
+            return False
+        self.last_eviction = now
+        value, sock = candidate
+        self.evict(sock, value)
+        return True
+
+    def eviction_candidate(self, now=None):
+        """(value, sock) of the least valuable peer past its grace period, or None."""
+        now = time.monotonic() if now is None else now
+        needed = [not have for have in self.storage.bitfield]
+        missing = sum(needed)
+        worst = None
+        for sock, score in list(self.peer_stats.items()):
+            if not score.evictable(now):
+                continue
+            value = score.value(self._usefulness(sock, needed, missing), now)
+            if worst is None or value < worst[0]:
+                worst = (value, sock)
+        return worst
+
+    def evict(self, sock, value):
+        EVENT_LOG.info("[×] Evicting %s (worth %.0f B/s) to make room for a new peer", self._peer(sock), value)
+        self.safe_close_peer(sock)
+
+    def _usefulness(self, sock, needed, missing):
+        """Fraction of the pieces we still need that the peer has."""
+        bitfield = self.peer_bitfields.get(sock)
+        if not bitfield or not missing:
+            return 0.0
+        return sum(1 for has, need in zip(bitfield, needed) if has and need) / missing
+
+    def _peer(self, sock):
+        """Address of a connection for log lines, without a getpeername() syscall."""
+        stats = self.peer_stats.get(sock)
+        return stats.address if stats is not None else '<unknown peer>'
+
+    def _track_peer(self, sock, address):
+        """Start counting and scoring an established connection, carrying over its address's failures."""
+        self.peer_stats[sock] = PeerStats(address, failures=self.failure_history.get(address[0], 0))
+
+    def _record_failure(self, sock):
+        """Hold a failure against a connection, and against its address for later connections."""
+        score = self.peer_stats.get(sock)
+        if score is not None:
+            score.add_failure()
+        try:
+            ip = sock.getpeername()[0]
+        except OSError:
+            return
+        self.failure_history[ip] = self.failure_history.pop(ip, 0) + 1
+        while len(self.failure_history) > FAILURE_HISTORY_SIZE:
+            self.failure_history.popitem(last=False)
 
     def connect_to_peer(self, ip, port):
-        print(f"[*] Attempting connection to {ip}:{port}")
+        EVENT_LOG.info("[*] Attempting connection to %s:%s", ip, port)
         try:
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(5)  # 5 seconds timeout
             sock.connect((ip, port))
-            print(f"[+] Connected to {ip}:{port}")
-            self.connected_peers.append(sock)
+            EVENT_LOG.info("[+] Connected to %s:%s", ip, port)
             return sock
         except socket.timeout:
-            print(f"[!] Connection to {ip}:{port} timed out.")
+            EVENT_LOG.warning("[!] Connection to %s:%s timed out.", ip, port)
         except socket.error as e:
-            print(f"[!] Failed to connect to {ip}:{port}: {e}")
+            EVENT_LOG.warning("[!] Failed to connect to %s:%s: %s", ip, port, e)
         return None
 
-    def handle_peer_connection(self, conn, is_incoming):
+    def handle_peer_connection(self, conn, is_incoming, handshake=None):
         sockname = conn.getpeername()
+        self._watch_connection(conn)
         try:
             if is_incoming:
-                peer_id = self.receive_handshake(conn)
-                if not peer_id:
-                    print(f"[!] Invalid handshake from {conn.getpeername()}")
+                if handshake is None:
+                    handshake = self.receive_handshake(conn)
+                if not handshake:
+                    EVENT_LOG.warning("[!] Invalid handshake from %s", sockname)
+                    self._unwatch_connection(conn)
                     conn.close()
                     return
+                peer_id, reserved = handshake
                 self.send_handshake(conn)
+                raw_conn = conn
                 conn = self.secure_socket(conn, is_initiator=False)
-                print(f"[+] Started encryption of conversation")
+                raw_conn.settimeout(None)  # The session's handshake timeout no longer applies
+                self._set_send_timeout(raw_conn)
+                EVENT_LOG.info("[+] Started encryption of conversation")
+                self._unwatch_connection(raw_conn)
+                self._watch_connection(conn)
                 self.remote_peer_ids[conn] = peer_id
+                self._track_peer(conn, sockname)
+                self._register_extensions(conn, reserved)
                 self.send_bitfield(conn)
                 self.peer_bitfields[conn] = self.receive_bitfield(conn)
+                self.send_allowed_fast(conn)
+                self.send_extended_handshake(conn)
                 self.handle_server_peer_message(conn)
             else:
-                print(f"[+] Peer handshake established with {conn.getpeername()}")
+                EVENT_LOG.info("[+] Peer handshake established with %s", self._peer(conn))
                 peer_bitfield = self.receive_bitfield(conn)
-                print(f"[→] Bitfield received from {sockname}: {peer_bitfield}")
+                EVENT_LOG.debug("[→] Bitfield received from %s: %d pieces", sockname, sum(peer_bitfield or ()))
                 self.peer_bitfields[conn] = peer_bitfield
                 self.send_bitfield(conn)
+                self.send_extended_handshake(conn)
                 self.download_loop(conn, self.peer_bitfields[conn])
 
         except Exception as e:
-            print(f"[!] Error handling peer {sockname}: {e}")
-            conn.close()
+            EVENT_LOG.warning("[!] Error handling peer %s: %s", sockname, e)
+        finally:
+            self.safe_close_peer(conn)  # Whatever ended the connection, none of its state outlives it
 
     def handle_server_peer_message(self, sock):
-        sock.settimeout(60)
-        peer_choked = True  # choke until interested is sent
-
         try:
             while True:
-                msg_id, payload = ProtocolMessage.parse_message(sock)
+                msg_id, payload = self.read_message(sock)
                 if msg_id is None:
-                    print(f"[!] Peer {sock.getpeername()} disconnected.")
+                    EVENT_LOG.info("[!] Peer %s disconnected.", self._peer(sock))
                     break
 
-                if msg_id == 4:  # have
-                    self._handle_have(sock, payload)
-
-                elif msg_id == 3:  # not interested
-                    print(f"[←] Peer {sock.getpeername()} not interested. Closing connection.")
-                    self.safe_close_peer(sock)
+                if not self.dispatch_message(sock, msg_id, payload):
                     break
 
-                elif msg_id == 2:  # interested
-                    print(f"[←] Peer {sock.getpeername()} is interested.")
-                    peer_choked = self._handle_interested(sock)
-
-                elif msg_id == 6:  # request
-                    if peer_choked:
-                        print(f"[!] Refusing request from choked peer {sock.getpeername()}")
-                        continue
-                    index = int.from_bytes(payload[0:4], 'big')
-                    begin = int.from_bytes(payload[4:8], 'big')
-                    length = int.from_bytes(payload[8:12], 'big')
-                    self.respond_to_request(sock, index, begin, length)
-
-                else:
-                    print(f"[←] Unhandled server-side msg ID {msg_id} from {sock.getpeername()}")
-
-        except (socket.timeout, Exception) as e:
-            print(f"[!] Upload loop terminated: {e}")
+        except Exception as e:
+            EVENT_LOG.warning("[!] Upload loop terminated: %s", e)
+            self._unwatch_connection(sock)
             sock.close()
             return
 
     def respond_to_request(self, sock, index, begin, length):
         try:
-            # Read the requested block from disk or memory
-            block = self.storage.read_block(index, begin, length)
-            if block is None:
-                print(f"[!] Block read failed: index={index}, begin={begin}, length={length}")
-                return
+            self._peer_limiter(sock, upload=True).consume(length)
 
-            msg = ProtocolMessage.build_response(index, begin, block)
+            key = (self.info_hash, index, begin, length)
+            cached = self.session.block_cache.get(key)
+            if cached is not None:
+                msg = ProtocolMessage.build_response(index, begin, cached)
+            else:
+                # Read the requested block straight into the outgoing frame
+                msg, block = ProtocolMessage.build_response_frame(index, begin, length)
+                if self.storage.read_block_into(index, begin, block) != length:
+                    EVENT_LOG.warning("[!] Block read failed: index=%s, begin=%s, length=%s", index, begin, length)
+                    return
+                self.session.block_cache.put(key, block)
 
             # Send to peer
             sock.send(msg)
-            print(f"[→] Sent piece {index} [{begin}:{begin + length}] to {sock.getpeername()}")
+            score = self.peer_stats.get(sock)
+            if score is not None:
+                score.add_upload(length)
+            EVENT_LOG.debug("[→] Sent piece %d [%d:%d] to %s", index, begin, begin + length, self._peer(sock))
 
         except Exception as e:
-            print(f"[!] Failed to send piece {index} to {sock.getpeername()}: {e}")
+            EVENT_LOG.warning("[!] Failed to send piece %s to %s: %s", index, self._peer(sock), e)
 
     def download_loop(self, conn, peer_bitfield):
         try:
-            sockname = conn.getpeername()
+            sockname = self._peer(conn)
             peer_id = self.remote_peer_ids.get(conn, b'unknown').decode(errors='ignore')
 
             # Step 1: Check if peer has anything useful
@@ -272,241 +505,345 @@ class TorrentPeer:
             if conn not in self.sent_interested:
                 self.send_interested(conn)
                 self.sent_interested.add(conn)
-                print(f"[→] Sent 'interested' to {sockname}")
-
-            # Step 3: Wait for initial unchoke
-            if conn in self.choked_peers:
-                if not self._wait_until_unchoked(conn, sockname):
-                    return
+                EVENT_LOG.debug("[→] Sent 'interested' to %s", sockname)
 
-            # Step 4: Begin request loop
+            # Step 3: Begin request loop
             while True:
-                # If we've been choked again, wait
+                piece_index = None
+                # If we've been choked, fall back to allowed-fast pieces or wait
                 if conn in self.choked_peers:
-                    if not self._wait_until_unchoked(conn, sockname):
-                        break
+                    piece_index = self._get_allowed_fast_piece(conn, peer_bitfield)
+                    if piece_index is None:
+                        if not self._wait_until_unchoked(conn, sockname):
+                            break
+                        continue
 
-                piece_index = self.storage.get_needed_piece(peer_bitfield)
                 if piece_index is None:
-                    print(f"[✓] No more pieces to request from {sockname}. Done with this peer.")
+                    piece_index = self.storage.get_needed_piece(self._requestable(conn, peer_bitfield))
+                if piece_index is None:
+                    EVENT_LOG.info("[✓] No more pieces to request from %s. Done with this peer.", sockname)
                     break
 
                 # Compute actual piece size (especially important for the last piece)
                 piece_size = min(self.piece_length, self.total_length - piece_index * self.piece_length)
                 self.pending_pieces[piece_index] = Piece(piece_size, BLOCK_SIZE)
 
+                request_timer = None
                 try:
                     piece_size = min(self.piece_length, self.total_length - piece_index * self.piece_length)
-                    for offset in range(0, piece_size, BLOCK_SIZE):
-                        block_len = min(BLOCK_SIZE, piece_size - offset)
-                        self.request_piece(conn, piece_index, offset, block_len)
+                    self._peer_limiter(conn, upload=False).consume(piece_size)
+                    conn.send(ProtocolMessage.build_requests(piece_index, piece_size, BLOCK_SIZE))
+                    stats = self.peer_stats.get(conn)
+                    if stats is not None:
+                        stats.requests_sent(-(-piece_size // BLOCK_SIZE))
+                    pending = self.pending_pieces[piece_index]
+                    if self.merkle and conn in self.v2_peers:
+                        self.request_leaf_hashes(conn, piece_index)
+                    request_timer = self.timers.schedule(REQUEST_TIMEOUT, self._on_request_timeout,
+                                                         conn, piece_index, pending, 0)
+                    self.connection_timers.get(conn, {})['request'] = request_timer
 
                     while piece_index in self.pending_pieces and not self.pending_pieces[piece_index].is_complete():
                         if not self.receive_and_dispatch(conn):
                             raise Exception("Connection dropped or corrupted")
 
                 except Exception as e:
-                    print(f"[!] Failed to download piece {piece_index} from {sockname}: {e}")
+                    EVENT_LOG.warning("[!] Failed to download piece %s from %s: %s", piece_index, sockname, e)
                     self.storage.release_piece(piece_index)
                     if piece_index in self.pending_pieces:
                         del self.pending_pieces[piece_index]
                     time.sleep(2)
+                finally:
+                    self.timers.cancel(self.connection_timers.get(conn, {}).pop('request', request_timer))
+                    stats = self.peer_stats.get(conn)
+                    if stats is not None:
+                        stats.requests_abandoned()  # Blocks still in flight belong to a piece we gave up
 
         except Exception as e:
-            print(f"[!] Error in download loop with {conn.getpeername()}: {e}")
+            EVENT_LOG.warning("[!] Error in download loop with %s: %s", self._peer(conn), e)
         finally:
+            self._unwatch_connection(conn)
             conn.close()
 
+    def read_message(self, sock):
+        """Read one message and note that the peer is alive. An oversized message raises, ending the connection."""
+        msg_id, payload = ProtocolMessage.parse_message(sock, self.max_message_length)
+        if msg_id is not None:
+            self.last_received[sock] = time.monotonic()
+        return msg_id, payload
+
     def receive_and_dispatch(self, sock):
         try:
-            msg_id, payload = ProtocolMessage.parse_message(sock)
+            msg_id, payload = self.read_message(sock)
             if msg_id is None:
-                print(f"[!] Peer {sock.getpeername()} closed connection.")
+                EVENT_LOG.info("[!] Peer %s closed connection.", self._peer(sock))
                 return False
 
-            if msg_id == 7:
-                self.handle_piece_message(payload)
-            else:
-                self.handle_peer_message(sock, msg_id, payload)
-
-            return True
+            return self.dispatch_message(sock, msg_id, payload)
 
         except Exception as e:
-            print(f"[!] Error receiving from {sock.getpeername()}: {e}")
+            EVENT_LOG.warning("[!] Error receiving from %s: %s", self._peer(sock), e)
             return False
 
-    def handle_peer_message(self, sock, msg_id, payload):
-        if msg_id == 0:
-            self.choked_peers.add(sock)
-            print(f"[←] Peer {sock.getpeername()} choked us.")
-        elif msg_id == 1:
-            self.choked_peers.discard(sock)
-            print(f"[←] Peer {sock.getpeername()} unchoked us.")
-        elif msg_id == 2:
-            print(f"[←] Peer {sock.getpeername()} sent interested.")
-        elif msg_id == 3:
-            print(f"[←] Peer {sock.getpeername()} not interested.")
-        elif msg_id == 4:
-            self._handle_have(sock, payload)
-        elif msg_id == 5:
-            self.peer_bitfields[sock] = ProtocolMessage.parse_bitfield(payload, self.num_pieces)
-            print(f"[←] Received bitfield from {sock.getpeername()}")
-        else:
-            print(f"[?] Unknown message ID {msg_id} from {sock.getpeername()}")
+    def dispatch_message(self, sock, msg_id, payload):
+        """Route one message through the dispatch table. Returns False once the connection is done."""
+        handler = self.message_handlers.get(msg_id)
+        if handler is None:
+            EVENT_LOG.warning("[?] Unknown message ID %s from %s", msg_id, self._peer(sock))
+            return True
+        return handler(sock, payload) is not False
 
-    def handle_piece_message(self, payload):
-        index = int.from_bytes(payload[0:4], 'big')
-        begin = int.from_bytes(payload[4:8], 'big')
-        block = payload[8:]
+    def handle_piece_message(self, payload, sock=None):
+        index, begin, block = ProtocolMessage.parse_piece(payload)
 
-        pending = self.pending_pieces[index]
-        pending.store_block(begin, block)
+        pending = self.pending_pieces.get(index)
+        if pending is None:
+            return  # Late block for a piece that was rejected or abandoned
+        if not pending.store_block(begin, block):
+            self._on_bad_block(sock, index, begin, len(block))
+            return
 
         if pending.is_complete():
             piece_data = pending.reassemble()
-            if self.storage.validate_piece_data(index, piece_data):
-                self.storage.write_piece(index, piece_data)
-                self.storage.mark_piece_done(index)
+            # Blocks checked against verified leaf hashes need no whole-piece pass
+            if pending.is_verified() or self.storage.validate_piece_data(index, piece_data):
                 del self.pending_pieces[index]
-                for peer_conn in self.peer_bitfields.keys():
-                    try:
-                        self.send_have(index, peer_conn)
-                    except Exception as e:
-                        print(f"[!] Failed to send 'have' to {peer_conn.getpeername()}: {e}")
+                # The piece stays requested until it is on disk, so nobody fetches it twice meanwhile
+                self.session.disk_pool.submit(self._commit_piece, index, piece_data)
             else:
-                print(f"[✗] Hash mismatch on piece {index}")
+                EVENT_LOG.warning("[✗] Hash mismatch on piece %s", index)
+                if sock is not None:
+                    self._record_failure(sock)
                 self.pending_pieces[index] = Piece(self.piece_length, BLOCK_SIZE)
 
+    def _commit_piece(self, index, piece_data):
+        """Disk pool task: write a verified piece, then tell our peers we have it."""
+        try:
+            self.storage.write_piece(index, piece_data)
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to write piece %s: %s", index, e)
+            self.storage.release_piece(index)
+            return
+        self.storage.mark_piece_done(index)
+        self.stats.piece_completed()
+        for peer_conn in list(self.peer_bitfields.keys()):
+            try:
+                self.send_have(index, peer_conn)
+            except Exception as e:
+                EVENT_LOG.warning("[!] Failed to send 'have' to %s: %s", self._peer(peer_conn), e)
+
     def receive_handshake(self, sock):
-        data = b''
-        while len(data) < 62:
-            chunk = sock.recv(62 - len(data))
-            if not chunk:
-                return None
-            data += chunk
-        if not data.startswith(b'\x13BitTorrent protocol'):
+        handshake = ProtocolMessage.receive_handshake(sock)
+        if handshake is None:
             return None
-
-        info_hash_received = data[28:48]
+        info_hash_received, peer_id, reserved = handshake
         if info_hash_received != self.info_hash:
             return None
-
-        return data[48:]
+        return peer_id, reserved
 
     def send_handshake(self, sock):
-        sock.send(ProtocolMessage.build_handshake(self.info_hash, self.peer_id))
+        reserved = ProtocolMessage.build_reserved(v2=self.merkle)
+        sock.send(ProtocolMessage.build_handshake(self.info_hash, self.peer_id, reserved))
 
     def send_interested(self, sock):
         sock.send(ProtocolMessage.build_interested())
 
     def send_bitfield(self, sock):
         try:
-            # Convert your storage bitfield (list of bools) to a byte array
-            bitfield_bool = self.storage.bitfield  # e.g., [True, False, True, ...]
-            print(bitfield_bool)
-            bitstring = ''.join(['1' if b else '0' for b in bitfield_bool])
-            # Pad the bitstring to be a multiple of 8
-            while len(bitstring) % 8 != 0:
-                bitstring += '0'
-
-            print(bitstring)
-            # Convert to bytes
-            bitfield_bytes = bytearray()
-            for i in range(0, len(bitstring), 8):
-                byte = int(bitstring[i:i + 8], 2)
-                bitfield_bytes.append(byte)
-
-            # Build the full message
-            payload = b'\x05' + bitfield_bytes  # ID = 5
-            length_prefix = len(payload).to_bytes(4, 'big')
-            msg = length_prefix + payload
-            print(msg)
-            sock.send(msg)
-            print(f"[→] Sent bitfield to {sock.getpeername()}")
+            if sock in self.fast_peers:
+                # BEP 6 lets seeders and fresh leechers skip the full bitfield
+                if all(self.storage.bitfield):
+                    sock.send(ProtocolMessage.build_have_all())
+                    EVENT_LOG.debug("[→] Sent 'have all' to %s", self._peer(sock))
+                    return
+                if not any(self.storage.bitfield):
+                    sock.send(ProtocolMessage.build_have_none())
+                    EVENT_LOG.debug("[→] Sent 'have none' to %s", self._peer(sock))
+                    return
+
+            sock.send(ProtocolMessage.build_bitfield(self.storage.bitfield))
+            EVENT_LOG.debug("[→] Sent bitfield to %s", self._peer(sock))
 
         except Exception as e:
-            print(f"[!] Failed to send bitfield: {e}")
+            EVENT_LOG.warning("[!] Failed to send bitfield: %s", e)
 
     def receive_bitfield(self, sock):
         try:
-            msg_id, payload = ProtocolMessage.parse_message(sock)
-            if msg_id == 5:
+            msg_id, payload = self.read_message(sock)
+            if msg_id == BITFIELD:
                 return ProtocolMessage.parse_bitfield(payload, self.num_pieces)
+            if msg_id == HAVE_ALL:
+                return [True] * self.num_pieces
+            if msg_id == HAVE_NONE:
+                return [False] * self.num_pieces
             return None
         except Exception as e:
-            print(f"[!] Error receiving bitfield: {e}")
+            EVENT_LOG.warning("[!] Error receiving bitfield: %s", e)
             return None
 
     def send_have(self, index, sock):
         """ To announce a given index piece has been added and able to download"""
         try:
             sock.send(ProtocolMessage.build_have(index))
-            print(f"[→] Sent 'have' message for piece {index} to {sock.getpeername()}")
+            EVENT_LOG.debug("[→] Sent 'have' message for piece %d to %s", index, self._peer(sock))
         except Exception as e:
-            print(f"[!] Failed to send 'have' message to {sock.getpeername()}: {e}")
+            EVENT_LOG.warning("[!] Failed to send 'have' message to %s: %s", self._peer(sock), e)
 
     def send_choke(self, sock):
         try:
             sock.send(ProtocolMessage.build_choke())
-            print(f"[↑] Sent choke to {sock.getpeername()}")
+            EVENT_LOG.debug("[↑] Sent choke to %s", self._peer(sock))
         except Exception as e:
-            print(f"[!] Failed to send choke: {e}")
+            EVENT_LOG.warning("[!] Failed to send choke: %s", e)
 
     def send_unchoke(self, sock):
         try:
             sock.send(ProtocolMessage.build_unchoke())
-            print(f"[↑] Sent unchoke to {sock.getpeername()}")
+            EVENT_LOG.debug("[↑] Sent unchoke to %s", self._peer(sock))
         except Exception as e:
-            print(f"[!] Failed to send unchoke: {e}")
+            EVENT_LOG.warning("[!] Failed to send unchoke: %s", e)
+
+    def send_reject(self, sock, index, begin, length):
+        try:
+            sock.send(ProtocolMessage.build_reject(index, begin, length))
+            EVENT_LOG.debug("[→] Rejected request for piece %d [%d:%d] from %s", index, begin, begin + length,
+                            self._peer(sock))
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send reject: %s", e)
+
+    def send_allowed_fast(self, sock):
+        """Offer a new fast peer a few pieces it may fetch before being unchoked."""
+        if sock not in self.fast_peers:
+            return
+        try:
+            ip = sock.getpeername()[0]
+            candidates = ProtocolMessage.allowed_fast_set(ip, self.info_hash, self.num_pieces, ALLOWED_FAST_COUNT)
+            peer_bitfield = self.peer_bitfields.get(sock) or [False] * self.num_pieces
+            allowed = {i for i in candidates if self.storage.bitfield[i] and not peer_bitfield[i]}
+            self.allowed_fast_sent[sock] = allowed
+            for index in allowed:
+                sock.send(ProtocolMessage.build_allowed_fast(index))
+            if allowed:
+                EVENT_LOG.debug("[→] Sent allowed-fast set %s to %s", sorted(allowed), self._peer(sock))
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send allowed-fast set: %s", e)
+
+    def send_extended_handshake(self, sock):
+        if sock not in self.extended_peers:
+            return
+        try:
+            handshake = {
+                b'm': {b'ut_pex': UT_PEX_ID},
+                b'p': self.listen_port,
+                b'v': CLIENT_VERSION,
+            }
+            sock.send(ProtocolMessage.build_extended(EXTENDED_HANDSHAKE, bencode.encode(handshake)))
+            EVENT_LOG.debug("[→] Sent extended handshake to %s", self._peer(sock))
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send extended handshake: %s", e)
+
+    def send_pex(self, sock):
+        """Send the peers we are connected to that this peer hasn't heard about from us yet."""
+        remote_id = self.extended_peers.get(sock, {}).get(b'ut_pex')
+        if not remote_id:
+            return
+        own_address = self.peer_addresses.get(sock)
+        current = {addr for addr in self.peer_addresses.values() if addr != own_address}
+        previous = self.pex_sent.get(sock, set())
+
+        added = list(current - previous)[:PEX_MAX_PEERS]
+        dropped = list(previous - current)[:PEX_MAX_PEERS]
+        if not added and not dropped:
+            return
+
+        message = {
+            b'added': ProtocolMessage.build_compact_peers(added),
+            b'added.f': bytes(len(added)),
+            b'dropped': ProtocolMessage.build_compact_peers(dropped),
+        }
+        try:
+            sock.send(ProtocolMessage.build_extended(remote_id, bencode.encode(message)))
+            self.pex_sent[sock] = (previous - set(dropped)) | set(added)
+            EVENT_LOG.debug("[→] Sent PEX to %s: +%d -%d", self._peer(sock), len(added), len(dropped))
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send PEX to %s: %s", self._peer(sock), e)
+            self.safe_close_peer(sock)
+
+    def send_keep_alive(self, sock):
+        try:
+            sock.send(ProtocolMessage.build_keep_alive())
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send keep-alive to %s: %s", self._peer(sock), e)
+            self.safe_close_peer(sock)
 
     def request_piece(self, sock, index, begin, length):
         sock.send(ProtocolMessage.build_piece(index, begin, length))
 
-    def wait_for_unchoke(self, sock, timeout=30):
+    def request_leaf_hashes(self, sock, index):
+        """Ask for the 16 KiB leaf hashes of a piece, so its blocks can be verified one by one."""
+        width = self.storage.leaf_width
+        try:
+            sock.send(ProtocolMessage.build_hash_request(self.storage.pieces_root, 0, index * width, width))
+        except Exception as e:
+            EVENT_LOG.warning("[!] Failed to send hash request: %s", e)
+
+    def _on_bad_block(self, sock, index, begin, length):
+        """A block failed its leaf hash: note who sent it and fetch just that block again."""
+        peer = self._peer(sock)
+        if sock is not None:
+            self.hash_failures[sock] = self.hash_failures.get(sock, 0) + 1
+            self._record_failure(sock)
+        EVENT_LOG.warning("[✗] Block %d [%d:%d] from %s failed its hash. Re-requesting it.",
+                          index, begin, begin + length, peer)
+        if sock is not None:
+            try:
+                self.request_piece(sock, index, begin, length)
+                stats = self.peer_stats.get(sock)
+                if stats is not None:
+                    stats.requests_sent(1)
+            except Exception as e:
+                EVENT_LOG.warning("[!] Failed to re-request block: %s", e)
+
+    def wait_for_unchoke(self, sock, timeout=UNCHOKE_TIMEOUT):
         """
-        Blocks until an 'unchoke' (ID=1) message is received.
-        Returns True if unchoked within timeout, False otherwise.
+        Blocks until an 'unchoke' (ID=1) message is received, dispatching
+        everything else that arrives meanwhile. A peer that sends keep-alives
+        but doesn't unchoke us within `timeout` seconds is disconnected by a
+        timer, which ends the wait.
+        Returns True if unchoked (or an allowed-fast piece was offered), False
+        if the connection went away.
         """
-        sock.settimeout(timeout)
+        self._reschedule(sock, 'unchoke', timeout, self._on_unchoke_timeout, timeout)
         try:
             while True:
-                # Read message length
-                length_bytes = sock.recv(4)
-                if len(length_bytes) < 4:
-                    print("[!] Connection closed while waiting for unchoke")
+                msg_id, payload = self.read_message(sock)
+                if msg_id is None:
+                    EVENT_LOG.warning("[!] Connection closed while waiting for unchoke")
                     return False
 
-                length = int.from_bytes(length_bytes, 'big')
-
-                if length == 0:
-                    continue  # Keep-alive message, skip
-
-                # Read message ID
-                msg_id = sock.recv(1)
-                if not msg_id:
-                    print("[!] Connection closed (no message ID)")
+                if not self.dispatch_message(sock, msg_id, payload):
                     return False
 
-                if msg_id == b'\x01':
-                    print(f"[✓] Received unchoke from {sock.getpeername()}")
+                if sock not in self.choked_peers:
+                    EVENT_LOG.debug("[✓] Received unchoke from %s", self._peer(sock))
                     return True
 
-                # Skip rest of the message
-                sock.recv(length - 1)
-
-        except socket.timeout:
-            print(f"[!] Timed out waiting for unchoke from {sock.getpeername()}")
-            return False
+                if msg_id == ALLOWED_FAST:
+                    return True
 
         except Exception as e:
-            print(f"[!] Error waiting for unchoke: {e}")
+            EVENT_LOG.warning("[!] Error waiting for unchoke: %s", e)
             return False
+        finally:
+            self.timers.cancel(self.connection_timers.get(sock, {}).pop('unchoke', None))
 
     def _should_interested(self, conn, peer_bitfield, sockname, peer_id):
         initial_piece = self.storage.get_needed_piece(peer_bitfield)
         if initial_piece is None:
-            print(f"[=] Peer {sockname} ({peer_id}) has nothing we need. Sending 'not interested' and closing.")
+            EVENT_LOG.info("[=] Peer %s (%s) has nothing we need. Sending 'not interested' and closing.",
+                           sockname, peer_id)
             conn.send(ProtocolMessage.build_not_interested())
+            self._unwatch_connection(conn)
             conn.close()
             return False
         self.storage.release_piece(initial_piece)
@@ -514,48 +851,384 @@ class TorrentPeer:
 
     def _wait_until_unchoked(self, conn, sockname):
         if not self.wait_for_unchoke(conn):
-            print(f"[!] Timed out waiting for unchoke from {sockname}")
+            EVENT_LOG.warning("[!] Gave up waiting for unchoke from %s", sockname)
+            self._unwatch_connection(conn)
             conn.close()
             return False
-        self.choked_peers.discard(conn)
         return True
 
-    def _handle_interested(self, sock):
+    def set_rate_limits(self, upload=None, download=None, peer_upload=None, peer_download=None):
+        """Adjust limits at runtime, in bytes/s (0 = unlimited, None = unchanged)."""
+        if upload is not None:
+            self.upload_limiter.set_rate(upload)
+        if download is not None:
+            self.download_limiter.set_rate(download)
+        if peer_upload is not None:
+            self.peer_upload_rate = peer_upload
+            for limiter in list(self.peer_upload_limiters.values()):
+                limiter.set_rate(peer_upload)
+        if peer_download is not None:
+            self.peer_download_rate = peer_download
+            for limiter in list(self.peer_download_limiters.values()):
+                limiter.set_rate(peer_download)
+
+    def snapshot(self, peers=True):
+        """
+        Statistics of the torrent as a plain dict, safe to call from any thread.
+
+        :param peers: Include one entry per connection (skip for a cheaper summary)
+        """
+        now = time.monotonic()
+        bitfield = self.storage.bitfield
+        last = self.num_pieces - 1
+        done = sum(bitfield)
+        have = done * self.piece_length
+        if done and bitfield[last]:
+            have -= self.piece_length - (self.total_length - last * self.piece_length)
+        live = list(self.peer_stats.items())
+        download_rate = sum(stats.download_rate(now) for _, stats in live)
+        snapshot = dict(
+            info_hash=self.info_hash.hex(), name=self.name, num_pieces=self.num_pieces, pieces_done=done,
+            left=self.total_length - have,
+            downloaded=self.stats.downloaded + sum(stats.bytes_down for _, stats in live),
+            uploaded=self.stats.uploaded + sum(stats.bytes_up for _, stats in live),
+            download_rate=round(download_rate), upload_rate=round(sum(stats.upload_rate(now) for _, stats in live)),
+            piece_rate=round(self.stats.piece_rate(now), 3), eta=eta(self.total_length - have, download_rate),
+            connections=len(live), max_connections=self.max_connections,
+            uptime=round(now - self.stats.started),
+        )
+        if peers:
+            snapshot['peers'] = [
+                stats.snapshot(now, interested=sock in self.sent_interested, choked=sock in self.choked_peers,
+                               unchoked_by_us=sock in self.unchoked_peers, snubbed=sock in self.snubbed_peers,
+                               hash_failures=self.hash_failures.get(sock, 0),
+                               pieces=sum(self.peer_bitfields.get(sock) or ()))
+                for sock, stats in live
+            ]
+        return snapshot
+
+    def _peer_limiter(self, sock, upload):
+        limiters = self.peer_upload_limiters if upload else self.peer_download_limiters
+        limiter = limiters.get(sock)
+        if limiter is None:
+            if upload:
+                limiter = TokenBucket(self.peer_upload_rate, parent=self.upload_limiter)
+            else:
+                limiter = TokenBucket(self.peer_download_rate, parent=self.download_limiter)
+            limiters[sock] = limiter
+        return limiter
+
+    def _watch_connection(self, sock):
+        """Start keep-alive and idle timers for a connection."""
+        self.last_received[sock] = time.monotonic()
+        self.connection_timers[sock] = {
+            'keepalive': self.timers.schedule(KEEPALIVE_INTERVAL, self._on_keepalive_timer, sock),
+            'idle': self.timers.schedule(IDLE_TIMEOUT, self._on_idle_timer, sock),
+        }
+
+    def _unwatch_connection(self, sock):
+        for timer in self.connection_timers.pop(sock, {}).values():
+            self.timers.cancel(timer)
+        self.last_received.pop(sock, None)
+        self.snubbed_peers.discard(sock)
+        self.peer_upload_limiters.pop(sock, None)
+        self.peer_download_limiters.pop(sock, None)
+
+    def _reschedule(self, sock, name, delay, callback, *args):
+        timers = self.connection_timers.get(sock)
+        if timers is not None:
+            self.timers.cancel(timers.get(name))
+            timers[name] = self.timers.schedule(delay, callback, sock, *args)
+
+    @staticmethod
+    def _set_send_timeout(sock):
+        """
+        Make a send that blocks longer than SEND_TIMEOUT fail, leaving receives
+        blocking. The peer is closed then: the frame may have gone out half-sent.
+        """
+        if os.name == 'nt':
+            value = SEND_TIMEOUT * 1000  # DWORD milliseconds
+        else:
+            value = struct.pack('ll', SEND_TIMEOUT, 0)  # struct timeval
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+
+    def _on_keepalive_timer(self, sock):
+        # Sends can block on a peer that stopped reading; the wheel thread must not
+        self.session.send_pool.submit(self.send_keep_alive, sock)
+        self._reschedule(sock, 'keepalive', KEEPALIVE_INTERVAL, self._on_keepalive_timer)
+
+    def _on_idle_timer(self, sock):
+        last = self.last_received.get(sock)
+        if last is None:
+            return
+        idle = time.monotonic() - last
+        if idle >= IDLE_TIMEOUT:
+            EVENT_LOG.info("[×] Peer %s idle for %ds. Disconnecting.", self._peer(sock), idle)
+            self.safe_close_peer(sock)
+            return
+        self._reschedule(sock, 'idle', IDLE_TIMEOUT - idle, self._on_idle_timer)
+
+    def _on_request_timeout(self, sock, index, piece, seen_bytes):
+        if self.pending_pieces.get(index) is not piece or piece.is_complete():
+            return
+        if piece.received_bytes > seen_bytes:
+            # Still making progress, check again later
+            self._reschedule(sock, 'request', REQUEST_TIMEOUT, self._on_request_timeout,
+                             index, piece, piece.received_bytes)
+            return
+        EVENT_LOG.warning("[!] Peer %s snubbed us on piece %d. Releasing it and disconnecting.",
+                          self._peer(sock), index)
+        self.snubbed_peers.add(sock)
+        self._record_failure(sock)
+        if self.pending_pieces.pop(index, None) is not None:
+            self.storage.release_piece(index)
+        # The download thread is blocked reading from this peer; shutting the socket down wakes it
+        self.safe_close_peer(sock)
+
+    def _on_unchoke_timeout(self, sock, timeout):
+        if sock not in self.choked_peers:
+            return
+        EVENT_LOG.warning("[!] Peer %s kept us choked for %ds. Disconnecting.", self._peer(sock), timeout)
+        self.safe_close_peer(sock)
+
+    def _on_pex_timer(self, sock):
+        self.session.send_pool.submit(self.send_pex, sock)
+        self._reschedule(sock, 'pex', PEX_INTERVAL, self._on_pex_timer)
+
+    def _get_allowed_fast_piece(self, conn, peer_bitfield):
+        allowed = self.allowed_fast_received.get(conn)
+        if not allowed:
+            return None
+        allowed_bitfield = [has and i in allowed for i, has in enumerate(self._requestable(conn, peer_bitfield))]
+        return self.storage.get_needed_piece(allowed_bitfield)
+
+    def _requestable(self, conn, peer_bitfield):
+        """The peer's bitfield without the pieces it rejected, so a rejecting peer isn't asked again and again."""
+        rejected = self.rejected_pieces.get(conn)
+        if not rejected:
+            return peer_bitfield
+        return [has and i not in rejected for i, has in enumerate(peer_bitfield)]
+
+    def _register_extensions(self, sock, reserved):
+        if ProtocolMessage.supports_fast(reserved):
+            self.fast_peers.add(sock)
+            EVENT_LOG.info("[+] Fast Extension enabled with %s", self._peer(sock))
+        if self.merkle and ProtocolMessage.supports_v2(reserved):
+            self.v2_peers.add(sock)
+            EVENT_LOG.info("[+] v2 hash exchange enabled with %s", self._peer(sock))
+        if ProtocolMessage.supports_extended(reserved):
+            self.extended_peers[sock] = {}
+            EVENT_LOG.info("[+] Extension Protocol enabled with %s", self._peer(sock))
+
+    def _handle_extended(self, sock, payload):
+        if not payload or sock not in self.extended_peers:
+            EVENT_LOG.warning("[!] Unexpected extended message from %s", self._peer(sock))
+            return
+        ext_id, body = payload[0], payload[1:]
+        try:
+            message = bencode.decode(body)
+        except Exception as e:
+            EVENT_LOG.warning("[!] Malformed extended message from %s: %s", self._peer(sock), e)
+            return
+
+        if ext_id == EXTENDED_HANDSHAKE:
+            self.extended_peers[sock] = {
+                name: msg_id for name, msg_id in message.get(b'm', {}).items() if isinstance(msg_id, int)
+            }
+            listen_port = message.get(b'p')
+            if isinstance(listen_port, int) and 0 < listen_port < 65536:
+                self.peer_addresses[sock] = (sock.getpeername()[0], listen_port)
+                self.known_addresses.add(self.peer_addresses[sock])
+            if b'ut_pex' in self.extended_peers[sock]:
+                self._reschedule(sock, 'pex', PEX_INTERVAL, self._on_pex_timer)
+            EVENT_LOG.debug("[←] Extended handshake from %s: %r", self._peer(sock), message.get(b'v', b'?'))
+
+        elif ext_id == UT_PEX_ID:
+            added = ProtocolMessage.parse_compact_peers(message.get(b'added', b''))
+            EVENT_LOG.debug("[←] PEX from %s: %d peers", self._peer(sock), len(added))
+            for ip, port in added[:PEX_MAX_PEERS]:
+                self.add_peer_candidate(ip, port)
+
+        else:
+            EVENT_LOG.warning("[?] Unknown extended message %s from %s", ext_id, self._peer(sock))
+
+    def _handle_reject(self, sock, payload):
+        if len(payload) != 12:
+            EVENT_LOG.warning("[!] Malformed 'reject' message from %s", self._peer(sock))
+            return
+        index, begin, _ = ProtocolMessage.parse_block(payload)
+        EVENT_LOG.debug("[←] Peer %s rejected piece %d [%d]", self._peer(sock), index, begin)
+        stats = self.peer_stats.get(sock)
+        if stats is not None:
+            stats.request_rejected()
+        self.rejected_pieces.setdefault(sock, set()).add(index)
+        self.allowed_fast_received.get(sock, set()).discard(index)  # A rejected fast piece is no longer offered
+
+        # Drop the piece right away so it can be re-issued instead of waiting for a timeout
+        if self.pending_pieces.pop(index, None) is not None:
+            self.storage.release_piece(index)
+
+    def _handle_allowed_fast(self, sock, payload):
+        if len(payload) != 4:
+            EVENT_LOG.warning("[!] Malformed 'allowed fast' message from %s", self._peer(sock))
+            return
+        index = ProtocolMessage.parse_index(payload)
+        if 0 <= index < self.num_pieces:
+            self.allowed_fast_received.setdefault(sock, set()).add(index)
+            EVENT_LOG.debug("[←] Peer %s allowed fast piece %d", self._peer(sock), index)
+
+    def _handle_hash_request(self, sock, payload):
+        if len(payload) != 48:
+            EVENT_LOG.warning("[!] Malformed 'hash request' from %s", self._peer(sock))
+            return
+        request = ProtocolMessage.parse_hash_request(payload)
+        hashes = None
+        if self.merkle and request[0] == self.storage.pieces_root:
+            hashes = self.storage.get_hashes(*request[1:])
+        if hashes is None:
+            sock.send(ProtocolMessage.build_hash_reject(*request))
+            EVENT_LOG.debug("[→] Rejected hash request from %s", self._peer(sock))
+            return
+        sock.send(ProtocolMessage.build_hashes(*request, hashes))
+        EVENT_LOG.debug("[→] Sent %d hashes to %s", len(hashes) // 32, self._peer(sock))
+
+    def _handle_hashes(self, sock, payload):
+        if len(payload) < 48 or (len(payload) - 48) % 32:
+            EVENT_LOG.warning("[!] Malformed 'hashes' message from %s", self._peer(sock))
+            return
+        pieces_root, base_layer, index, length, _, hashes = ProtocolMessage.parse_hashes(payload)
+        width = self.storage.leaf_width if self.merkle else 0
+        if pieces_root != self.storage.pieces_root or base_layer != 0 or length != width or index % width:
+            return  # Not an answer to anything we ask for
+        piece_index = index // width
+        pending = self.pending_pieces.get(piece_index)
+        if pending is None or pending.is_verified():
+            return
+        leaves = bytes(hashes[:length * 32])
+        if not self.storage.verify_leaves(piece_index, leaves):
+            self.hash_failures[sock] = self.hash_failures.get(sock, 0) + 1
+            self._record_failure(sock)
+            EVENT_LOG.warning("[✗] Leaf hashes for piece %d from %s don't match the piece layer",
+                              piece_index, self._peer(sock))
+            return
+        for begin in pending.set_leaf_hashes(leaves):
+            self._on_bad_block(sock, piece_index, begin, min(BLOCK_SIZE, pending.total_length - begin))
+        EVENT_LOG.debug("[←] Leaf hashes for piece %d from %s", piece_index, self._peer(sock))
+
+    def _handle_hash_reject(self, sock, payload):
+        # The piece is still checked as a whole against the piece layer once it completes
+        EVENT_LOG.debug("[←] Peer %s rejected our hash request", self._peer(sock))
+
+    def _handle_keep_alive(self, sock, payload):
+        pass  # read_message already refreshed the idle timer
+
+    def _handle_choke(self, sock, payload):
+        self.choked_peers.add(sock)
+        EVENT_LOG.debug("[←] Peer %s choked us.", self._peer(sock))
+
+    def _handle_unchoke(self, sock, payload):
+        self.choked_peers.discard(sock)
+        EVENT_LOG.debug("[←] Peer %s unchoked us.", self._peer(sock))
+
+    def _handle_interested(self, sock, payload):
+        EVENT_LOG.debug("[←] Peer %s is interested.", self._peer(sock))
+        if sock in self.unchoked_peers:
+            return
         if self.upload_slots.acquire(blocking=False):  # try getting a slot
             self.send_unchoke(sock)
-            self.choked_peers.discard(sock)
-            print(f"[↑] Unchoked {sock.getpeername()}")
-            return False
+            self.unchoked_peers.add(sock)
+            EVENT_LOG.debug("[↑] Unchoked %s", self._peer(sock))
+            return
         self.send_choke(sock)
-        self.choked_peers.add(sock)
-        print(f"[×] No slots available: Choked {sock.getpeername()}")
-        return True
+        EVENT_LOG.debug("[×] No slots available: Choked %s", self._peer(sock))
+
+    def _handle_not_interested(self, sock, payload):
+        if sock in self.sent_interested:
+            # We are downloading from them; their interest doesn't matter
+            EVENT_LOG.debug("[←] Peer %s not interested.", self._peer(sock))
+            return
+        EVENT_LOG.info("[←] Peer %s not interested. Closing connection.", self._peer(sock))
+        self.safe_close_peer(sock)
+        return False
+
+    def _handle_bitfield(self, sock, payload):
+        self.peer_bitfields[sock] = ProtocolMessage.parse_bitfield(payload, self.num_pieces)
+        EVENT_LOG.debug("[←] Received bitfield from %s", self._peer(sock))
+
+    def _handle_have_all(self, sock, payload):
+        self.peer_bitfields[sock] = [True] * self.num_pieces
+        EVENT_LOG.debug("[←] Peer %s has all pieces.", self._peer(sock))
+
+    def _handle_have_none(self, sock, payload):
+        self.peer_bitfields[sock] = [False] * self.num_pieces
+        EVENT_LOG.debug("[←] Peer %s has no pieces.", self._peer(sock))
+
+    def _handle_suggest(self, sock, payload):
+        EVENT_LOG.debug("[←] Peer %s suggested piece %d", self._peer(sock), ProtocolMessage.parse_index(payload))
+
+    def _handle_request(self, sock, payload):
+        if len(payload) != 12:
+            EVENT_LOG.warning("[!] Malformed 'request' message from %s. Disconnecting.", self._peer(sock))
+            self.safe_close_peer(sock)
+            return False
+        index, begin, length = ProtocolMessage.parse_block(payload)
+        # Checked before any rate-limit tokens or buffer space are spent on it
+        if not self._valid_request(index, begin, length):
+            if sock in self.fast_peers:
+                EVENT_LOG.warning("[!] Rejecting invalid request %d [%d:+%d] from %s",
+                                  index, begin, length, self._peer(sock))
+                self.send_reject(sock, index, begin, length)
+                return
+            EVENT_LOG.warning("[!] Invalid request %d [%d:+%d] from %s. Disconnecting.",
+                              index, begin, length, self._peer(sock))
+            self.safe_close_peer(sock)
+            return False
+        if sock not in self.unchoked_peers and index not in self.allowed_fast_sent.get(sock, ()):
+            EVENT_LOG.debug("[!] Refusing request from choked peer %s", self._peer(sock))
+            if sock in self.fast_peers:
+                self.send_reject(sock, index, begin, length)
+            return
+        self.respond_to_request(sock, index, begin, length)
+
+    def _valid_request(self, index, begin, length):
+        """A block of a piece we have, no longer than MAX_REQUEST_LENGTH and inside the piece."""
+        if not 0 <= index < self.num_pieces or not 0 < length <= MAX_REQUEST_LENGTH:
+            return False
+        piece_size = min(self.piece_length, self.total_length - index * self.piece_length)
+        return begin + length <= piece_size and self.storage.bitfield[index]
+
+    def _handle_piece(self, sock, payload):
+        self.snubbed_peers.discard(sock)
+        score = self.peer_stats.get(sock)
+        if score is not None:
+            score.add_download(len(payload) - 8)
+        self.handle_piece_message(payload, sock)
 
     def _handle_have(self, sock, payload):
         try:
             if len(payload) != 4:
-                print(f"[!] Malformed 'have' message from {sock.getpeername()}")
+                EVENT_LOG.warning("[!] Malformed 'have' message from %s", self._peer(sock))
                 return
 
-            piece_index = int.from_bytes(payload, 'big')
+            piece_index = ProtocolMessage.parse_index(payload)
 
             if sock not in self.peer_bitfields.keys():
-                print(f"[!] Received 'have' from unknown peer {sock.getpeername()}")
+                EVENT_LOG.warning("[!] Received 'have' from unknown peer %s", self._peer(sock))
                 return
 
             bitfield = self.peer_bitfields[sock]
             if piece_index < 0 or piece_index >= len(bitfield):
-                print(f"[!] Invalid piece index {piece_index} from {sock.getpeername()}")
+                EVENT_LOG.warning("[!] Invalid piece index %s from %s", piece_index, self._peer(sock))
                 return
 
             bitfield[piece_index] = True
-            print(f"[←] Peer {sock.getpeername()} now has piece {piece_index}")
+            EVENT_LOG.debug("[←] Peer %s now has piece %d", self._peer(sock), piece_index)
 
             if all(bitfield):
-                print(f"[✓] Peer {sock.getpeername()} has completed the file!")
+                EVENT_LOG.info("[✓] Peer %s has completed the file!", self._peer(sock))
 
         except Exception as e:
-            print(f"[!] Error handling 'have' from {sock.getpeername()}: {e}")
+            EVENT_LOG.warning("[!] Error handling 'have' from %s: %s", self._peer(sock), e)
 
     def secure_socket(self, sock, is_initiator):
         es = EncryptedSocket(sock)
@@ -566,9 +1239,8 @@ class TorrentPeer:
         return es
 
     def safe_close_peer(self, sock):
-        sockname = None
+        sockname = self._peer(sock)
         try:
-            sockname = sock.getpeername()
             sock.shutdown(socket.SHUT_RDWR)
         except:
             pass  # Already disconnected or invalid
@@ -578,8 +1250,31 @@ class TorrentPeer:
         except:
             pass
 
+        # Upload slot handling. Eviction and the idle timer may close a peer while its
+        # own thread does too, so only the call that takes it out of the set releases the slot.
+        try:
+            self.unchoked_peers.remove(sock)
+        except KeyError:
+            pass
+        else:
+            self.upload_slots.release()
+
         # Clean up all peer-related state
+        self._unwatch_connection(sock)
         self.choked_peers.discard(sock)
+        self.fast_peers.discard(sock)
+        self.v2_peers.discard(sock)
+        self.hash_failures.pop(sock, None)
+        stats = self.peer_stats.pop(sock, None)
+        if stats is not None:
+            self.stats.retire(stats)
+        self.sent_interested.discard(sock)
+        self.allowed_fast_sent.pop(sock, None)
+        self.allowed_fast_received.pop(sock, None)
+        self.rejected_pieces.pop(sock, None)
+        self.extended_peers.pop(sock, None)
+        self.pex_sent.pop(sock, None)
+        self.known_addresses.discard(self.peer_addresses.pop(sock, None))
         self.peer_bitfields.pop(sock, None)
         self.remote_peer_ids.pop(sock, None)
         if hasattr(self, 'peer_interested'):
@@ -587,21 +1282,17 @@ class TorrentPeer:
         if hasattr(self, 'pending_pieces'):
             self.pending_pieces.pop(sock, None)
 
-        # Upload slot handling
-        if hasattr(self, 'upload_slots') and isinstance(self.upload_slots, threading.Semaphore):
-            if sock not in self.choked_peers:  # was unchoked → release slot
-                self.upload_slots.release()
-
-        print(f"[×] Cleaned up connection with {sockname or '<unknown peer>'}")
+        EVENT_LOG.info("[×] Cleaned up connection with %s", sockname)
 
     def shutdown_all_peers(self):
-        print("[⏻] Shutting down all peer connections...")
+        EVENT_LOG.info("[⏻] Shutting down all peer connections...")
         all_peers = set()
 
         # Aggregate all known connections to all_peers
         all_peers.update(self.peer_bitfields.keys())
         all_peers.update(self.remote_peer_ids.keys())
         all_peers.update(self.choked_peers)
+        all_peers.update(self.peer_stats.keys())
         if hasattr(self, 'peer_interested'):
             all_peers.update(self.peer_interested.keys())
         if hasattr(self, 'pending_pieces'):
@@ -610,4 +1301,4 @@ class TorrentPeer:
         for sock in all_peers:
             self.safe_close_peer(sock)
 
-        print("[✓] All peers cleaned up.")
+        EVENT_LOG.info("[✓] All peers cleaned up.")
@@ -1,6 +1,7 @@
 import socket
 import hashlib
 import random
+import threading
 from Crypto.Cipher import ARC4
 
 # 768-bit MODP Group (from RFC 2409 Appendix E)
@@ -20,6 +21,7 @@ class EncryptedSocket:
         self.shared_secret = None
         self.rc4_encryptor = None
         self.rc4_decryptor = None
+        self.send_lock = threading.Lock()  # RC4 is a stream cipher: sends must not interleave
 
     def _dh_generate_keypair(self):
         priv = random.randint(2, p - 2)
@@ -35,13 +37,15 @@ class EncryptedSocket:
         return ARC4.new(key), ARC4.new(key)  # (encryptor, decryptor)
 
     def _recv_exact(self, n):
-        data = b''
-        while len(data) < n:
-            chunk = self.sock.recv(n - len(data))
-            if not chunk:
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
+            count = self.sock.recv_into(view[received:])
+            if not count:
                 raise ConnectionError("Connection closed during receive")
-            data += chunk
-        return data
+            received += count
+        return bytes(data)
 
     def perform_handshake_as_initiator(self):
         priv, pub = self._dh_generate_keypair()
@@ -66,8 +70,9 @@ class EncryptedSocket:
         self.shared_secret = shared_secret
 
     def send(self, data):
-        encrypted = self.rc4_encryptor.encrypt(data)
-        self.sock.sendall(encrypted)
+        with self.send_lock:
+            encrypted = self.rc4_encryptor.encrypt(data)
+            self.sock.sendall(encrypted)
 
     def recv(self, n):
         data = self._recv_exact(n)
@@ -76,11 +81,17 @@ class EncryptedSocket:
     def close(self):
         self.sock.close()
 
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
     def getpeername(self):
         return self.sock.getpeername()
 
     def settimeout(self, n):
         self.sock.settimeout(n)
 
+    def setsockopt(self, level, option, value):
+        self.sock.setsockopt(level, option, value)
+
     def fileno(self):
         return self.sock.fileno()
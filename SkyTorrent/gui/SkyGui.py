@@ -8,9 +8,13 @@ from PyQt6.QtGui import QPixmap, QFont, QColor, QPalette, QIcon, QMovie
 from PyQt6.QtCore import Qt, QTimer
 import os
 import threading
-from SkyTorrent.utils.torrent_generator import generate_torrent
-from SkyTorrent.utils.torrent_parser import parse_torrent_file
+from SkyTorrent.utils.torrent_generator import (
+    generate_torrent, choose_piece_length, estimate_metadata, format_size, collect_files
+)
+from SkyTorrent.utils.metadata_cache import MetadataCache
 from SkyTorrent.core.torrent_peer import TorrentPeer
+from SkyTorrent.core.session import Session
+from SkyTorrent.core.stats import format_rate, format_eta
 from SkyTorrent.core.storage_manager import StorageManager
 
 
@@ -107,6 +111,13 @@ class GenerateTorrentScreen(QWidget):
         self.choose_file_btn.clicked.connect(self.choose_file)
         layout.addWidget(self.choose_file_btn)
 
+        self.choose_folder_btn = QPushButton("Choose Folder")
+        self.choose_folder_btn.clicked.connect(self.choose_folder)
+        layout.addWidget(self.choose_folder_btn)
+
+        self.plan_label = QLabel("")
+        layout.addWidget(self.plan_label)
+
         self.tracker_input = QLineEdit("http://localhost:6969/announce")
         layout.addWidget(self.tracker_input)
 
@@ -131,6 +142,26 @@ class GenerateTorrentScreen(QWidget):
         file_path, _ = QFileDialog.getOpenFileName(self, "Select File")
         if file_path:
             self.choose_file_btn.setText(file_path)
+            self.show_plan(file_path)
+
+    def choose_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, "Select Folder")
+        if folder:
+            self.choose_file_btn.setText(folder)
+            self.show_plan(folder)
+
+    def show_plan(self, path):
+        if os.path.isdir(path):
+            files = collect_files(path)
+            size = sum(file_size for _, _, file_size in files)
+            contents = f"{len(files):,} files, {format_size(size)}"
+        else:
+            size = os.path.getsize(path)
+            contents = format_size(size)
+        piece_length = choose_piece_length(size)
+        piece_count, metadata_size = estimate_metadata(size, piece_length)
+        self.plan_label.setText(f"{contents}: {piece_count:,} pieces of {format_size(piece_length)}, "
+                                f"~{format_size(metadata_size)} torrent file")
 
     def generate_torrent_file(self):
         file_path = self.choose_file_btn.text()
@@ -143,8 +174,10 @@ class GenerateTorrentScreen(QWidget):
         file_name = os.path.basename(file_path).split(".")[0]
         out_path = os.path.join(out_dir, file_name + ".torrent")
         try:
-            generate_torrent(file_path, tracker_url, out_path)
-            self.status_label.setText(f"Torrent generated: {out_path}")
+            summary = generate_torrent(file_path, tracker_url, out_path)
+            self.status_label.setText(f"Torrent generated: {out_path}\n"
+                                      f"{summary['piece_count']:,} pieces of {format_size(summary['piece_length'])}, "
+                                      f"metadata {format_size(summary['metadata_size'])}")
             QMessageBox.information(self, "Success", f"Torrent file created at:\n{out_path}")
         except Exception as e:
             self.status_label.setText(f"Error: {e}")
@@ -222,6 +255,8 @@ class DownloadTorrentScreen(QWidget):
     def __init__(self):
         super().__init__()
         self.stacked_widget = None
+        self.session = None  # One listening port and shared budgets for every torrent opened here
+        self.metadata_cache = MetadataCache()  # Torrents opened before load from the index without a parse
 
         # Modern layout
         self.layout = QVBoxLayout()
@@ -300,38 +335,41 @@ class DownloadTorrentScreen(QWidget):
 
     def load_torrent(self):
         import random
-        self.peer_id_label = QLabel()
-        self.layout.insertWidget(2, self.peer_id_label)
-        peer_id = b'-PC0001-' + bytes(f'{random.randint(0, 999999):06}', encoding='utf-8')
-        self.peer_id_label.setText(f"Peer ID: {peer_id.decode('utf-8')}")
+        if self.session is None:
+            peer_id = b'-PC0001-' + bytes(f'{random.randint(0, 999999):06}', encoding='utf-8')
+            self.session = Session(peer_id)
+            self.peer_id_label = QLabel()
+            self.layout.insertWidget(2, self.peer_id_label)
+            self.peer_id_label.setText(f"Peer ID: {peer_id.decode('utf-8')}")
         path, _ = QFileDialog.getOpenFileName(self, "Open .torrent file", "", "Torrent Files (*.torrent)")
         if path:
             try:
-                meta = parse_torrent_file(path)
-                file_path = os.path.join("../files", meta['info']['name'])
-                sm = StorageManager(file_path, meta['info']['length'], meta['info']['piece length'],
-                                    meta['info']['pieces'])
-                peer = TorrentPeer(peer_id, meta, sm)
+                meta = self.metadata_cache.load(path)
+                self.metadata_cache.save()
+                file_path = os.path.join("../files", meta['name'])
+                sm = StorageManager(file_path, meta['length'], meta['piece_length'], meta['pieces'],
+                                    meta['pieces_root'], meta['piece_layers'].get(meta['pieces_root']))
+                peer = TorrentPeer(self.session.peer_id, meta, sm, session=self.session)
                 self.progress.setMaximum(len(sm.bitfield))
                 self.status_label.setText("Downloading...")
-                threading.Thread(target=self.monitor_progress, args=(sm,), daemon=True).start()
+                threading.Thread(target=self.monitor_progress, args=(peer,), daemon=True).start()
                 peer.start()
             except Exception as e:
                 self.status_label.setText(f"Error: {e}")
 
-    def monitor_progress(self, storage):
+    def monitor_progress(self, peer):
         import time
-        connected = 1
-        completed = 0
         while True:
-            done = storage.bitfield.count(True)
-            self.peer_info_label.setText(f"Peers connected: {connected} | Peers completed: {completed}")
-            self.progress.setValue(done)
-            if done == len(storage.bitfield):
-                completed += 1
+            stats = peer.snapshot()
+            completed = sum(1 for p in stats['peers'] if p['pieces'] == stats['num_pieces'])
+            self.peer_info_label.setText(f"Peers connected: {stats['connections']} | Peers completed: {completed}")
+            self.progress.setValue(stats['pieces_done'])
+            if stats['pieces_done'] == stats['num_pieces']:
                 self.status_label.setText("Download complete!")
                 self.back_btn.setVisible(True)
                 break
+            self.status_label.setText(f"Downloading... ↓ {format_rate(stats['download_rate'])} "
+                                      f"↑ {format_rate(stats['upload_rate'])} | ETA {format_eta(stats['eta'])}")
             time.sleep(1)
 
 
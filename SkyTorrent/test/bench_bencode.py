@@ -0,0 +1,76 @@
+# bench_bencode.py
+# Decode/encode throughput of the built-in bencode codec, against bencodepy when it is installed,
+# and info_hash via the raw span vs decode + re-encode.
+#
+#   python -m SkyTorrent.test.bench_bencode [--pieces 50000] [--files 2000]
+
+import argparse
+import hashlib
+import os
+import timeit
+from SkyTorrent.utils import bencode
+
+try:
+    import bencodepy
+except ImportError:
+    bencodepy = None
+
+
+def make_torrent(pieces, files):
+    info = {
+        b'name': b'dataset',
+        b'piece length': 2 ** 20,
+        b'pieces': os.urandom(20 * pieces),
+        b'files': [{b'length': 1000 + i, b'path': [b'dir%d' % (i % 10), b'file%06d.bin' % i]} for i in range(files)],
+    }
+    return bencode.encode({b'announce': b'http://localhost:6969/announce', b'info': info})
+
+
+def make_announce_response(peers):
+    return {b'interval': 1800, b'min interval': 300, b'complete': 10, b'incomplete': 40,
+            b'peers': os.urandom(6 * peers)}
+
+
+def bench(label, func, number):
+    rate = number / min(timeit.repeat(func, number=number, repeat=5))
+    print(f"{label:<42}{rate:>14,.0f}")
+
+
+def reencode_info_hash(raw):
+    """What the parser did before: decode everything, re-encode info, hash that."""
+    return hashlib.sha1(bencode.encode(bencode.decode(raw)[b'info'])).digest()
+
+
+def span_info_hash(raw):
+    _, (start, end) = bencode.decode_with_span(raw, b'info', keep_views=True)
+    return hashlib.sha1(memoryview(raw)[start:end]).digest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bencode codec.")
+    parser.add_argument("--pieces", type=int, default=50000)
+    parser.add_argument("--files", type=int, default=2000)
+    args = parser.parse_args()
+
+    torrent = make_torrent(args.pieces, args.files)
+    response = make_announce_response(50)
+    encoded_response = bencode.encode(response)
+    assert reencode_info_hash(torrent) == span_info_hash(torrent)
+
+    print(f"torrent: {len(torrent) / 2 ** 20:.1f} MiB, {args.pieces} pieces, {args.files} files")
+    print(f"{'operation (ops/s)':<42}{'ops/s':>14}")
+    if bencodepy is not None:
+        bench("bencodepy decode torrent", lambda: bencodepy.decode(torrent), 20)
+    bench("bencode decode torrent", lambda: bencode.decode(torrent), 20)
+    bench("bencode decode torrent (views)", lambda: bencode.decode(torrent, keep_views=True), 20)
+    bench("info_hash: decode + re-encode", lambda: reencode_info_hash(torrent), 20)
+    bench("info_hash: raw span", lambda: span_info_hash(torrent), 20)
+    if bencodepy is not None:
+        bench("bencodepy encode announce response", lambda: bencodepy.encode(response), 50_000)
+        bench("bencodepy decode announce response", lambda: bencodepy.decode(encoded_response), 50_000)
+    bench("bencode encode announce response", lambda: bencode.encode(response), 50_000)
+    bench("bencode decode announce response", lambda: bencode.decode(encoded_response), 50_000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# bench_event_log.py
+# Blocks served per second with a print per block (as before the event log),
+# with the event log recording debug events in its ring, in quiet mode, and
+# with no logging at all. Also the cost of get_needed_piece when the peer has
+# nothing we need, with and without the bitfield dump it used to print.
+# Prints go to a line-buffered /dev/null, which behaves like a terminal.
+#
+#   python -m SkyTorrent.test.bench_event_log [--blocks 20000] [--pieces 5000]
+
+import argparse
+import contextlib
+import os
+import socket
+import threading
+import timeit
+from SkyTorrent.core.event_log import EventLog, DEBUG, WARNING
+from SkyTorrent.core.protocolmessage import ProtocolMessage
+
+BLOCK = 16 * 1024
+
+
+def drain(sock):
+    while sock.recv(1 << 20):
+        pass
+
+
+def serve(sock, data, blocks, log_block):
+    """The work of respond_to_request: frame a block, fill it, send it, log it."""
+    view = memoryview(data)
+    peer = ('127.0.0.1', 6881)
+    for i in range(blocks):
+        begin = (i * BLOCK) % len(data)
+        msg, block = ProtocolMessage.build_response_frame(i, begin, BLOCK)
+        block[:] = view[begin:begin + BLOCK]
+        sock.sendall(msg)
+        log_block(sock, peer, i, begin)
+
+
+def print_per_block(sock, peer, index, begin):
+    print(f"[→] Sent piece {index} [{begin}:{begin + BLOCK}] to {sock.getpeername()}")
+
+
+def logger(log):
+    def log_block(sock, peer, index, begin):
+        log.debug("[→] Sent piece %d [%d:%d] to %s", index, begin, begin + BLOCK, peer)
+    return log_block
+
+
+def no_log(sock, peer, index, begin):
+    pass
+
+
+def get_needed_piece(bitfield, requested, peer_bitfield, dump):
+    for index, their_has in enumerate(peer_bitfield):
+        if their_has and not bitfield[index] and index not in requested:
+            return index
+    if dump:
+        print(bitfield)
+        print(requested)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hot-path logging, print vs event log.")
+    parser.add_argument("--blocks", type=int, default=20000)
+    parser.add_argument("--pieces", type=int, default=5000)
+    args = parser.parse_args()
+
+    data = os.urandom(4 * 2 ** 20)
+    modes = [
+        ("print per block (before)", print_per_block),
+        ("event log, debug into ring", logger(EventLog(level=DEBUG, print_level=WARNING))),
+        ("event log, quiet", logger(EventLog(level=WARNING, print_level=WARNING))),
+        ("no logging", no_log),
+    ]
+
+    with open(os.devnull, 'w', buffering=1) as sink, contextlib.redirect_stdout(sink):
+        results = []
+        for label, log_block in modes:
+            a, b = socket.socketpair()
+            reader = threading.Thread(target=drain, args=(b,), daemon=True)
+            reader.start()
+            elapsed = min(timeit.repeat(lambda: serve(a, data, args.blocks, log_block), number=1, repeat=3))
+            a.close()
+            reader.join()
+            b.close()
+            results.append((label, args.blocks / elapsed, args.blocks * BLOCK / elapsed / 2 ** 20))
+
+        bitfield = [True] * args.pieces
+        peer_bitfield = [True] * args.pieces  # Has nothing we need: the case that printed the bitfield
+        needed = []
+        for label, dump in (("get_needed_piece, printing bitfield (before)", True), ("get_needed_piece", False)):
+            elapsed = min(timeit.repeat(lambda: get_needed_piece(bitfield, set(), peer_bitfield, dump),
+                                        number=200, repeat=3))
+            needed.append((label, 200 / elapsed))
+
+    print(f"{'serving ' + str(args.blocks) + ' blocks':<46}{'blocks/s':>12}{'MiB/s':>10}")
+    for label, rate, throughput in results:
+        print(f"{label:<46}{rate:>12,.0f}{throughput:>10,.0f}")
+    print(f"\n{'peer with nothing we need, ' + str(args.pieces) + ' pieces':<46}{'calls/s':>12}")
+    for label, rate in needed:
+        print(f"{label:<46}{rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
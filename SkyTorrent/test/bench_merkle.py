@@ -0,0 +1,67 @@
+# bench_merkle.py
+# Cost of accepting the last block of a piece: v1 hashes the whole piece once it is complete,
+# v2 checks each 16 KiB block against its leaf hash as it arrives.
+#
+#   python -m SkyTorrent.test.bench_merkle [--max-piece-mb 16]
+
+import argparse
+import hashlib
+import os
+import timeit
+from SkyTorrent.core.piece import Piece
+from SkyTorrent.utils import merkle
+
+BLOCK = merkle.BLOCK_SIZE
+
+
+def fill(piece, data, last=True):
+    """Store every block of `data`; with last=False, all but the final one."""
+    for begin in range(0, len(data) - (0 if last else BLOCK), BLOCK):
+        piece.store_block(begin, data[begin:begin + BLOCK])
+
+
+def v1_last_block(data, expected):
+    piece = Piece(len(data), BLOCK)
+    fill(piece, data, last=False)
+    started = timeit.default_timer()
+    fill_last(piece, data)
+    assert hashlib.sha1(piece.reassemble()).digest() == expected
+    return timeit.default_timer() - started
+
+
+def v2_last_block(data, leaves):
+    piece = Piece(len(data), BLOCK)
+    piece.set_leaf_hashes(leaves)
+    fill(piece, data, last=False)
+    started = timeit.default_timer()
+    fill_last(piece, data)
+    assert piece.is_complete() and piece.is_verified()
+    piece.reassemble()
+    return timeit.default_timer() - started
+
+
+def fill_last(piece, data):
+    begin = len(data) - BLOCK
+    piece.store_block(begin, data[begin:])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark piece completion latency, v1 vs v2.")
+    parser.add_argument("--max-piece-mb", type=int, default=16)
+    args = parser.parse_args()
+
+    print(f"{'piece':>8}{'v1 (ms)':>12}{'v2 (ms)':>12}{'v2 block hashing, spread (ms)':>32}")
+    size = 256 * 1024
+    while size <= args.max_piece_mb * 2 ** 20:
+        data = os.urandom(size)
+        digest = hashlib.sha1(data).digest()
+        leaves = merkle.hash_blocks(data)
+        v1 = min(v1_last_block(data, digest) for _ in range(5))
+        v2 = min(v2_last_block(data, leaves) for _ in range(5))
+        total = min(timeit.repeat(lambda: merkle.hash_blocks(data), number=1, repeat=5))
+        print(f"{size // 1024:>6}Ki{v1 * 1000:>12.2f}{v2 * 1000:>12.2f}{total * 1000:>32.2f}")
+        size *= 4
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+# bench_metadata_cache.py
+# Startup cost of loading a directory of .torrent files: parsing every file vs the metadata index.
+#
+#   python -m SkyTorrent.test.bench_metadata_cache [--torrents 2000] [--pieces 5000]
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from SkyTorrent.utils import bencode
+from SkyTorrent.utils.metadata_cache import MetadataCache
+from SkyTorrent.utils.torrent_parser import parse_torrent_file
+
+
+def make_torrents(directory, count, pieces):
+    for i in range(count):
+        info = {b'name': b'payload%05d' % i, b'piece length': 2 ** 18,
+                b'pieces': os.urandom(20 * pieces), b'length': 2 ** 18 * pieces}
+        with open(os.path.join(directory, f"t{i:05d}.torrent"), 'wb') as f:
+            f.write(bencode.encode({b'announce': b'http://localhost:6969/announce', b'info': info}))
+
+
+def timed(label, func):
+    started = time.perf_counter()
+    result = func()
+    print(f"{label:<34}{time.perf_counter() - started:>9.3f}s")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark torrent metadata loading at startup.")
+    parser.add_argument("--torrents", type=int, default=2000)
+    parser.add_argument("--pieces", type=int, default=5000, help="Piece hashes per torrent")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        directory = os.path.join(root, 'torrents')
+        os.mkdir(directory)
+        make_torrents(directory, args.torrents, args.pieces)
+        index = os.path.join(root, 'index.bin')
+        paths = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+        print(f"{args.torrents} torrents, {args.pieces * 20 / 1024:,.0f} KiB of piece hashes each")
+
+        parsed = timed("parse every file", lambda: [parse_torrent_file(p) for p in paths])
+        cache = MetadataCache(index)
+        timed("cold index (parse + index)", lambda: cache.load_directory(directory))
+        timed("write index", cache.save)
+        print(f"index size: {os.path.getsize(index) / 1024:,.1f} KiB")
+        warm = timed("warm index (read + stat)", lambda: MetadataCache(index).load_directory(directory))
+        assert [t['info_hash'] for t in warm] == [p['info_hash'] for p in parsed]
+        timed("activate one torrent (pieces)", lambda: warm[0]['pieces'])
+        assert warm[0]['pieces'] == bytes(parsed[0]['pieces'])
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
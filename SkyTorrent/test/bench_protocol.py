@@ -0,0 +1,139 @@
+# bench_protocol.py
+# Encode/decode operations per second: original to_bytes codec vs precompiled struct codec.
+#
+#   python -m SkyTorrent.test.bench_protocol
+
+import timeit
+from SkyTorrent.core.protocolmessage import ProtocolMessage
+
+BLOCK = bytes(2 ** 14)
+PIECE_SIZE = 2 ** 18
+
+
+class LegacyProtocolMessage:
+    """The wire codec as it was before the struct rewrite, kept for comparison."""
+
+    @staticmethod
+    def build_have(index):
+        return (5).to_bytes(4, 'big') + b'\x04' + index.to_bytes(4, 'big')
+
+    @staticmethod
+    def build_piece(index, begin, length):
+        payload = (
+                index.to_bytes(4, 'big') +
+                begin.to_bytes(4, 'big') +
+                length.to_bytes(4, 'big')
+        )
+        return len(payload + b'\x06').to_bytes(4, 'big') + b'\x06' + payload
+
+    @staticmethod
+    def build_response(index, begin, block):
+        payload = (
+                index.to_bytes(4, 'big') +
+                begin.to_bytes(4, 'big') +
+                block
+        )
+        return len(payload + b'\x07').to_bytes(4, 'big') + b'\x07' + payload
+
+    @staticmethod
+    def parse_bitfield(bitfield_bytes, num_pieces):
+        bitfield = []
+        for byte in bitfield_bytes:
+            for i in range(8):
+                bit = (byte >> (7 - i)) & 1
+                bitfield.append(bool(bit))
+        return bitfield[:num_pieces]
+
+    @staticmethod
+    def parse_message(sock):
+        header = sock.recv(4)
+        if len(header) < 4:
+            return None, None
+        length = int.from_bytes(header, 'big')
+        if length == 0:
+            return -1, b''
+        msg_id = sock.recv(1)
+        if len(msg_id) < 1:
+            return None, None
+        to_read = length - 1
+        payload = sock.recv(to_read) if to_read > 0 else b''
+        return int.from_bytes(msg_id, 'big'), payload
+
+
+class LoopbackSocket:
+    """Replays the same encoded message forever, like a peer that never stops sending."""
+
+    def __init__(self, message):
+        self.data = message * 64
+        self.pos = 0
+
+    def recv(self, n):
+        if self.pos + n > len(self.data):
+            self.pos = 0
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+
+def legacy_requests():
+    for begin in range(0, PIECE_SIZE, len(BLOCK)):
+        LegacyProtocolMessage.build_piece(1, begin, len(BLOCK))
+
+
+def struct_requests():
+    ProtocolMessage.build_requests(1, PIECE_SIZE, len(BLOCK))
+
+
+def legacy_decode_request(sock):
+    _, payload = LegacyProtocolMessage.parse_message(sock)
+    return (int.from_bytes(payload[0:4], 'big'), int.from_bytes(payload[4:8], 'big'),
+            int.from_bytes(payload[8:12], 'big'))
+
+
+def struct_decode_request(sock):
+    _, payload = ProtocolMessage.parse_message(sock)
+    return ProtocolMessage.parse_block(payload)
+
+
+def legacy_decode_piece(sock):
+    _, payload = LegacyProtocolMessage.parse_message(sock)
+    return int.from_bytes(payload[0:4], 'big'), int.from_bytes(payload[4:8], 'big'), payload[8:]
+
+
+def struct_decode_piece(sock):
+    _, payload = ProtocolMessage.parse_message(sock)
+    return ProtocolMessage.parse_piece(payload)
+
+
+def bench(label, legacy, current, number):
+    old = number / min(timeit.repeat(legacy, number=number, repeat=5))
+    new = number / min(timeit.repeat(current, number=number, repeat=5))
+    print(f"{label:<28}{old:>14,.0f}{new:>14,.0f}{new / old:>9.2f}x")
+
+
+def main():
+    request_msg = ProtocolMessage.build_piece(1, 0, len(BLOCK))
+    piece_msg = ProtocolMessage.build_response(1, 0, BLOCK)
+    bitfield = ProtocolMessage.build_bitfield([True, False] * 2000)[5:]
+
+    print(f"{'operation (ops/s)':<28}{'legacy':>14}{'struct':>14}{'speedup':>10}")
+    bench("encode have", lambda: LegacyProtocolMessage.build_have(1234),
+          lambda: ProtocolMessage.build_have(1234), 200_000)
+    bench("encode request", lambda: LegacyProtocolMessage.build_piece(1, 16384, 16384),
+          lambda: ProtocolMessage.build_piece(1, 16384, 16384), 200_000)
+    bench("encode piece requests (16)", legacy_requests, struct_requests, 20_000)
+    bench("encode piece (16 KiB)", lambda: LegacyProtocolMessage.build_response(1, 0, BLOCK),
+          lambda: ProtocolMessage.build_response(1, 0, BLOCK), 50_000)
+
+    legacy_sock, struct_sock = LoopbackSocket(request_msg), LoopbackSocket(request_msg)
+    bench("decode request", lambda: legacy_decode_request(legacy_sock),
+          lambda: struct_decode_request(struct_sock), 200_000)
+    legacy_sock, struct_sock = LoopbackSocket(piece_msg), LoopbackSocket(piece_msg)
+    bench("decode piece (16 KiB)", lambda: legacy_decode_piece(legacy_sock),
+          lambda: struct_decode_piece(struct_sock), 50_000)
+    bench("decode bitfield (4000)", lambda: LegacyProtocolMessage.parse_bitfield(bitfield, 4000),
+          lambda: ProtocolMessage.parse_bitfield(bitfield, 4000), 2_000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# bench_torrent_generator.py
+# Piece hashing time and peak memory: original read-everything hasher vs the streaming parallel one.
+#
+#   python -m SkyTorrent.test.bench_torrent_generator [--size-mb 512] [--workers 4] [--tree-files 5000]
+#
+# With --tree-files the payload is split into that many small files in nested directories.
+
+import argparse
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from SkyTorrent.utils.torrent_generator import hash_pieces, collect_files, PIECE_LEN
+
+
+def legacy_hash_pieces(file_path, piece_length=PIECE_LEN):
+    """The generator's hashing before streaming: whole file in memory, one piece at a time."""
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    pieces = []
+    for i in range(0, len(content), piece_length):
+        pieces.append(hashlib.sha1(content[i:i + piece_length]).digest())
+    return b''.join(pieces)
+
+
+def legacy_hash_tree(files, piece_length=PIECE_LEN):
+    """Per-file reads glued together in memory, then hashed serially."""
+    content = b''.join(open(path, 'rb').read() for path, _, _ in files)
+    return b''.join(hashlib.sha1(content[i:i + piece_length]).digest() for i in range(0, len(content), piece_length))
+
+
+def make_tree(root, size, count):
+    chunk = size // count
+    for i in range(count):
+        directory = os.path.join(root, f"d{i % 16:02d}", f"s{i % 5}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"f{i:06d}.bin"), 'wb') as f:
+            f.write(os.urandom(chunk))
+
+
+def bench_tree(args, size):
+    root = tempfile.mkdtemp()
+    try:
+        make_tree(root, size, args.tree_files)
+        files = collect_files(root)
+        print(f"{os.cpu_count()} CPUs, {args.tree_files} files, {args.size_mb} MiB total, {PIECE_LEN // 1024} KiB pieces")
+        print(f"{'implementation':<22}{'time':>10}{'MiB/s':>12}{'peak MiB':>14}")
+        legacy = measure("per-file read + serial", lambda: legacy_hash_tree(files), size)
+        streamed = measure("streaming + parallel",
+                           lambda: hash_pieces([(path, s) for path, _, s in files], workers=args.workers), size)
+        assert legacy == streamed, "piece hashes differ"
+    finally:
+        shutil.rmtree(root)
+
+
+def measure(label, func, size):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22}{elapsed:>9.2f}s{size / elapsed / 2 ** 20:>12,.0f}{peak / 2 ** 20:>14,.1f}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark torrent piece hashing.")
+    parser.add_argument("--size-mb", type=int, default=512, help="Size of the generated test file")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing threads (default: CPU count)")
+    parser.add_argument("--tree-files", type=int, default=0, help="Spread the payload over this many files")
+    args = parser.parse_args()
+
+    size = args.size_mb * 2 ** 20
+    if args.tree_files:
+        bench_tree(args, size)
+        return
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(2 ** 20))
+        path = f.name
+    try:
+        print(f"{os.cpu_count()} CPUs, {args.size_mb} MiB file, {PIECE_LEN // 1024} KiB pieces")
+        print(f"{'implementation':<22}{'time':>10}{'MiB/s':>12}{'peak MiB':>14}")
+        legacy = measure("read all + serial", lambda: legacy_hash_pieces(path), size)
+        streamed = measure("streaming + parallel", lambda: hash_pieces(path, workers=args.workers), size)
+        assert legacy == streamed, "piece hashes differ"
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
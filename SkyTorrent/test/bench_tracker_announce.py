@@ -0,0 +1,71 @@
+# bench_tracker_announce.py
+# Loopback announces per second: HTTP tracker (Flask) vs UDP tracker (BEP 15).
+#
+#   python -m SkyTorrent.test.bench_tracker_announce [--seconds 5] [--peers 200]
+
+import argparse
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from werkzeug.serving import make_server
+from SkyTorrent import tracker_server
+from SkyTorrent.tracker.udp_tracker import UDPTrackerServer, UDPTrackerClient
+
+INFO_HASH = os.urandom(20)
+
+
+def bench_http(port, seconds, peer_ids):
+    base = f"http://127.0.0.1:{port}/announce?info_hash={urllib.parse.quote_from_bytes(INFO_HASH)}"
+    count = 0
+    sent = received = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        peer_id = peer_ids[count % len(peer_ids)]
+        url = f"{base}&peer_id={urllib.parse.quote_from_bytes(peer_id)}&port={6881 + count % 1000}&left=1&compact=1"
+        sent += len(url)
+        with urllib.request.urlopen(url) as response:
+            received += len(response.read())
+        count += 1
+    return count, sent, received
+
+
+def bench_udp(port, seconds, peer_ids):
+    client = UDPTrackerClient(f"udp://127.0.0.1:{port}")
+    count = 0
+    received = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        peer_id = peer_ids[count % len(peer_ids)]
+        *_, peers = client.announce(INFO_HASH, peer_id, 6881 + count % 1000, left=1)
+        received += 20 + len(peers)
+        count += 1
+    client.close()
+    return count, 98 * count, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare HTTP and UDP tracker announce throughput.")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--peers", type=int, default=200, help="Distinct peer_ids cycled through")
+    args = parser.parse_args()
+
+    tracker_server.app.logger.disabled = True
+    http_server = make_server("127.0.0.1", 0, tracker_server.app, threaded=True)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    udp_server = UDPTrackerServer(tracker_server.tracker_data, host="127.0.0.1", port=0)
+    udp_server.start()
+
+    peer_ids = [os.urandom(20) for _ in range(args.peers)]
+    print(f"{'transport':<10}{'announces/s':>14}{'req payload':>13}{'resp payload':>14}  (bytes, excluding TCP/HTTP framing)")
+    for name, bench, port in (("HTTP", bench_http, http_server.server_port), ("UDP", bench_udp, udp_server.port)):
+        count, sent, received = bench(port, args.seconds, peer_ids)
+        print(f"{name:<10}{count / args.seconds:>14,.0f}{sent / count:>13.0f}{received / count:>14.0f}")
+
+    http_server.shutdown()
+    udp_server.stop()
+
+
+if __name__ == "__main__":
+    main()
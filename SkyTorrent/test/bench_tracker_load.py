@@ -0,0 +1,114 @@
+# bench_tracker_load.py
+# Loopback load test for the HTTP tracker: announces per second and latency percentiles.
+# The tracker runs in its own process so the load generator does not share its GIL.
+#
+#   python -m SkyTorrent.test.bench_tracker_load [--seconds 10] [--connections 64] [--mode async|flask]
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+import urllib.parse
+
+
+def serve(mode, port):
+    if mode == "async":
+        from SkyTorrent.tracker.async_server import AsyncTrackerServer
+        from SkyTorrent.tracker.swarm_store import SwarmStore
+        AsyncTrackerServer(SwarmStore(), host="127.0.0.1", port=port).run()
+    else:
+        import logging
+        from SkyTorrent import tracker_server
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").disabled = True
+        make_server("127.0.0.1", port, tracker_server.app, threaded=True).serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"tracker did not start on port {port}")
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = 0
+    for line in head.split(b"\r\n"):
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":", 1)[1])
+    await reader.readexactly(length)
+    return head[9:12]
+
+
+async def client(port, deadline, info_hashes, latencies, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    peer_id = urllib.parse.quote_from_bytes(os.urandom(20))
+    count = 0
+    try:
+        while time.perf_counter() < deadline:
+            info_hash = urllib.parse.quote_from_bytes(info_hashes[count % len(info_hashes)])
+            request = (f"GET /announce?info_hash={info_hash}&peer_id={peer_id}&port={6881 + count % 1000}"
+                       f"&left={count % 2}&compact=1 HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n").encode()
+            started = time.perf_counter()
+            writer.write(request)
+            status = await read_response(reader)
+            latencies.append(time.perf_counter() - started)
+            if status != b"200":
+                errors.append(status)
+            count += 1
+    finally:
+        writer.close()
+
+
+async def generate_load(port, seconds, connections, swarms):
+    info_hashes = [os.urandom(20) for _ in range(swarms)]
+    latencies, errors = [], []
+    deadline = time.perf_counter() + seconds
+    await asyncio.gather(*(client(port, deadline, info_hashes, latencies, errors) for _ in range(connections)))
+    return latencies, errors
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the HTTP tracker on loopback.")
+    parser.add_argument("--mode", choices=("async", "flask"), default="async")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--connections", type=int, default=64, help="Concurrent keep-alive clients")
+    parser.add_argument("--swarms", type=int, default=100, help="Distinct info_hashes announced to")
+    args = parser.parse_args()
+
+    port = free_port()
+    server = multiprocessing.Process(target=serve, args=(args.mode, port), daemon=True)
+    server.start()
+    try:
+        wait_for_port(port)
+        latencies, errors = asyncio.run(generate_load(port, args.seconds, args.connections, args.swarms))
+    finally:
+        server.terminate()
+
+    latencies.sort()
+    print(f"mode={args.mode} connections={args.connections} swarms={args.swarms}")
+    print(f"announces/s  {len(latencies) / args.seconds:>12,.0f}")
+    print(f"p50 latency  {percentile(latencies, 0.50) * 1000:>12.2f} ms")
+    print(f"p99 latency  {percentile(latencies, 0.99) * 1000:>12.2f} ms")
+    print(f"errors       {len(errors):>12}")
+
+
+if __name__ == "__main__":
+    main()
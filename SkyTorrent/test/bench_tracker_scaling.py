@@ -0,0 +1,68 @@
+# bench_tracker_scaling.py
+# Announce throughput of the sharded tracker as the worker count grows.
+# Load comes from several client processes so the generator is not the bottleneck.
+#
+#   python -m SkyTorrent.test.bench_tracker_scaling [--workers 1 2 4 8] [--clients 4] [--seconds 10]
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+from SkyTorrent.test.bench_tracker_load import free_port, wait_for_port, generate_load, percentile
+from SkyTorrent.tracker.sharded import run_shard
+
+
+def start_tracker(workers, port):
+    handoff_ports = [free_port() for _ in range(workers)]
+    processes = [
+        multiprocessing.Process(
+            target=run_shard, args=(index, handoff_ports, "127.0.0.1", port),
+            kwargs=dict(interval=1800, peer_timeout=1800, cleanup_interval=60), daemon=True)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    wait_for_port(port)
+    time.sleep(0.5)  # Let every worker bind before load starts, or early connections skew to one
+    return processes
+
+
+def load_worker(args):
+    port, seconds, connections, swarms = args
+    latencies, errors = asyncio.run(generate_load(port, seconds, connections, swarms))
+    return latencies, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure sharded tracker scaling on loopback.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--clients", type=int, default=os.cpu_count(), help="Load generator processes")
+    parser.add_argument("--connections", type=int, default=32, help="Keep-alive connections per client process")
+    parser.add_argument("--swarms", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} client processes x {args.connections} connections")
+    print(f"{'workers':>8}{'announces/s':>14}{'p99 ms':>10}{'speedup':>10}{'errors':>8}")
+    baseline = None
+    with multiprocessing.Pool(args.clients) as pool:
+        for workers in args.workers:
+            port = free_port()
+            processes = start_tracker(workers, port)
+            try:
+                results = pool.map(load_worker, [(port, args.seconds, args.connections, args.swarms)] * args.clients)
+            finally:
+                for process in processes:
+                    process.terminate()
+
+            latencies = sorted(latency for result, _ in results for latency in result)
+            errors = sum(count for _, count in results)
+            rate = len(latencies) / args.seconds
+            baseline = baseline or rate
+            print(f"{workers:>8}{rate:>14,.0f}{percentile(latencies, 0.99) * 1000:>10.2f}"
+                  f"{rate / baseline:>9.2f}x{errors:>8}")
+
+
+if __name__ == "__main__":
+    main()
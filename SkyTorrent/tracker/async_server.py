@@ -0,0 +1,111 @@
+# async_server.py
+# Production HTTP tracker: a minimal HTTP/1.1 server on asyncio, sharing SwarmStore with the UDP endpoint.
+import asyncio
+import time
+from SkyTorrent.tracker.handlers import parse_query, handle_announce, handle_scrape
+from SkyTorrent.tracker.metrics import collect, render, record_request, HTTP_LABELS, OTHER_HTTP
+
+MAX_HEADER_SIZE = 8192
+KEEPALIVE_TIMEOUT = 30  # seconds an idle keep-alive connection is held open
+
+REASONS = {200: b'OK', 400: b'Bad Request', 404: b'Not Found', 405: b'Method Not Allowed',
+           500: b'Internal Server Error'}
+
+
+class AsyncTrackerServer:
+    """
+    Serves /announce and /scrape on one event loop. Only what trackers need
+    from HTTP is implemented: GET, keep-alive and Content-Length responses.
+    Nothing is printed per request unless `verbose` is set.
+    """
+
+    def __init__(self, store, host='0.0.0.0', port=6969, interval=1800, verbose=False, reuse_port=False):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.verbose = verbose
+        self.reuse_port = reuse_port  # Let several processes accept on the same port
+        self.server = None
+
+    def run(self):
+        """Serve until interrupted. Blocks the calling thread."""
+        try:
+            asyncio.run(self.serve_forever())
+        except KeyboardInterrupt:
+            pass
+
+    async def serve_forever(self):
+        self.server = await asyncio.start_server(
+            self.handle_client, self.host, self.port, limit=MAX_HEADER_SIZE, backlog=1024,
+            reuse_port=self.reuse_port or None)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"[*] Async HTTP tracker listening on port {self.port}")
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        ip = writer.get_extra_info('peername')[0]
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError):
+                    break
+
+                request_line, _, headers = head.partition(b'\r\n')
+                parts = request_line.split(b' ')
+                if len(parts) != 3:
+                    writer.write(self.build_response(400, b'Malformed request line', False))
+                    break
+                method, target, version = parts
+                connection = headers.lower()
+                if version == b'HTTP/1.0':
+                    keep_alive = b'connection: keep-alive' in connection
+                else:
+                    keep_alive = b'connection: close' not in connection
+
+                started = time.perf_counter()
+                if method != b'GET':
+                    status, body = 405, b'Only GET is supported'
+                else:
+                    status, body = await self.dispatch(target, ip)
+                record_request(HTTP_LABELS.get(target.partition(b'?')[0], OTHER_HTTP), started, len(body))
+                writer.write(self.build_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, target, ip):
+        """Produce (status, body) for a request; subclasses may await other services here."""
+        return self.route(target, ip)
+
+    def route(self, target, ip):
+        path, _, query_string = target.partition(b'?')
+        if self.verbose:
+            print(f"[*] {path.decode(errors='replace')} from {ip}")
+        try:
+            if path == b'/announce':
+                return 200, handle_announce(self.store, parse_query(query_string), ip, self.interval)
+            if path == b'/scrape':
+                return 200, handle_scrape(self.store, parse_query(query_string))
+            if path == b'/metrics':
+                return 200, render(collect(self.store)).encode()
+            return 404, b'Not found'
+        except Exception as e:
+            return 500, f"Error: {e}".encode()
+
+    @staticmethod
+    def build_response(status, body, keep_alive):
+        return b''.join((
+            b'HTTP/1.1 %d %s\r\n' % (status, REASONS[status]),
+            b'Content-Type: text/plain\r\n',
+            b'Content-Length: %d\r\n' % len(body),
+            b'' if keep_alive else b'Connection: close\r\n',
+            b'\r\n',
+            body,
+        ))
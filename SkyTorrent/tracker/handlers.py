@@ -0,0 +1,61 @@
+# handlers.py
+# Transport-agnostic /announce and /scrape logic, shared by the Flask and asyncio servers.
+import time
+import urllib.parse
+from SkyTorrent.utils import bencode
+
+
+def parse_query(query_string):
+    """
+    Split a raw query string into {key: [values]}, percent-decoding to bytes.
+    Keys may repeat (e.g. several info_hash values in one scrape).
+    """
+    query = {}
+    for param in query_string.split(b"&"):
+        if b"=" in param:
+            k, v = param.split(b"=", 1)
+            query.setdefault(k, []).append(urllib.parse.unquote_to_bytes(v))
+    return query
+
+
+def handle_announce(store, query, ip, interval):
+    """
+    Record an announce and build the bencoded response.
+
+    :param store: SwarmStore holding the swarms
+    :param query: Output of parse_query()
+    :param ip: Address the request came from
+    :param interval: Re-announce interval to hand back, in seconds
+    """
+    info_hash = query[b"info_hash"][0]
+    peer_id = query[b"peer_id"][0]
+    port = int(query[b"port"][0])
+    left = int(query[b"left"][0]) if b"left" in query else None
+    numwant = int(query[b"numwant"][0]) if b"numwant" in query else None
+    event = query[b"event"][0] if b"event" in query else b''
+
+    # Update or add peer; the compact sample excludes the requester
+    compact_peers, complete, incomplete = store.announce(
+        info_hash, peer_id, ip, port, left, time.time(), numwant, event)
+
+    return bencode.encode({
+        b'interval': interval,
+        b'min interval': int(store.min_interval),  # bencode has no floats
+        b'complete': complete,
+        b'incomplete': incomplete,
+        b'peers': compact_peers
+    })
+
+
+def handle_scrape(store, query):
+    """Bencoded scrape for every info_hash in the query; none means every active swarm."""
+    return encode_scrape(store.scrape(query.get(b"info_hash")))
+
+
+def encode_scrape(stats):
+    """Bencode {info_hash: (complete, downloaded, incomplete)} as a scrape response."""
+    files = {
+        info_hash: {b'complete': complete, b'downloaded': downloaded, b'incomplete': incomplete}
+        for info_hash, (complete, downloaded, incomplete) in stats.items()
+    }
+    return bencode.encode({b'files': files})
@@ -0,0 +1,184 @@
+# metrics.py
+# Low-overhead tracker instrumentation, rendered in the Prometheus text format for /metrics.
+import bisect
+import json
+import threading
+import time
+import weakref
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BYTES_BUCKETS = (32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+SWARM_SIZE_BUCKETS = (1, 2, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+EXPIRED_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Metrics:
+    """
+    Counters and histograms kept per thread: recording is an update of a dict
+    no other thread writes, so the hot path takes no lock. Shards are summed
+    only when /metrics is scraped, and shards of finished threads are folded
+    into one so short-lived request threads don't pile up.
+    """
+
+    def __init__(self):
+        self.families = {}  # name → (type, help, buckets)
+        self._local = threading.local()
+        self._shards = []  # (weakref to owning thread, shard)
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text):
+        self.families[name] = ('counter', help_text, None)
+
+    def gauge(self, name, help_text):
+        self.families[name] = ('gauge', help_text, None)
+
+    def histogram(self, name, help_text, buckets):
+        self.families[name] = ('histogram', help_text, tuple(buckets))
+
+    def inc(self, name, labels='', amount=1):
+        """
+        :param labels: Preformatted label pairs, e.g. 'event="started"'
+        """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, value, labels=''):
+        shard = self._shard()
+        key = (name, labels)
+        series = shard.get(key)
+        buckets = self.families[name][2]
+        if series is None:
+            series = shard[key] = [0] * (len(buckets) + 2)  # per-bucket counts, +Inf, sum
+        series[bisect.bisect_left(buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        """All shards summed into {(name, labels): value or histogram series}."""
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread() is None:
+                    merge_into(self._retired, shard)
+                else:
+                    live.append((thread, shard))
+            self._shards = live
+            total = {}
+            merge_into(total, self._retired)
+            for _, shard in live:
+                merge_into(total, shard)
+        return total
+
+    def render(self, values):
+        """Prometheus text exposition of snapshot-shaped `values`."""
+        families = {}
+        for (name, labels), value in values.items():
+            families.setdefault(name, []).append((labels, value))
+
+        lines = []
+        for name, (kind, help_text, buckets) in self.families.items():
+            series = families.get(name)
+            if not series:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(series):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_braces(labels)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ('+Inf',), value):
+                    cumulative += count
+                    le = 'le="%s"' % bound
+                    lines.append(f"{name}_bucket{_braces(labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_braces(labels)} {value[-1]}")
+                lines.append(f"{name}_count{_braces(labels)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+
+def merge_into(total, values):
+    # list() copies the items in one step, so a thread recording meanwhile can't break the iteration
+    for key, value in list(values.items()):
+        if isinstance(value, list):
+            current = total.get(key)
+            total[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            total[key] = total.get(key, 0) + value
+
+
+def _braces(labels, extra=''):
+    labels = ','.join(part for part in (labels, extra) if part)
+    return '{' + labels + '}' if labels else ''
+
+
+METRICS = Metrics()
+METRICS.counter('tracker_announces_total', 'Announces received, by event')
+METRICS.counter('tracker_announces_throttled_total', 'Announces answered from cache because they came before min interval')
+METRICS.histogram('tracker_request_duration_seconds', 'Time to produce a response', LATENCY_BUCKETS)
+METRICS.histogram('tracker_response_bytes', 'Response body size', BYTES_BUCKETS)
+METRICS.gauge('tracker_swarms', 'Swarms with at least one peer')
+METRICS.gauge('tracker_peers', 'Peers across all swarms, by role')
+METRICS.histogram('tracker_swarm_size', 'Peers per swarm', SWARM_SIZE_BUCKETS)
+METRICS.histogram('tracker_cleanup_expired_peers', 'Peers expired per cleanup pass', EXPIRED_BUCKETS)
+
+EVENT_LABELS = {b'': 'event="none"', b'started': 'event="started"',
+                b'completed': 'event="completed"', b'stopped': 'event="stopped"'}
+OTHER_EVENT = 'event="other"'
+HTTP_LABELS = {b'/announce': 'endpoint="announce",transport="http"',
+               b'/scrape': 'endpoint="scrape",transport="http"',
+               b'/metrics': 'endpoint="metrics",transport="http"'}
+OTHER_HTTP = 'endpoint="other",transport="http"'
+UDP_ANNOUNCE = 'endpoint="announce",transport="udp"'
+UDP_SCRAPE = 'endpoint="scrape",transport="udp"'
+UDP_OTHER = 'endpoint="other",transport="udp"'
+
+
+def record_request(labels, started, size):
+    """Record one response: `started` is its time.perf_counter() start, `size` its body length."""
+    METRICS.observe('tracker_request_duration_seconds', time.perf_counter() - started, labels)
+    METRICS.observe('tracker_response_bytes', size, labels)
+
+
+def collect(store):
+    """Recorded metrics plus swarm gauges read from `store` at scrape time."""
+    values = METRICS.snapshot()
+    sizes = [0] * (len(SWARM_SIZE_BUCKETS) + 2)
+    seeders = leechers = 0
+    with store.lock:
+        swarms = len(store.swarms)
+        for swarm in store.swarms.values():
+            seeders += len(swarm.seeders)
+            leechers += len(swarm.leechers)
+            size = len(swarm.peers)
+            sizes[bisect.bisect_left(SWARM_SIZE_BUCKETS, size)] += 1
+            sizes[-1] += size
+    values[('tracker_swarms', '')] = swarms
+    values[('tracker_peers', 'role="seeder"')] = seeders
+    values[('tracker_peers', 'role="leecher"')] = leechers
+    values[('tracker_swarm_size', '')] = sizes
+    return values
+
+
+def render(values):
+    return METRICS.render(values)
+
+
+def encode_values(values):
+    """JSON form of collect() output, for shipping between sharded workers."""
+    return json.dumps([[name, labels, value] for (name, labels), value in values.items()]).encode()
+
+
+def decode_values(data):
+    return {(name, labels): value for name, labels, value in json.loads(data)}
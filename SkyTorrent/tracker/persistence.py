@@ -0,0 +1,119 @@
+# persistence.py
+# Periodic binary snapshots of SwarmStore so swarms survive tracker restarts.
+import os
+import struct
+import threading
+import time
+
+SNAPSHOT_MAGIC = b'SKYT'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct('>4sBdI')  # magic, version, written_at, swarm count
+SWARM_RECORD = struct.Struct('>20sII')  # info_hash, downloaded, peer count
+PEER_RECORD = struct.Struct('>20s6sd?')  # peer_id, compact address, last_seen, seeder
+
+SNAPSHOT_INTERVAL = 60  # seconds
+
+
+def save_snapshot(store, path):
+    """
+    Write every swarm to `path` atomically. The store lock is taken once per
+    swarm while its peers are copied, so announces only ever wait for one swarm.
+    Returns the number of peers written.
+    """
+    with store.lock:
+        info_hashes = set(store.swarms) | set(store.downloaded)
+
+    parts = [b'']  # Header goes in once the swarm count is known
+    swarms = peers = 0
+    for info_hash in info_hashes:
+        with store.lock:
+            swarm = store.swarms.get(info_hash)
+            entries = [PEER_RECORD.pack(e.peer_id, e.compact, e.last_seen, e.seeder)
+                       for e in swarm.peers.values()] if swarm is not None else []
+            downloaded = store.downloaded.get(info_hash, 0)
+        parts.append(SWARM_RECORD.pack(info_hash, downloaded, len(entries)))
+        parts.extend(entries)
+        swarms += 1
+        peers += len(entries)
+    parts[0] = SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, time.time(), swarms)
+
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(b''.join(parts))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    return peers
+
+
+def load_snapshot(store, path, cutoff, owns=None):
+    """
+    Restore swarms from `path`, skipping peers last seen before `cutoff`.
+    Returns the number of peers restored (0 if there is no usable snapshot).
+
+    :param owns: Optional predicate on info_hash; swarms it rejects are skipped
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = memoryview(f.read())
+    except FileNotFoundError:
+        return 0
+
+    if len(data) < SNAPSHOT_HEADER.size:
+        print(f"[!] Ignoring truncated tracker snapshot {path}")
+        return 0
+    magic, version, _, swarm_count = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        print(f"[!] Ignoring tracker snapshot {path}: unknown format")
+        return 0
+
+    restored = 0
+    offset = SNAPSHOT_HEADER.size
+    try:
+        for _ in range(swarm_count):
+            info_hash, downloaded, peer_count = SWARM_RECORD.unpack_from(data, offset)
+            offset += SWARM_RECORD.size
+            peers = []
+            for _ in range(peer_count):
+                peer = PEER_RECORD.unpack_from(data, offset)
+                offset += PEER_RECORD.size
+                if peer[2] >= cutoff:
+                    peers.append(peer)
+            if owns is None or owns(info_hash):
+                store.restore(info_hash, downloaded, peers)
+                restored += len(peers)
+    except struct.error:
+        print(f"[!] Tracker snapshot {path} is truncated; restored what was readable")
+    return restored
+
+
+class SnapshotWriter:
+    """Background thread that saves the store every `interval` seconds and once more on stop()."""
+
+    def __init__(self, store, path, interval=SNAPSHOT_INTERVAL):
+        self.store = store
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.save()
+
+    def save(self):
+        try:
+            return save_snapshot(self.store, self.path)
+        except OSError as e:
+            print(f"[!] Could not write tracker snapshot {self.path}: {e}")
+            return 0
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.save()
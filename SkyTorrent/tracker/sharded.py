@@ -0,0 +1,277 @@
+# sharded.py
+# Multi-process tracker: swarms are sharded by info_hash across worker processes.
+#
+# Every worker accepts HTTP connections on the same port (SO_REUSEPORT), so the
+# kernel spreads clients across cores. A request for a swarm another worker owns
+# is handed off to that worker over a pipelined loopback connection.
+import asyncio
+import collections
+import glob
+import multiprocessing
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from SkyTorrent.tracker.async_server import AsyncTrackerServer
+from SkyTorrent.tracker.handlers import parse_query, handle_announce, encode_scrape
+from SkyTorrent.tracker.metrics import collect, render, merge_into, encode_values, decode_values
+from SkyTorrent.tracker.persistence import SnapshotWriter, load_snapshot, SNAPSHOT_INTERVAL
+from SkyTorrent.tracker.swarm_store import SwarmStore, DEFAULT_NUMWANT, MAX_NUMWANT, MIN_INTERVAL, CACHE_TTL
+
+HANDOFF_HEADER = struct.Struct('>IB')  # payload length, op
+REPLY_HEADER = struct.Struct('>IH')  # body length, HTTP status
+SCRAPE_STATS = struct.Struct('>20sIII')  # info_hash, complete, downloaded, incomplete
+
+OP_ANNOUNCE = 1  # payload: ip length (1 byte), ip, raw query string
+OP_SCRAPE = 2  # payload: concatenated 20-byte info_hashes, empty for all swarms
+OP_METRICS = 3  # payload: empty; reply: the shard's metrics as JSON
+
+CONNECT_RETRIES = 50  # Sibling workers may still be starting up
+CONNECT_RETRY_DELAY = 0.1
+RESTORE_TIMEOUT = 60  # seconds to wait for every worker to read the snapshots before stale ones are removed
+
+SHARD_FILE = re.compile(r'\.shard(\d+)$')
+
+
+def shard_of(info_hash, shards):
+    """Owning shard of a swarm. info_hash is a SHA-1, so its leading bytes are uniform."""
+    return int.from_bytes(info_hash[:4], 'big') % shards
+
+
+class ShardLink:
+    """
+    Persistent connection to a sibling worker. Requests are pipelined and the
+    sibling answers them in order, so replies are matched to a FIFO of futures.
+    """
+
+    def __init__(self, port):
+        self.port = port
+        self.writer = None
+        self.reader_task = None
+        self.pending = collections.deque()
+        self.connecting = asyncio.Lock()
+
+    async def request(self, op, payload):
+        """Send one handoff and wait for its (status, body)."""
+        if self.writer is None or self.writer.is_closing():
+            async with self.connecting:
+                if self.writer is None or self.writer.is_closing():
+                    await self._connect()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.writer.write(HANDOFF_HEADER.pack(len(payload), op) + payload)
+        await self.writer.drain()
+        return await future
+
+    async def _connect(self):
+        for attempt in range(CONNECT_RETRIES):
+            try:
+                reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+                break
+            except OSError:
+                if attempt == CONNECT_RETRIES - 1:
+                    raise
+                await asyncio.sleep(CONNECT_RETRY_DELAY)
+        self.reader_task = asyncio.get_running_loop().create_task(self._read_replies(reader))
+
+    async def _read_replies(self, reader):
+        try:
+            while True:
+                length, status = REPLY_HEADER.unpack(await reader.readexactly(REPLY_HEADER.size))
+                body = await reader.readexactly(length)
+                self.pending.popleft().set_result((status, body))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self.writer.close()
+            while self.pending:
+                self.pending.popleft().set_exception(ConnectionError(f"shard on port {self.port} went away"))
+
+
+class ShardWorker(AsyncTrackerServer):
+    """One worker process: serves clients on the shared port and owns the swarms of its shard."""
+
+    def __init__(self, index, handoff_ports, store, host='0.0.0.0', port=6969, interval=1800):
+        super().__init__(store, host, port, interval, reuse_port=True)
+        self.index = index
+        self.shards = len(handoff_ports)
+        self.handoff_ports = handoff_ports
+        self.links = {}  # shard → ShardLink
+
+    async def serve_forever(self):
+        handoff = await asyncio.start_server(self.handle_handoff, '127.0.0.1', self.handoff_ports[self.index])
+        async with handoff:
+            await super().serve_forever()
+
+    async def dispatch(self, target, ip):
+        path, _, query_string = target.partition(b'?')
+        try:
+            if path == b'/announce':
+                query = parse_query(query_string)
+                owner = shard_of(query[b'info_hash'][0], self.shards)
+                if owner == self.index:
+                    return 200, handle_announce(self.store, query, ip, self.interval)
+                address = ip.encode()
+                return await self.link(owner).request(OP_ANNOUNCE, bytes([len(address)]) + address + query_string)
+            if path == b'/scrape':
+                return 200, encode_scrape(await self.gather_scrape(parse_query(query_string).get(b'info_hash')))
+            if path == b'/metrics':
+                return 200, render(await self.gather_metrics()).encode()
+            return 404, b'Not found'
+        except Exception as e:
+            return 500, f"Error: {e}".encode()
+
+    async def gather_scrape(self, info_hashes):
+        """Scrape stats from every shard that owns one of `info_hashes` (all shards for None)."""
+        if info_hashes is None:
+            wanted = {shard: None for shard in range(self.shards)}
+        else:
+            wanted = collections.defaultdict(list)
+            for info_hash in info_hashes:
+                wanted[shard_of(info_hash, self.shards)].append(info_hash)
+
+        stats = self.store.scrape(wanted.pop(self.index)) if self.index in wanted else {}
+        replies = await asyncio.gather(*(
+            self.link(shard).request(OP_SCRAPE, b''.join(hashes or ())) for shard, hashes in wanted.items()))
+        for status, body in replies:
+            for info_hash, complete, downloaded, incomplete in SCRAPE_STATS.iter_unpack(body):
+                stats[info_hash] = (complete, downloaded, incomplete)
+        return stats
+
+    async def gather_metrics(self):
+        """Metrics of every shard summed, so any worker can answer /metrics for the whole tracker."""
+        values = collect(self.store)
+        replies = await asyncio.gather(*(
+            self.link(shard).request(OP_METRICS, b'') for shard in range(self.shards) if shard != self.index))
+        for status, body in replies:
+            merge_into(values, decode_values(body))
+        return values
+
+    def link(self, shard):
+        link = self.links.get(shard)
+        if link is None:
+            link = self.links[shard] = ShardLink(self.handoff_ports[shard])
+        return link
+
+    async def handle_handoff(self, reader, writer):
+        """Serve pipelined requests forwarded by sibling workers, replying in order."""
+        try:
+            while True:
+                length, op = HANDOFF_HEADER.unpack(await reader.readexactly(HANDOFF_HEADER.size))
+                payload = await reader.readexactly(length)
+                status, body = self.handle_op(op, payload)
+                writer.write(REPLY_HEADER.pack(len(body), status) + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def handle_op(self, op, payload):
+        try:
+            if op == OP_ANNOUNCE:
+                end = 1 + payload[0]
+                ip = payload[1:end].decode()
+                return 200, handle_announce(self.store, parse_query(payload[end:]), ip, self.interval)
+            if op == OP_SCRAPE:
+                hashes = [payload[i:i + 20] for i in range(0, len(payload), 20)] or None
+                stats = self.store.scrape(hashes)
+                return 200, b''.join(SCRAPE_STATS.pack(info_hash, *counts) for info_hash, counts in stats.items())
+            if op == OP_METRICS:
+                return 200, encode_values(collect(self.store))
+            return 400, b'Unknown handoff op'
+        except Exception as e:
+            return 500, f"Error: {e}".encode()
+
+
+def shard_files(state_file):
+    """(shard index, path) of every snapshot written by a shard, leaving out half-written .tmp files."""
+    found = []
+    for path in glob.glob(f"{glob.escape(state_file)}.shard*"):
+        match = SHARD_FILE.search(path[len(state_file):])
+        if match:
+            found.append((int(match.group(1)), path))
+    return sorted(found)
+
+
+def run_shard(index, handoff_ports, host, port, interval, peer_timeout, cleanup_interval,
+              default_numwant=DEFAULT_NUMWANT, max_numwant=MAX_NUMWANT,
+              min_interval=MIN_INTERVAL, cache_ttl=CACHE_TTL, state_file=None, snapshot_interval=SNAPSHOT_INTERVAL,
+              restored_barrier=None):
+    """
+    Worker process entry point.
+
+    :param restored_barrier: multiprocessing.Barrier the workers pass once they have read the
+        snapshots; only then are files of shards beyond the current worker count removed
+    """
+    store = SwarmStore(default_numwant, max_numwant, min_interval, cache_ttl)
+    shards = len(handoff_ports)
+    snapshots = None
+    if state_file:
+        # Read every shard's file so swarms find their owner even if the worker count changed
+        def owns(info_hash):
+            return shard_of(info_hash, shards) == index
+
+        files = shard_files(state_file)
+        restored = sum(load_snapshot(store, path, time.time() - peer_timeout, owns) for _, path in files)
+        print(f"[*] Shard {index} restored {restored} peers")
+        snapshots = SnapshotWriter(store, f"{state_file}.shard{index}", snapshot_interval)
+        snapshots.save()  # Peers restored from other layouts are now in this shard's own file
+        snapshots.start()
+        if restored_barrier is not None:
+            remove_stale_shard_files(index, files, shards, restored_barrier)
+    threading.Thread(target=store.expire_forever, args=(peer_timeout, cleanup_interval), daemon=True).start()
+
+    try:
+        ShardWorker(index, handoff_ports, store, host, port, interval).run()
+    finally:
+        if snapshots is not None:
+            snapshots.stop()
+
+
+def remove_stale_shard_files(index, files, shards, restored_barrier):
+    """Once every worker has read and re-saved the snapshots, drop those of shards that no longer exist."""
+    try:
+        restored_barrier.wait(RESTORE_TIMEOUT)
+    except threading.BrokenBarrierError:
+        print(f"[!] Shard {index}: not every worker restored its snapshot; keeping old shard files")
+        return
+    if index != 0:
+        return
+    for shard, path in files:
+        if shard >= shards:
+            try:
+                os.remove(path)
+                print(f"[*] Removed snapshot {path} of a shard from an earlier, larger run")
+            except OSError as e:
+                print(f"[!] Could not remove {path}: {e}")
+
+
+def run_sharded(workers, host='0.0.0.0', port=6969, handoff_base_port=None, **options):
+    """
+    Start `workers` shard processes sharing `port` and wait for them.
+
+    :param handoff_base_port: First loopback port for worker-to-worker handoffs
+        (worker i listens on handoff_base_port + i); defaults to port + 1
+    :param options: Forwarded to run_shard (interval, peer_timeout, cleanup_interval, ...)
+    """
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        raise SystemExit("[!] Sharded mode needs SO_REUSEPORT, which this platform does not support")
+    base = handoff_base_port or port + 1
+    handoff_ports = [base + i for i in range(workers)]
+
+    if options.get('state_file'):
+        options['restored_barrier'] = multiprocessing.Barrier(workers)
+    processes = [
+        multiprocessing.Process(target=run_shard, args=(index, handoff_ports, host, port), kwargs=options)
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    print(f"[*] Sharded tracker: {workers} workers on port {port}")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()  # Workers got the same SIGINT and save their snapshots on the way out
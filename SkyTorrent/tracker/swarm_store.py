@@ -0,0 +1,325 @@
+# swarm_store.py
+import heapq
+import random
+import socket
+import threading
+import time
+from SkyTorrent.tracker.metrics import METRICS, EVENT_LABELS, OTHER_EVENT
+
+DEFAULT_NUMWANT = 50
+MAX_NUMWANT = 200
+MIN_INTERVAL = 300  # seconds; earlier re-announces get a cached answer and change nothing
+CACHE_TTL = 1.0  # seconds one random peer sample is shared by a swarm's announces
+
+
+def _without_entry(blob, compact):
+    """Compact blob with the `compact` entry cut out, if it is there."""
+    if not compact:
+        return blob
+    pos = blob.find(compact)
+    while pos % 6 and pos != -1:
+        pos = blob.find(compact, pos + 1)  # Match only on entry boundaries
+    return blob if pos == -1 else blob[:pos] + blob[pos + 6:]
+
+
+def _random_window(blob, k):
+    """k consecutive compact entries from a random entry of `blob` on, wrapping around."""
+    count = len(blob) // 6
+    if k >= count:
+        return blob
+    start = random.randrange(count) * 6
+    end = start + k * 6
+    return blob[start:end] if end <= len(blob) else blob[start:] + blob[:end - len(blob)]
+
+
+class PeerEntry:
+    __slots__ = ('peer_id', 'compact', 'last_seen', 'seeder', 'index')
+
+    def __init__(self, peer_id, compact, last_seen, seeder):
+        self.peer_id = peer_id
+        self.compact = compact  # 4-byte IPv4 address + 2-byte port, ready for the response
+        self.last_seen = last_seen
+        self.seeder = seeder
+        self.index = -1  # Position in Swarm.seeders or Swarm.leechers
+
+
+class Swarm:
+    """
+    Peers of one torrent, keyed by peer_id. Seeders and leechers live in two
+    dense arrays so random samples are O(numwant), and each array keeps a
+    cached compact blob that is rebuilt only when its membership changes.
+    """
+
+    def __init__(self):
+        self.peers = {}  # peer_id → PeerEntry
+        self.seeders = []
+        self.leechers = []
+        self._blobs = {True: None, False: None}  # seeder? → joined compact entries
+        self._samples = {True: None, False: None}  # for seeder? → (expires, version, size, blob per group)
+        self._version = 0  # Bumped on every membership change
+
+    def __len__(self):
+        return len(self.peers)
+
+    def upsert(self, peer_id, compact, now, seeder):
+        entry = self.peers.get(peer_id)
+        if entry is None:
+            entry = PeerEntry(peer_id, compact, now, seeder)
+            self.peers[peer_id] = entry
+            self._attach(entry)
+        else:
+            if entry.seeder != seeder:
+                self._detach(entry)
+                entry.seeder = seeder
+                entry.compact = compact
+                self._attach(entry)
+            elif entry.compact != compact:
+                entry.compact = compact
+                self._blobs[seeder] = None
+            entry.last_seen = now
+        return entry
+
+    def remove(self, peer_id):
+        entry = self.peers.pop(peer_id, None)
+        if entry is not None:
+            self._detach(entry)
+        return entry
+
+    def compact_peers(self, exclude=None):
+        """All peers as one compact string, optionally without the requesting peer."""
+        return self.select(len(self.peers), False, exclude)
+
+    def select(self, numwant, for_seeder, exclude=None):
+        """
+        Up to `numwant` compact peers, drawn uniformly at random. Leechers get
+        seeders first and seeders get leechers first; the other group fills the rest.
+        """
+        return b''.join(self._select_parts(numwant, for_seeder, exclude))
+
+    def _select_parts(self, numwant, for_seeder, exclude=None):
+        """select() as one compact blob per group, preferred group first."""
+        requester = self.peers.get(exclude) if exclude is not None else None
+        groups = (self.leechers, self.seeders) if for_seeder else (self.seeders, self.leechers)
+        parts = []
+        remaining = numwant
+        for group in groups:
+            if remaining <= 0:
+                break
+            chunk, count = self._take(group, remaining, requester)
+            parts.append(chunk)
+            remaining -= count
+        return parts
+
+    def cached_select(self, numwant, for_seeder, exclude, now, ttl, sample_size):
+        """
+        Like select(), but drawn from one sample shared by every announce in the
+        next `ttl` seconds, so a flash crowd on one torrent costs one draw per TTL.
+        Each call takes a window at a random offset into the sample, wrapping
+        around, so requesters in the same TTL still get different peers.
+        A sample smaller than sample_size is the whole swarm, so it is only reused
+        while membership is unchanged.
+
+        :param exclude: Requester's compact entry, cut out of the shared sample
+        :param sample_size: Peers per shared sample; at least numwant + 1
+        """
+        cached = self._samples[for_seeder]
+        if cached is None or cached[0] <= now or (cached[1] != self._version and cached[2] < sample_size):
+            parts = self._select_parts(sample_size, for_seeder)
+            cached = self._samples[for_seeder] = (now + ttl, self._version, sum(map(len, parts)) // 6, parts)
+        # Windows are taken per group, so the preferred group still comes first
+        result = []
+        remaining = numwant
+        for part in cached[3]:
+            if remaining <= 0:
+                break
+            window = _random_window(_without_entry(part, exclude), remaining)
+            result.append(window)
+            remaining -= len(window) // 6
+        return b''.join(result)
+
+    def _take(self, group, k, requester):
+        contains_requester = requester is not None and requester.index < len(group) \
+            and group[requester.index] is requester
+        available = len(group) - contains_requester
+        if k >= available:
+            blob = self._blob(group)
+            if not contains_requester:
+                return blob, available
+            start = requester.index * 6
+            return blob[:start] + blob[start + 6:], available
+
+        picked = random.sample(group, k + contains_requester)
+        return b''.join(e.compact for e in picked if e is not requester)[:k * 6], k
+
+    def _blob(self, group):
+        seeder = group is self.seeders
+        blob = self._blobs[seeder]
+        if blob is None:
+            blob = self._blobs[seeder] = b''.join(entry.compact for entry in group)
+        return blob
+
+    def _attach(self, entry):
+        group = self.seeders if entry.seeder else self.leechers
+        entry.index = len(group)
+        group.append(entry)
+        self._blobs[entry.seeder] = None
+        self._version += 1
+
+    def _detach(self, entry):
+        # Swap-remove keeps the array dense in O(1)
+        group = self.seeders if entry.seeder else self.leechers
+        last = group.pop()
+        if last is not entry:
+            last.index = entry.index
+            group[entry.index] = last
+        self._blobs[entry.seeder] = None
+        self._version += 1
+
+
+class SwarmStore:
+    """
+    All swarms known to the tracker, keyed by info_hash. Safe to share
+    between request threads and the cleanup thread.
+
+    Every announce pushes (last_seen, info_hash, peer_id) onto a min-heap.
+    Expiry pops only entries older than the cutoff; entries superseded by a
+    later announce are recognised by their stale last_seen and skipped.
+    """
+
+    def __init__(self, default_numwant=DEFAULT_NUMWANT, max_numwant=MAX_NUMWANT,
+                 min_interval=MIN_INTERVAL, cache_ttl=CACHE_TTL):
+        self.swarms = {}  # info_hash → Swarm
+        self.default_numwant = default_numwant
+        self.max_numwant = max_numwant
+        self.min_interval = min_interval
+        self.cache_ttl = cache_ttl
+        self.expiry_heap = []  # (last_seen, info_hash, peer_id), lazily deleted
+        self.downloaded = {}  # info_hash → 'completed' events seen; survives empty swarms
+        self.lock = threading.Lock()
+
+    def announce(self, info_hash, peer_id, ip, port, left, now, numwant=None, event=b''):
+        """
+        Record an announce. Returns (compact peer sample, complete, incomplete),
+        where complete/incomplete are the swarm's seeder and leecher counts.
+        Scrape counters are updated from `event` and `left` here, never by scanning peers.
+
+        A peer re-announcing within `min_interval` without a state change is
+        throttled: it gets a cached sample and its entry and expiry are left alone.
+        """
+        seeder = left == 0
+        numwant = self.clamp_numwant(numwant)
+        METRICS.inc('tracker_announces_total', EVENT_LABELS.get(event, OTHER_EVENT))
+        if event == b'stopped':
+            with self.lock:
+                self._remove(info_hash, peer_id)
+                swarm = self.swarms.get(info_hash)
+                if swarm is None:
+                    return b'', 0, 0
+                return b'', len(swarm.seeders), len(swarm.leechers)
+
+        compact = compact_address(ip, port)
+        with self.lock:
+            if event == b'completed':
+                self.downloaded[info_hash] = self.downloaded.get(info_hash, 0) + 1
+            swarm = self.swarms.get(info_hash)
+            if swarm is None:
+                swarm = self.swarms[info_hash] = Swarm()
+            entry = swarm.peers.get(peer_id)
+            throttled = entry is not None and event != b'completed' and entry.seeder == seeder \
+                and entry.compact == compact and now - entry.last_seen < self.min_interval
+            if throttled:
+                METRICS.inc('tracker_announces_throttled_total')
+            else:
+                swarm.upsert(peer_id, compact, now, seeder)
+                heapq.heappush(self.expiry_heap, (now, info_hash, peer_id))
+            peers = swarm.cached_select(numwant, seeder, compact, now, self.cache_ttl, self.max_numwant + 1)
+            return peers, len(swarm.seeders), len(swarm.leechers)
+
+    def scrape(self, info_hashes=None):
+        """
+        {info_hash: (complete, downloaded, incomplete)} for the given swarms,
+        or for every active swarm when info_hashes is None.
+        """
+        with self.lock:
+            if info_hashes is None:
+                info_hashes = list(self.swarms)
+            stats = {}
+            for info_hash in info_hashes:
+                swarm = self.swarms.get(info_hash)
+                complete, incomplete = (len(swarm.seeders), len(swarm.leechers)) if swarm else (0, 0)
+                stats[info_hash] = (complete, self.downloaded.get(info_hash, 0), incomplete)
+            return stats
+
+    def restore(self, info_hash, downloaded, peers):
+        """
+        Reload one swarm from a snapshot.
+
+        :param downloaded: Saved 'completed' counter
+        :param peers: Iterable of (peer_id, compact, last_seen, seeder)
+        """
+        with self.lock:
+            if downloaded:
+                self.downloaded[info_hash] = max(downloaded, self.downloaded.get(info_hash, 0))
+            for peer_id, compact, last_seen, seeder in peers:
+                swarm = self.swarms.get(info_hash)
+                if swarm is None:
+                    swarm = self.swarms[info_hash] = Swarm()
+                swarm.upsert(peer_id, compact, last_seen, seeder)
+                heapq.heappush(self.expiry_heap, (last_seen, info_hash, peer_id))
+
+    def clamp_numwant(self, numwant):
+        if numwant is None or numwant < 0:
+            return self.default_numwant
+        return min(numwant, self.max_numwant)
+
+    def remove_peer(self, info_hash, peer_id):
+        with self.lock:
+            self._remove(info_hash, peer_id)
+
+    def expire(self, cutoff):
+        """Drop peers not seen since `cutoff`. Returns how many were removed."""
+        removed = 0
+        heap = self.expiry_heap
+        with self.lock:
+            while heap and heap[0][0] < cutoff:
+                last_seen, info_hash, peer_id = heapq.heappop(heap)
+                swarm = self.swarms.get(info_hash)
+                entry = swarm.peers.get(peer_id) if swarm is not None else None
+                if entry is None or entry.last_seen != last_seen:
+                    continue  # Peer left or announced again since this entry was pushed
+                self._remove(info_hash, peer_id)
+                removed += 1
+        return removed
+
+    def next_expiry(self):
+        """last_seen of the oldest heap entry, or None when the heap is empty."""
+        with self.lock:
+            return self.expiry_heap[0][0] if self.expiry_heap else None
+
+    def expire_forever(self, timeout, max_interval):
+        """
+        Cleanup loop: drop peers silent for `timeout` seconds, sleeping until
+        the oldest peer is due but never longer than `max_interval`.
+        """
+        while True:
+            now = time.time()
+            removed = self.expire(now - timeout)
+            METRICS.observe('tracker_cleanup_expired_peers', removed)
+            if removed:
+                print(f"[*] Cleanup removed {removed} expired peers")
+
+            oldest = self.next_expiry()
+            delay = max_interval if oldest is None else oldest + timeout - now
+            time.sleep(min(max_interval, max(1, delay)))
+
+    def _remove(self, info_hash, peer_id):
+        swarm = self.swarms.get(info_hash)
+        if swarm is None:
+            return
+        swarm.remove(peer_id)
+        if not swarm:
+            del self.swarms[info_hash]
+
+
+def compact_address(ip, port):
+    return socket.inet_aton(ip) + port.to_bytes(2, 'big')
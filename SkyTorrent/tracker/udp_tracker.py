@@ -0,0 +1,212 @@
+# udp_tracker.py
+# UDP tracker protocol (BEP 15): server side for the tracker, client side for TorrentPeer.
+import hashlib
+import hmac
+import os
+import random
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from SkyTorrent.tracker.metrics import record_request, UDP_ANNOUNCE, UDP_SCRAPE, UDP_OTHER
+
+PROTOCOL_ID = 0x41727101980
+
+ACTION_CONNECT = 0
+ACTION_ANNOUNCE = 1
+ACTION_SCRAPE = 2
+ACTION_ERROR = 3
+
+EVENT_NONE = 0
+EVENT_COMPLETED = 1
+EVENT_STARTED = 2
+EVENT_STOPPED = 3
+EVENT_NAMES = {EVENT_NONE: b'', EVENT_COMPLETED: b'completed', EVENT_STARTED: b'started', EVENT_STOPPED: b'stopped'}
+EVENT_IDS = {name: event for event, name in EVENT_NAMES.items()}
+REQUEST_LABELS = {ACTION_ANNOUNCE: UDP_ANNOUNCE, ACTION_SCRAPE: UDP_SCRAPE}
+
+CONNECT_REQUEST = struct.Struct('>QII')  # protocol_id, action, transaction_id
+CONNECT_RESPONSE = struct.Struct('>IIQ')  # action, transaction_id, connection_id
+REQUEST_HEADER = struct.Struct('>QII')  # connection_id, action, transaction_id
+ANNOUNCE_REQUEST = struct.Struct('>QII20s20sQQQIIIiH')
+ANNOUNCE_RESPONSE = struct.Struct('>IIIII')  # action, transaction_id, interval, leechers, seeders
+SCRAPE_ENTRY = struct.Struct('>III')  # seeders, completed, leechers
+RESPONSE_HEADER = struct.Struct('>II')  # action, transaction_id
+
+CONNECTION_ID_LIFETIME = 60  # seconds a connection ID is valid for (BEP 15 allows 2 minutes)
+MAX_SCRAPE_HASHES = 74  # what fits in a single packet
+RETRY_BASE = 15  # seconds; BEP 15 backoff is RETRY_BASE * 2^n
+UDP_MAX_RETRIES = 3
+
+
+class UDPTrackerServer:
+    """
+    BEP 15 tracker endpoint sharing the HTTP tracker's SwarmStore.
+
+    Connection IDs are stateless: an HMAC of the client address and the
+    current time window, so nothing has to be stored per client.
+    """
+
+    def __init__(self, store, host='0.0.0.0', port=6969, interval=1800):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.secret = os.urandom(16)
+        self.sock = None
+        self.running = False
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.host, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.running = True
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        print(f"[*] UDP tracker listening on port {self.port}")
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+
+    def serve_forever(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(2048)
+            except OSError:
+                break
+            started = time.perf_counter()
+            try:
+                response = self.handle_packet(data, addr)
+            except Exception as e:
+                response = None
+                print(f"[!] Bad UDP tracker packet from {addr}: {e}")
+            if len(data) >= 16:
+                action = int.from_bytes(data[8:12], 'big')
+                record_request(REQUEST_LABELS.get(action, UDP_OTHER), started, len(response or b''))
+            if response:
+                self.sock.sendto(response, addr)
+
+    def handle_packet(self, data, addr):
+        if len(data) < 16:
+            return None
+        connection_id, action, transaction_id = REQUEST_HEADER.unpack_from(data)
+
+        if action == ACTION_CONNECT:
+            if connection_id != PROTOCOL_ID:
+                return None
+            return CONNECT_RESPONSE.pack(ACTION_CONNECT, transaction_id, self._connection_id(addr))
+
+        if not self._valid_connection_id(connection_id, addr):
+            return self._error(transaction_id, b"invalid connection id")
+
+        if action == ACTION_ANNOUNCE:
+            return self._announce(data, addr, transaction_id)
+        if action == ACTION_SCRAPE:
+            return self._scrape(data, transaction_id)
+        return self._error(transaction_id, b"unknown action")
+
+    def _announce(self, data, addr, transaction_id):
+        if len(data) < ANNOUNCE_REQUEST.size:
+            return self._error(transaction_id, b"announce too short")
+        (_, _, _, info_hash, peer_id, downloaded, left, uploaded,
+         event, _ip, _key, numwant, port) = ANNOUNCE_REQUEST.unpack_from(data)
+
+        peers, complete, incomplete = self.store.announce(
+            info_hash, peer_id, addr[0], port, left, time.time(),
+            numwant if numwant >= 0 else None, EVENT_NAMES.get(event, b''))
+
+        return ANNOUNCE_RESPONSE.pack(ACTION_ANNOUNCE, transaction_id, self.interval, incomplete, complete) + peers
+
+    def _scrape(self, data, transaction_id):
+        hashes = data[16:16 + 20 * MAX_SCRAPE_HASHES]
+        info_hashes = [hashes[i:i + 20] for i in range(0, len(hashes) - len(hashes) % 20, 20)]
+        stats = self.store.scrape(info_hashes)
+        response = [RESPONSE_HEADER.pack(ACTION_SCRAPE, transaction_id)]
+        for info_hash in info_hashes:
+            response.append(SCRAPE_ENTRY.pack(*stats[info_hash]))
+        return b''.join(response)
+
+    def _error(self, transaction_id, message):
+        return RESPONSE_HEADER.pack(ACTION_ERROR, transaction_id) + message
+
+    def _connection_id(self, addr, window=None):
+        if window is None:
+            window = int(time.time() // CONNECTION_ID_LIFETIME)
+        mac = hmac.new(self.secret, f"{addr[0]}:{addr[1]}:{window}".encode(), hashlib.sha1).digest()
+        return int.from_bytes(mac[:8], 'big')
+
+    def _valid_connection_id(self, connection_id, addr):
+        window = int(time.time() // CONNECTION_ID_LIFETIME)
+        return connection_id in (self._connection_id(addr, window), self._connection_id(addr, window - 1))
+
+
+class UDPTrackerClient:
+    """BEP 15 announcer with retransmit backoff and connection ID reuse."""
+
+    def __init__(self, url, max_retries=UDP_MAX_RETRIES):
+        parsed = urllib.parse.urlparse(url)
+        self.address = (parsed.hostname, parsed.port or 80)
+        self.max_retries = max_retries
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.connection_id = None
+        self.connected_at = 0
+
+    def close(self):
+        self.sock.close()
+
+    def announce(self, info_hash, peer_id, port, downloaded=0, left=0, uploaded=0, event=b'', numwant=-1):
+        """Returns (interval, leechers, seeders, compact peers)."""
+        connection_id = self._connect()
+        transaction_id = random.getrandbits(32)
+        request = ANNOUNCE_REQUEST.pack(
+            connection_id, ACTION_ANNOUNCE, transaction_id, info_hash, peer_id,
+            downloaded, left, uploaded, EVENT_IDS.get(event, EVENT_NONE), 0, random.getrandbits(32), numwant, port)
+        response = self._request(request, transaction_id, ACTION_ANNOUNCE)
+        _, _, interval, leechers, seeders = ANNOUNCE_RESPONSE.unpack_from(response)
+        return interval, leechers, seeders, response[ANNOUNCE_RESPONSE.size:]
+
+    def scrape(self, info_hashes):
+        """Returns [(seeders, completed, leechers), ...] in request order."""
+        connection_id = self._connect()
+        transaction_id = random.getrandbits(32)
+        request = REQUEST_HEADER.pack(connection_id, ACTION_SCRAPE, transaction_id) + b''.join(info_hashes)
+        response = self._request(request, transaction_id, ACTION_SCRAPE)
+        return [SCRAPE_ENTRY.unpack_from(response, offset)
+                for offset in range(RESPONSE_HEADER.size, len(response), SCRAPE_ENTRY.size)]
+
+    def _connect(self):
+        if self.connection_id is not None and time.monotonic() - self.connected_at < CONNECTION_ID_LIFETIME:
+            return self.connection_id
+        transaction_id = random.getrandbits(32)
+        request = CONNECT_REQUEST.pack(PROTOCOL_ID, ACTION_CONNECT, transaction_id)
+        response = self._request(request, transaction_id, ACTION_CONNECT)
+        _, _, self.connection_id = CONNECT_RESPONSE.unpack_from(response)
+        self.connected_at = time.monotonic()
+        return self.connection_id
+
+    def _request(self, request, transaction_id, action):
+        for attempt in range(self.max_retries + 1):
+            self.sock.sendto(request, self.address)
+            deadline = time.monotonic() + RETRY_BASE * 2 ** attempt
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+                try:
+                    response, _ = self.sock.recvfrom(65536)
+                except socket.timeout:
+                    break
+                if len(response) < RESPONSE_HEADER.size:
+                    continue
+                got_action, got_transaction = RESPONSE_HEADER.unpack_from(response)
+                if got_transaction != transaction_id:
+                    continue  # Late reply to an earlier attempt
+                if got_action == ACTION_ERROR:
+                    self.connection_id = None
+                    raise ConnectionError(f"Tracker error: {response[8:].decode(errors='ignore')}")
+                if got_action == action:
+                    return response
+        raise TimeoutError(f"UDP tracker {self.address[0]}:{self.address[1]} did not respond")
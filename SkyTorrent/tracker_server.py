@@ -1,11 +1,18 @@
 from flask import Flask, request, Response
+import os
 import time
-import bencodepy
 import threading
-import urllib.parse
+import argparse
+from SkyTorrent.tracker.swarm_store import SwarmStore, DEFAULT_NUMWANT, MAX_NUMWANT, MIN_INTERVAL, CACHE_TTL
+from SkyTorrent.tracker.handlers import parse_query, handle_announce, handle_scrape
+from SkyTorrent.tracker.async_server import AsyncTrackerServer
+from SkyTorrent.tracker.udp_tracker import UDPTrackerServer
+from SkyTorrent.tracker.persistence import SnapshotWriter, load_snapshot, SNAPSHOT_INTERVAL
+from SkyTorrent.tracker.sharded import run_sharded
+from SkyTorrent.tracker.metrics import collect, render, record_request, HTTP_LABELS, CONTENT_TYPE
 
 app = Flask(__name__)
-tracker_data = {}  # info_hash → list of peers
+tracker_data = SwarmStore()  # info_hash → Swarm
 
 PEER_TIMEOUT = 1800  # seconds
 CLEANUP_INTERVAL = 60
@@ -13,90 +20,91 @@ CLEANUP_INTERVAL = 60
 
 def cleanup_peers():
     print("[*] Cleanup thread started")
-    while True:
-        now = time.time()
-        for info_hash, peers in list(tracker_data.items()):
-            print("[*] Running cleanup for:", info_hash)
-            print(tracker_data)
-            tracker_data[info_hash] = [
-                peer for peer in peers if now - peer['last_seen'] < PEER_TIMEOUT
-            ]
-        time.sleep(CLEANUP_INTERVAL)
+    tracker_data.expire_forever(PEER_TIMEOUT, CLEANUP_INTERVAL)
 
 
 @app.route("/announce", methods=["GET"])
 def announce():
     try:
-        print("[*] Incoming /announce request")
         print(f"[*] /announce from {request.remote_addr}")
-        print(f"    Query: {request.query_string!r}")
-
-        # Step 1: Parse raw query string as bytes → list of (key, value)
-        raw_params = request.query_string.split(b"&")
-        query = {}
-        for param in raw_params:
-            if b"=" in param:
-                k, v = param.split(b"=", 1)
-                query[k] = v
-
-        # Step 2: Decode percent-encoded values safely
-        info_hash_bytes = urllib.parse.unquote_to_bytes(query[b"info_hash"])
-        peer_id_bytes = urllib.parse.unquote_to_bytes(query[b"peer_id"])
-        port = int(query[b"port"].decode("ascii"))
-        ip = request.remote_addr
-
-        print(f"[#] Clean decoded info_hash: {info_hash_bytes.hex()}")
-        print(f"[#] Decoded peer_id: {peer_id_bytes}")
-        print(f"[#] Decoded port: {port}")
-
-        peer = {
-            "ip": ip,
-            "port": port,
-            "peer_id": peer_id_bytes,
-            "last_seen": time.time()
-        }
-
-        print(peer)
-
-        if info_hash_bytes not in tracker_data:
-            tracker_data[info_hash_bytes] = []
-
-        existing_peers = tracker_data.get(info_hash_bytes, [])
-
-        # Build peer list before updating
-        compact_peers = b''
-        for p in existing_peers:
-            if p['peer_id'] != peer['peer_id']:  # Avoid returning self
-                ip_parts = [int(part) for part in p['ip'].split('.')]
-                compact_peers += bytes(ip_parts) + p['port'].to_bytes(2, 'big')
-
-        # Update or add peer
-        for i, existing in enumerate(existing_peers):
-            if existing['peer_id'] == peer['peer_id']:
-                existing_peers[i] = peer
-                break
-        else:
-            existing_peers.append(peer)
-
-        tracker_data[info_hash_bytes] = existing_peers
-
-        print(f"[#] All peers stored for hash {info_hash_bytes.hex()}:")
-        for p in tracker_data[info_hash_bytes]:
-            print(f"   - {p['ip']}:{p['port']} ({p['peer_id'].decode(errors='ignore')})")
+        started = time.perf_counter()
+        body = handle_announce(tracker_data, parse_query(request.query_string), request.remote_addr, PEER_TIMEOUT)
+        record_request(HTTP_LABELS[b'/announce'], started, len(body))
+        return Response(body, content_type='text/plain')
 
-        print(f"[#] Current peer requesting: {ip}:{port}")
+    except Exception as e:
+        return Response(f"Error: {e}", status=500)
 
-        response = {
-            b'interval': PEER_TIMEOUT,
-            b'peers': compact_peers
-        }
 
-        return Response(bencodepy.encode(response), content_type='text/plain')
+@app.route("/scrape", methods=["GET"])
+def scrape():
+    try:
+        started = time.perf_counter()
+        body = handle_scrape(tracker_data, parse_query(request.query_string))
+        record_request(HTTP_LABELS[b'/scrape'], started, len(body))
+        return Response(body, content_type='text/plain')
 
     except Exception as e:
         return Response(f"Error: {e}", status=500)
 
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(render(collect(tracker_data)), content_type=CONTENT_TYPE)
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the SkyTorrent tracker.")
+    parser.add_argument("--mode", choices=("flask", "async", "sharded"), default="flask",
+                        help="flask: development server with per-request logging; "
+                             "async: asyncio HTTP server for production; "
+                             "sharded: asyncio workers in several processes, swarms split by info_hash")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes in sharded mode")
+    parser.add_argument("--handoff-port", type=int, default=0,
+                        help="First loopback port for worker handoffs in sharded mode (default: --port + 1)")
+    parser.add_argument("--port", type=int, default=6969, help="HTTP listen port")
+    parser.add_argument("--udp-port", type=int, default=6969, help="UDP tracker (BEP 15) port, 0 to disable")
+    parser.add_argument("--default-numwant", type=int, default=DEFAULT_NUMWANT,
+                        help="Peers returned when the client sends no numwant")
+    parser.add_argument("--max-numwant", type=int, default=MAX_NUMWANT,
+                        help="Upper bound on peers returned per announce")
+    parser.add_argument("--min-interval", type=int, default=MIN_INTERVAL,
+                        help="Seconds a peer must wait between announces before they are processed again")
+    parser.add_argument("--cache-ttl", type=float, default=CACHE_TTL,
+                        help="Seconds a swarm's peer sample is reused across announces (0 to disable)")
+    parser.add_argument("--state-file", default="tracker_state.bin",
+                        help="Swarm snapshot reloaded on startup; empty to disable persistence")
+    parser.add_argument("--snapshot-interval", type=float, default=SNAPSHOT_INTERVAL,
+                        help="Seconds between swarm snapshots")
+    args = parser.parse_args()
+
+    if args.mode == "sharded":
+        # Each worker owns its store, cleanup and snapshots; UDP is served only in single-process modes
+        run_sharded(args.workers, port=args.port, handoff_base_port=args.handoff_port,
+                    interval=PEER_TIMEOUT, peer_timeout=PEER_TIMEOUT, cleanup_interval=CLEANUP_INTERVAL,
+                    default_numwant=args.default_numwant, max_numwant=args.max_numwant,
+                    min_interval=args.min_interval, cache_ttl=args.cache_ttl,
+                    state_file=args.state_file, snapshot_interval=args.snapshot_interval)
+        raise SystemExit
+
+    tracker_data.default_numwant = args.default_numwant
+    tracker_data.max_numwant = args.max_numwant
+    tracker_data.min_interval = args.min_interval
+    tracker_data.cache_ttl = args.cache_ttl
+    snapshots = None
+    if args.state_file:
+        restored = load_snapshot(tracker_data, args.state_file, time.time() - PEER_TIMEOUT)
+        print(f"[*] Restored {restored} peers from {args.state_file}")
+        snapshots = SnapshotWriter(tracker_data, args.state_file, args.snapshot_interval)
+        snapshots.start()
     threading.Thread(target=cleanup_peers, daemon=True).start()
-    app.run(host="0.0.0.0", port=6969)
+    if args.udp_port:
+        UDPTrackerServer(tracker_data, port=args.udp_port, interval=PEER_TIMEOUT).start()
+    try:
+        if args.mode == "async":
+            AsyncTrackerServer(tracker_data, port=args.port, interval=PEER_TIMEOUT).run()
+        else:
+            app.run(host="0.0.0.0", port=args.port)
+    finally:
+        if snapshots is not None:
+            snapshots.stop()
@@ -0,0 +1,178 @@
+# bencode.py
+# Bencode encoder/decoder. Decoding works over a memoryview, so large strings
+# (the `pieces` table) can be handed out as views instead of copies, and the raw
+# byte span of a value (the `info` dict) can be hashed exactly as it was sent.
+import re
+
+VIEW_THRESHOLD = 1024  # Strings at least this long stay memoryviews when keep_views is set
+
+_STRING_LENGTH = re.compile(rb'(0|[1-9][0-9]*):')
+_INTEGER = re.compile(rb'i(0|-?[1-9][0-9]*)e')
+
+
+class BencodeError(ValueError):
+    pass
+
+
+def encode(obj):
+    """Bencode ints, byte strings (bytes, bytearray, memoryview, str), lists and dicts."""
+    parts = []
+    _encode(obj, parts.append)
+    return b''.join(parts)
+
+
+def decode(data, keep_views=False):
+    """
+    Decode one bencoded value that spans all of `data`. Strings come back as
+    bytes, or as memoryview slices of `data` when keep_views is set and they
+    are at least VIEW_THRESHOLD long. Dict keys are always bytes.
+    """
+    decoder = _Decoder(data, keep_views)
+    try:
+        value, end = decoder.value(0)
+    except IndexError:
+        raise BencodeError("Truncated bencoded data") from None
+    except RecursionError:
+        raise BencodeError("Bencoded data is nested too deeply") from None
+    if end != len(decoder.view):
+        raise BencodeError(f"Trailing data after offset {end}")
+    return value
+
+
+def decode_with_span(data, key, keep_views=False):
+    """
+    Decode a top-level dict and return (dict, span), where span is the
+    (start, end) byte range that encoded `key`'s value (None if the key is
+    missing). Hashing that slice gives e.g. the info_hash without re-encoding.
+    """
+    decoder = _Decoder(data, keep_views)
+    view = decoder.view
+    result = {}
+    span = None
+    try:
+        if view[0] != 0x64:
+            raise BencodeError("Expected a dictionary at offset 0")
+        pos = 1
+        while view[pos] != 0x65:
+            name, pos = decoder.string(pos, False)
+            start = pos
+            result[name], pos = decoder.value(pos)
+            if name == key:
+                span = (start, pos)
+    except IndexError:
+        raise BencodeError("Truncated bencoded data") from None
+    except RecursionError:
+        raise BencodeError("Bencoded data is nested too deeply") from None
+    if pos + 1 != len(view):
+        raise BencodeError(f"Trailing data after offset {pos + 1}")
+    return result, span
+
+
+class _Decoder:
+    __slots__ = ('view', 'keep_views')
+
+    def __init__(self, data, keep_views):
+        self.view = data if isinstance(data, memoryview) else memoryview(data)
+        self.keep_views = keep_views
+
+    def value(self, pos):
+        """Decode the value starting at `pos`. Returns (value, offset just past it)."""
+        view = self.view
+        c = view[pos]
+        if 0x30 <= c <= 0x39:  # 0-9: string
+            return self.string(pos, self.keep_views)
+        if c == 0x64:  # d
+            result = {}
+            pos += 1
+            while view[pos] != 0x65:
+                key, pos = self.string(pos, False)
+                result[key], pos = self.value(pos)
+            return result, pos + 1
+        if c == 0x6C:  # l
+            result = []
+            pos += 1
+            while view[pos] != 0x65:
+                item, pos = self.value(pos)
+                result.append(item)
+            return result, pos + 1
+        if c == 0x69:  # i
+            match = _INTEGER.match(view, pos)
+            if match is None:
+                raise BencodeError(f"Malformed integer at offset {pos}")
+            return int(match.group(1)), match.end()
+        raise BencodeError(f"Unexpected byte {c:#04x} at offset {pos}")
+
+    def string(self, pos, allow_view):
+        match = _STRING_LENGTH.match(self.view, pos)
+        if match is None:
+            raise BencodeError(f"Malformed string length at offset {pos}")
+        start = match.end()
+        end = start + int(match.group(1))
+        if end > len(self.view):
+            raise BencodeError(f"String at offset {pos} runs past the end of the data")
+        chunk = self.view[start:end]
+        if allow_view and end - start >= VIEW_THRESHOLD:
+            return chunk, end
+        return chunk.tobytes(), end
+
+
+def _encode_bytes(obj, append):
+    append(b'%d:' % len(obj))
+    append(obj)
+
+
+def _encode_view(obj, append):
+    append(b'%d:' % obj.nbytes)
+    append(obj)
+
+
+def _encode_str(obj, append):
+    _encode_bytes(obj.encode(), append)
+
+
+def _encode_int(obj, append):
+    append(b'i%de' % obj)
+
+
+def _encode_list(obj, append):
+    append(b'l')
+    for item in obj:
+        _encode(item, append)
+    append(b'e')
+
+
+def _encode_dict(obj, append):
+    append(b'd')
+    # Keys sort as raw byte strings
+    items = sorted(((key.encode() if isinstance(key, str) else bytes(key), value) for key, value in obj.items()),
+                   key=lambda item: item[0])
+    for key, value in items:
+        _encode_bytes(key, append)
+        _encode(value, append)
+    append(b'e')
+
+
+_ENCODERS = {
+    bytes: _encode_bytes,
+    bytearray: _encode_bytes,
+    memoryview: _encode_view,
+    str: _encode_str,
+    int: _encode_int,
+    bool: _encode_int,
+    list: _encode_list,
+    tuple: _encode_list,
+    dict: _encode_dict,
+}
+
+
+def _encode(obj, append):
+    encoder = _ENCODERS.get(type(obj))
+    if encoder is None:
+        # Subclasses (OrderedDict, IntEnum, ...) fall back to their base type
+        for base, candidate in _ENCODERS.items():
+            if isinstance(obj, base):
+                encoder = candidate
+                break
+        else:
+            raise BencodeError(f"Cannot bencode {type(obj).__name__}")
+    encoder(obj, append)
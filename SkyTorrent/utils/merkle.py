@@ -0,0 +1,80 @@
+# merkle.py
+# BitTorrent v2 (BEP 52) hash trees: SHA-256 over 16 KiB blocks, one tree per file.
+# Leaves past the end of a file are zero hashes, and every layer is padded out to a
+# power of two with the root of an all-padding subtree of that height.
+import hashlib
+
+BLOCK_SIZE = 16 * 1024
+HASH_SIZE = 32
+ZERO_HASH = bytes(HASH_SIZE)
+
+_pad_hashes = [ZERO_HASH]  # _pad_hashes[level] = root of 2**level zero leaves
+
+
+def pad_hash(level):
+    while len(_pad_hashes) <= level:
+        last = _pad_hashes[-1]
+        _pad_hashes.append(hashlib.sha256(last + last).digest())
+    return _pad_hashes[level]
+
+
+def next_power_of_two(n):
+    return 1 << max(n - 1, 0).bit_length()
+
+
+def log2(n):
+    """Exponent of a power of two."""
+    return n.bit_length() - 1
+
+
+def split_hashes(data):
+    """Concatenated 32-byte hashes → list of bytes."""
+    return [bytes(data[i:i + HASH_SIZE]) for i in range(0, len(data), HASH_SIZE)]
+
+
+def hash_blocks(data):
+    """SHA-256 of every 16 KiB block of `data` (the last may be short), concatenated."""
+    sha256 = hashlib.sha256
+    return b''.join(sha256(data[i:i + BLOCK_SIZE]).digest() for i in range(0, len(data), BLOCK_SIZE))
+
+
+def merkle_layers(nodes, width, level=0):
+    """
+    Every layer of the tree over `nodes`, bottom first, each padded to its width.
+
+    :param nodes: Hashes at `level` (0 = leaves), left to right
+    :param width: Power-of-two node count of the bottom layer
+    :return: [bottom layer, ..., [root]]
+    """
+    if len(nodes) > width:
+        raise ValueError(f"{len(nodes)} hashes do not fit a layer of {width}")
+    layer = list(nodes) + [pad_hash(level)] * (width - len(nodes))
+    layers = [layer]
+    sha256 = hashlib.sha256
+    while len(layer) > 1:
+        layer = [sha256(layer[i] + layer[i + 1]).digest() for i in range(0, len(layer), 2)]
+        layers.append(layer)
+    return layers
+
+
+def merkle_root(nodes, width, level=0):
+    return merkle_layers(nodes, width, level)[-1][0]
+
+
+def leaf_width(length, piece_length):
+    """
+    Leaves under one piece-layer node. Files of more than one piece have a
+    piece layer (piece_length / 16 KiB leaves per node); a smaller file is a
+    single tree sized to its own block count.
+    """
+    blocks = -(-length // BLOCK_SIZE)
+    if length > piece_length:
+        return piece_length // BLOCK_SIZE
+    return next_power_of_two(blocks)
+
+
+def file_root(piece_roots, length, piece_length):
+    """pieces root of a file from its piece-layer hashes (or, for a one-piece file, its only subtree root)."""
+    if length <= piece_length:
+        return piece_roots[0]
+    return merkle_root(piece_roots, next_power_of_two(len(piece_roots)), log2(piece_length // BLOCK_SIZE))
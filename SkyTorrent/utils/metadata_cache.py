@@ -0,0 +1,247 @@
+# metadata_cache.py
+# On-disk index of parsed .torrent metadata, so a client that loads thousands of
+# torrents at startup only parses the ones that changed since the last run.
+import fnmatch
+import os
+import struct
+import threading
+from SkyTorrent.utils import bencode
+from SkyTorrent.utils.torrent_parser import parse_torrent
+
+DEFAULT_INDEX = 'torrent_index.bin'
+
+INDEX_MAGIC = b'SKYM'
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct('>4sBI')  # magic, version, entry count
+# path length, mtime_ns, file size, info_hash, meta version, piece length, payload length,
+# pieces offset, pieces size, announce length, name length, files blob length
+ENTRY_RECORD = struct.Struct('>HqQ20sBIQQQHHI')
+
+
+class IndexEntry:
+    __slots__ = ('path', 'mtime_ns', 'size', 'info_hash', 'meta_version', 'piece_length', 'length',
+                 'pieces_offset', 'pieces_size', 'announce', 'name', 'files_blob')
+
+    def __init__(self, path, mtime_ns, size, info_hash, meta_version, piece_length, length,
+                 pieces_offset, pieces_size, announce, name, files_blob):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.info_hash = info_hash
+        self.meta_version = meta_version
+        self.piece_length = piece_length
+        self.length = length
+        self.pieces_offset = pieces_offset  # Where the piece hashes sit inside the .torrent file
+        self.pieces_size = pieces_size
+        self.announce = announce
+        self.name = name
+        self.files_blob = files_blob  # Bencoded file list; b'' for a single-file torrent
+
+    def matches(self, st):
+        return self.mtime_ns == st.st_mtime_ns and self.size == st.st_size
+
+    def pack(self):
+        path, announce, name = self.path.encode(), self.announce.encode(), self.name.encode()
+        return ENTRY_RECORD.pack(len(path), self.mtime_ns, self.size, self.info_hash, self.meta_version,
+                                 self.piece_length, self.length, self.pieces_offset, self.pieces_size, len(announce),
+                                 len(name), len(self.files_blob)) + path + announce + name + self.files_blob
+
+
+class TorrentMetadata(dict):
+    """
+    The same dict parse_torrent_file() returns, except that 'pieces' and
+    'files' are filled in on first access: the piece hashes are read from the
+    .torrent file itself, so torrents that are listed but never started cost
+    only their index entry. v2 hash data (piece layers, per-file roots) comes
+    from a full parse of the file on first access. keys()/items() show just
+    the fields loaded so far.
+    """
+    V2_KEYS = ('info_hash_v2', 'pieces_root', 'piece_layers')
+    LAZY_KEYS = ('pieces', 'files') + V2_KEYS
+
+    def __init__(self, entry):
+        super().__init__(announce=entry.announce, info_hash=entry.info_hash, name=entry.name,
+                         piece_length=entry.piece_length, length=entry.length, meta_version=entry.meta_version)
+        self.entry = entry
+
+    def __missing__(self, key):
+        if key not in self.LAZY_KEYS:
+            raise KeyError(key)
+        if self.entry.meta_version == 2 and (key == 'files' or key in self.V2_KEYS):
+            self._load_v2()
+            return dict.__getitem__(self, key)
+        if key == 'pieces':
+            value = self._read_pieces()
+        elif key == 'files':
+            value = _decode_files(self.entry.files_blob)
+        else:
+            value = {} if key == 'piece_layers' else None
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return key in self.LAZY_KEYS or super().__contains__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def _load_v2(self):
+        entry = self.entry
+        with open(entry.path, 'rb') as f:
+            if not entry.matches(os.fstat(f.fileno())):
+                raise ValueError(f"{entry.path} changed since it was indexed")
+            parsed = parse_torrent(f.read(), entry.path)
+        for key in self.V2_KEYS + ('files',):
+            self[key] = parsed[key]
+
+    def _read_pieces(self):
+        entry = self.entry
+        with open(entry.path, 'rb') as f:
+            if not entry.matches(os.fstat(f.fileno())):
+                raise ValueError(f"{entry.path} changed since it was indexed")
+            f.seek(entry.pieces_offset)
+            pieces = f.read(entry.pieces_size)
+        if len(pieces) != entry.pieces_size:
+            raise ValueError(f"{entry.path} is shorter than its index entry")
+        return pieces
+
+
+class MetadataCache:
+    """
+    Parsed metadata keyed by absolute path, valid while the file's mtime and
+    size are unchanged. load() answers from the index when it can and parses
+    (then indexes) the file when it can't; save() writes the index back.
+    """
+
+    def __init__(self, index_path=DEFAULT_INDEX):
+        self.index_path = index_path
+        self.entries = {}  # absolute path → IndexEntry
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self.lock = threading.Lock()
+        self._read_index()
+
+    def load(self, path):
+        """Metadata for the .torrent at `path`, as a TorrentMetadata."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self.lock:
+            entry = self.entries.get(path)
+        if entry is not None and entry.matches(st):
+            self.hits += 1
+            return TorrentMetadata(entry)
+
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())  # Describe the bytes actually read
+            raw = f.read()
+        parsed = parse_torrent(raw, path, locate_pieces=True)
+        files = parsed['files']
+        entry = IndexEntry(path, st.st_mtime_ns, st.st_size, parsed['info_hash'], parsed['meta_version'],
+                           parsed['piece_length'], parsed['length'], parsed.get('pieces_offset', 0),
+                           len(parsed['pieces']), parsed['announce'], parsed['name'],
+                           bencode.encode(_strip_files(files)) if files is not None else b'')
+        with self.lock:
+            self.entries[path] = entry
+            self.dirty = True
+        self.misses += 1
+        return TorrentMetadata(entry)
+
+    def load_directory(self, directory, pattern='*.torrent'):
+        """Metadata for every matching file in `directory`, in name order. Unreadable files are skipped."""
+        torrents = []
+        for name in sorted(fnmatch.filter(os.listdir(directory), pattern)):
+            path = os.path.join(directory, name)
+            try:
+                torrents.append(self.load(path))
+            except (OSError, ValueError) as e:
+                print(f"[!] Skipping {path}: {e}")
+        print(f"[*] Loaded {len(torrents)} torrents from {directory} "
+              f"({self.hits} from the index, {self.misses} parsed)")
+        return torrents
+
+    def save(self, prune_missing=True):
+        """Write the index atomically if anything changed, optionally dropping entries for deleted files."""
+        with self.lock:
+            if prune_missing:
+                for path in [p for p in self.entries if not os.path.exists(p)]:
+                    del self.entries[path]
+                    self.dirty = True
+            if not self.dirty:
+                return
+            entries = list(self.entries.values())
+            self.dirty = False
+
+        data = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, len(entries)) + b''.join(e.pack() for e in entries)
+        temp_path = self.index_path + '.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"[!] Could not write metadata index {self.index_path}: {e}")
+            self.dirty = True
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, 'rb') as f:
+                data = memoryview(f.read())
+        except FileNotFoundError:
+            return
+
+        if len(data) < INDEX_HEADER.size:
+            print(f"[!] Ignoring truncated metadata index {self.index_path}")
+            return
+        magic, version, count = INDEX_HEADER.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            print(f"[!] Ignoring metadata index {self.index_path}: unknown format")
+            return
+
+        offset = INDEX_HEADER.size
+        try:
+            for _ in range(count):
+                (path_len, mtime_ns, size, info_hash, meta_version, piece_length, length, pieces_offset,
+                 pieces_size, announce_len, name_len, files_len) = ENTRY_RECORD.unpack_from(data, offset)
+                offset += ENTRY_RECORD.size
+                strings = []
+                for n in (path_len, announce_len, name_len):
+                    strings.append(bytes(data[offset:offset + n]).decode())
+                    offset += n
+                files_blob = bytes(data[offset:offset + files_len])
+                offset += files_len
+                if offset > len(data):
+                    raise struct.error("entry runs past the end of the index")
+                path, announce, name = strings
+                self.entries[path] = IndexEntry(path, mtime_ns, size, info_hash, meta_version, piece_length,
+                                                length, pieces_offset, pieces_size, announce, name, files_blob)
+        except (struct.error, UnicodeDecodeError):
+            print(f"[!] Metadata index {self.index_path} is damaged; kept {len(self.entries)} entries")
+            self.dirty = True
+
+
+def _strip_files(files):
+    """Length, path and the BEP 47 pad flag go in the index; v2 roots are re-read with the rest of the v2 data."""
+    stripped = []
+    for f in files:
+        entry = {'length': f['length'], 'path': f['path']}
+        if f.get('pad'):
+            entry['attr'] = 'p'
+        stripped.append(entry)
+    return stripped
+
+
+def _decode_files(blob):
+    if not blob:
+        return None
+    files = []
+    for f in bencode.decode(blob):
+        entry = {'length': f[b'length'], 'path': [part.decode() for part in f[b'path']]}
+        if b'p' in f.get(b'attr', b''):
+            entry['pad'] = True
+        files.append(entry)
+    return files
@@ -1,44 +1,380 @@
 # torrent_generator.py
 import os
+import time
+import fnmatch
 import hashlib
-import bencodepy
+from SkyTorrent.utils import bencode, merkle
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 PIECE_LEN = 256 * 1024  # 256 KB
+PROGRESS_INTERVAL = 0.5  # seconds between progress reports
 
+# Automatic piece length: aim for about TARGET_PIECES pieces, within these power-of-two bounds
+TARGET_PIECES = 1500
+MIN_PIECE_LEN = 16 * 1024  # One request block
+MAX_PIECE_LEN = 16 * 1024 * 1024
+METADATA_OVERHEAD = 256  # Rough size of everything in a .torrent besides the piece hashes
 
-def generate_torrent(file_path, tracker_url, out_path):
-    with open(file_path, 'rb') as f:
-        content = f.read()
 
-    pieces = []
-    for i in range(0, len(content), PIECE_LEN):
-        piece = content[i:i + PIECE_LEN]
-        pieces.append(hashlib.sha1(piece).digest())
+def choose_piece_length(total_size, target_pieces=TARGET_PIECES, min_length=MIN_PIECE_LEN, max_length=MAX_PIECE_LEN):
+    """
+    Smallest power-of-two piece length that keeps the piece count at or below
+    `target_pieces`, clamped to [min_length, max_length].
+    """
+    for bound in (min_length, max_length):
+        if bound <= 0 or bound & (bound - 1):
+            raise ValueError(f"Piece length bound {bound} is not a power of two")
+    if min_length > max_length:
+        raise ValueError("min_length is larger than max_length")
 
+    length = min_length
+    while length < max_length and length * target_pieces < total_size:
+        length *= 2
+    return length
+
+
+def estimate_metadata(total_size, piece_length):
+    """(piece count, approximate .torrent size in bytes) for a payload, before hashing it."""
+    piece_count = -(-total_size // piece_length)
+    return piece_count, 20 * piece_count + METADATA_OVERHEAD
+
+
+def collect_files(root, exclude=()):
+    """
+    Files under `root` in a deterministic order (names sorted at every level),
+    skipping any file or directory whose name or relative path matches an
+    `exclude` glob pattern.
+
+    :return: [(absolute path, relative path components, size)]
+    """
+    def excluded(name, relative):
+        return any(fnmatch.fnmatch(name, p) or fnmatch.fnmatch(relative, p) for p in exclude)
+
+    files = []
+    for directory, dirnames, filenames in os.walk(root):
+        relative_dir = os.path.relpath(directory, root)
+        relative_dir = '' if relative_dir == '.' else relative_dir.replace(os.sep, '/') + '/'
+        # Pruning and sorting in place steers os.walk itself
+        dirnames[:] = sorted(d for d in dirnames if not excluded(d, relative_dir + d))
+        for name in sorted(filenames):
+            relative = relative_dir + name
+            path = os.path.join(directory, name)
+            if excluded(name, relative) or not os.path.isfile(path):
+                continue
+            files.append((path, relative.split('/'), os.path.getsize(path)))
+    return files
+
+
+def hash_pieces(files, piece_length=PIECE_LEN, workers=None, progress=None):
+    """
+    SHA-1 of every piece of a file, or of several files read back to back as
+    one stream, in piece order, with bounded memory.
+
+    Files are read with readinto() into a small ring of reusable buffers while
+    a thread pool hashes the filled ones (hashlib releases the GIL on large
+    buffers), so reading and hashing overlap and memory stays at about
+    2 * workers pieces whatever the payload size. A piece may span many small
+    files; they are read straight into the same buffer.
+
+    :param files: A file path, or [(path, size)] in torrent order
+    :param workers: Hashing threads (defaults to the CPU count)
+    :param progress: Optional callable(done_bytes, total_bytes, elapsed_seconds)
+    :return: Concatenated 20-byte digests
+    """
+    if isinstance(files, (str, os.PathLike)):
+        files = [(files, os.path.getsize(files))]
+    return b''.join(_hash_stream(files, piece_length, workers, progress, _sha1))
+
+
+def hash_files_v2(files, piece_length=PIECE_LEN, workers=None, progress=None, hybrid=False):
+    """
+    BitTorrent v2 hashes of [(path, size)]: a SHA-256 merkle tree per file
+    with 16 KiB leaves. Pieces never span files. With `hybrid`, the v1 SHA-1
+    piece hashes are computed in the same pass, over the payload with every
+    file but the last padded out to a piece boundary.
+
+    :return: ([(pieces root or None for an empty file, piece layer)] per file, v1 pieces or None)
+    """
+    pieces = _hash_stream(files, piece_length, workers, progress,
+                          lambda data, pad: _hash_v2_piece(data, pad, piece_length, hybrid), align_files=True)
+    results = []
+    position = 0
+    for _, size in files:
+        count = -(-size // piece_length)
+        file_pieces = pieces[position:position + count]
+        position += count
+        if not size:
+            results.append((None, b''))
+        elif count == 1:
+            # A one-piece file is a single tree sized to its own block count
+            leaves = merkle.split_hashes(file_pieces[0][1])
+            results.append((merkle.merkle_root(leaves, merkle.leaf_width(size, piece_length)), b''))
+        else:
+            roots = [root for _, _, root in file_pieces]
+            results.append((merkle.file_root(roots, size, piece_length), b''.join(roots)))
+    return results, b''.join(digest for digest, _, _ in pieces) if hybrid else None
+
+
+def _hash_stream(files, piece_length, workers, progress, hasher, align_files=False):
+    """
+    Results of hasher(piece, pad) for every piece of [(path, size)] read as one
+    stream, in order. With `align_files`, pieces end at file boundaries and
+    `pad` is the zero padding to the next piece boundary (0 after the last file).
+    """
+    workers = workers or os.cpu_count() or 1
+    total = sum(size for _, size in files)
+    buffers = [bytearray(piece_length) for _ in range(2 * workers)]
+    pending = []  # (future, length) in piece order; at most len(buffers) in flight
+    digests = []
+    done = 0
+    started = last_report = time.perf_counter()
+
+    with _FileChain(files, align_files) as stream, ThreadPoolExecutor(workers) as pool:
+        piece = 0
+        while True:
+            if len(pending) == len(buffers):
+                future, length = pending.pop(0)
+                digests.append(future.result())  # Frees the oldest buffer for reuse
+                done += length
+            buffer = memoryview(buffers[piece % len(buffers)])
+            length = stream.readinto(buffer)
+            if not length:
+                break
+            pad = piece_length - length if align_files and length < piece_length and stream.more() else 0
+            pending.append((pool.submit(hasher, buffer[:length], pad), length))
+            piece += 1
+
+            now = time.perf_counter()
+            if progress is not None and now - last_report >= PROGRESS_INTERVAL:
+                progress(done, total, now - started)
+                last_report = now
+
+        for future, length in pending:
+            digests.append(future.result())
+            done += length
+
+    if progress is not None:
+        progress(done, total, time.perf_counter() - started)
+    return digests
+
+
+class _FileChain:
+    """
+    Reads [(path, size)] as one continuous stream, holding at most one file open.
+    With `stop_at_file_end`, a read never continues into the next file.
+    """
+
+    def __init__(self, files, stop_at_file_end=False):
+        self.files = list(files)
+        self.position = 0  # Next entry of self.files to open
+        self.stop_at_file_end = stop_at_file_end
+        self.current = None
+        self.remaining = 0  # Bytes still expected from the current file
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.current is not None:
+            self.current.close()
+
+    def readinto(self, buffer):
+        """Fill `buffer` across file boundaries. Returns the bytes read; short only at the end."""
+        filled = 0
+        while filled < len(buffer):
+            if self.current is None:
+                if self.position == len(self.files) or (filled and self.stop_at_file_end):
+                    break
+                path, self.remaining = self.files[self.position]
+                self.position += 1
+                if not self.remaining:
+                    continue
+                self.current = open(path, 'rb', buffering=0)
+            n = self.current.readinto(buffer[filled:filled + self.remaining])
+            if not n:
+                raise IOError(f"{self.current.name} shrank while it was being hashed")
+            filled += n
+            self.remaining -= n
+            if not self.remaining:
+                self.current.close()
+                self.current = None
+        return filled
+
+    def more(self):
+        """Whether any data is left after the current file."""
+        return any(size for _, size in self.files[self.position:])
+
+
+def _sha1(data, pad=0):
+    return hashlib.sha1(data).digest()
+
+
+def _hash_v2_piece(data, pad, piece_length, hybrid):
+    """(v1 SHA-1 of the zero-padded piece or b'', 16 KiB leaf hashes, piece-layer hash) of one piece."""
+    digest = b''
+    if hybrid:
+        sha1 = hashlib.sha1(data)
+        if pad:
+            sha1.update(bytes(pad))
+        digest = sha1.digest()
+    leaves = merkle.hash_blocks(data)
+    root = merkle.merkle_root(merkle.split_hashes(leaves), piece_length // merkle.BLOCK_SIZE)
+    return digest, leaves, root
+
+
+def print_progress(done, total, elapsed):
+    """Default progress reporter: percentage and throughput on one updating line."""
+    rate = done / elapsed / 2 ** 20 if elapsed else 0
+    percent = 100 * done / total if total else 100
+    print(f"\r[*] Hashing {percent:5.1f}%  {done / 2 ** 20:,.0f}/{total / 2 ** 20:,.0f} MiB  {rate:,.1f} MiB/s",
+          end='\n' if done >= total else '', flush=True)
+
+
+def generate_torrent(file_path, tracker_url, out_path, piece_length=None, workers=None, progress=None, exclude=(),
+                     meta_version='v1'):
+    """
+    Write a .torrent for `file_path`: single-file for a file, multi-file
+    (an info dict with `files`) for a directory.
+
+    :param piece_length: Bytes per piece; None picks one with choose_piece_length()
+    :param workers: Hashing threads (defaults to the CPU count)
+    :param progress: Optional callable(done_bytes, total_bytes, elapsed_seconds)
+    :param exclude: Glob patterns of files/directories to leave out of a directory torrent
+    :param meta_version: 'v1' (SHA-1 pieces), 'v2' (BEP 52 merkle trees) or 'hybrid' (both)
+    :return: {'piece_length', 'piece_count', 'metadata_size'} of the written torrent
+    """
+    if meta_version not in ('v1', 'v2', 'hybrid'):
+        raise ValueError(f"Unknown torrent version {meta_version!r}")
+    if os.path.isdir(file_path):
+        files = collect_files(file_path, exclude)
+        if not files:
+            raise ValueError(f"No files to add under {file_path}")
+    else:
+        files = [(file_path, [], os.path.getsize(file_path))]
+    total_size = sum(size for _, _, size in files)
+    if piece_length is None:
+        piece_length = choose_piece_length(total_size)
+    name = os.path.basename(os.path.normpath(file_path))
     info = {
-        b'piece length': PIECE_LEN,
-        b'pieces': b''.join(pieces),
-        b'name': os.path.basename(file_path).encode(),
-        b'length': len(content)
+        b'piece length': piece_length,
+        b'name': name.encode(),
     }
-
     torrent = {
         b'announce': tracker_url.encode(),
         b'info': info
     }
 
+    v1_files = [(size, parts) for _, parts, size in files]
+    if meta_version == 'v1':
+        pieces = hash_pieces([(path, size) for path, _, size in files], piece_length, workers, progress)
+    else:
+        if piece_length < merkle.BLOCK_SIZE:
+            raise ValueError(f"v2 torrents need pieces of at least {merkle.BLOCK_SIZE} bytes")
+        # Payload order is the file tree's, whose keys sort as bytes; hybrid v1 lists must follow it
+        files.sort(key=lambda f: [part.encode() for part in f[1]])
+        trees, pieces = hash_files_v2([(path, size) for path, _, size in files], piece_length, workers, progress,
+                                      hybrid=meta_version == 'hybrid')
+        info[b'meta version'] = 2
+        info[b'file tree'] = _file_tree(files if os.path.isdir(file_path) else [(file_path, [name], total_size)],
+                                        trees)
+        torrent[b'piece layers'] = {root: layer for root, layer in trees if layer}
+        v1_files = _pad_files([(size, parts) for _, parts, size in files], piece_length)
+        if meta_version == 'v2':
+            pieces = None
+
+    if pieces is not None:
+        info[b'pieces'] = pieces
+        if os.path.isdir(file_path):
+            info[b'files'] = [_v1_file_entry(size, parts) for size, parts in v1_files]
+        else:
+            info[b'length'] = total_size
+
+    encoded = bencode.encode(torrent)
     with open(out_path, 'wb') as f:
-        f.write(bencodepy.encode(torrent))
+        f.write(encoded)
 
     print(f"[+] Torrent created: {out_path}")
+    return {
+        'piece_length': piece_length,
+        'piece_count': sum(-(-size // piece_length) for _, _, size in files) if pieces is None else len(pieces) // 20,
+        'metadata_size': len(encoded)
+    }
+
+
+def _file_tree(files, trees):
+    """BEP 52 `file tree`: nested dicts by path component, each file a {'': {length, pieces root}} leaf."""
+    tree = {}
+    for (_, parts, size), (root, _) in zip(files, trees):
+        node = tree
+        for part in parts:
+            node = node.setdefault(part.encode(), {})
+        node[b''] = {b'length': size, b'pieces root': root} if root is not None else {b'length': size}
+    return tree
+
+
+def _pad_files(files, piece_length):
+    """
+    v1 file list of a hybrid torrent: a BEP 47 padding file after every file
+    that doesn't end on a piece boundary, so v1 pieces line up with v2 ones.
+    """
+    padded = []
+    for i, (size, parts) in enumerate(files):
+        padded.append((size, parts))
+        pad = -size % piece_length
+        if pad and any(later for later, _ in files[i + 1:]):
+            padded.append((pad, None))
+    return padded
+
+
+def _v1_file_entry(size, parts):
+    if parts is None:
+        return {b'length': size, b'path': [b'.pad', str(size).encode()], b'attr': b'p'}
+    return {b'length': size, b'path': [part.encode() for part in parts]}
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if size < 1024 or unit == 'GiB':
+            return f"{size:,.0f} {unit}" if unit == 'B' else f"{size:,.1f} {unit}"
+        size /= 1024
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Generate a .torrent file from a file.")
-    parser.add_argument("file_path", nargs='?', default="my_file.txt", help="Path to the source file")
+    parser = argparse.ArgumentParser(description="Generate a .torrent file from a file or directory.")
+    parser.add_argument("file_path", nargs='?', default="my_file.txt", help="Path to the source file or directory")
     parser.add_argument("tracker_url", nargs='?', default="http://localhost:6969/announce", help="Tracker URL")
     parser.add_argument("out_path", nargs='?', default="my_file.torrent", help="Output .torrent file path")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing threads (default: CPU count)")
+    parser.add_argument("--piece-length", type=int, default=None,
+                        help="Piece length in KiB, a power of two (default: chosen from the file size)")
+    parser.add_argument("--target-pieces", type=int, default=TARGET_PIECES,
+                        help="Piece count the automatic piece length aims for")
+    parser.add_argument("--min-piece-length", type=int, default=MIN_PIECE_LEN // 1024,
+                        help="Smallest automatic piece length in KiB")
+    parser.add_argument("--max-piece-length", type=int, default=MAX_PIECE_LEN // 1024,
+                        help="Largest automatic piece length in KiB")
+    parser.add_argument("--exclude", action="append", default=[], metavar="PATTERN",
+                        help="Glob of files/directories to skip in a directory torrent (repeatable)")
+    parser.add_argument("--meta-version", choices=('v1', 'v2', 'hybrid'), default='v1',
+                        help="v1 SHA-1 pieces, v2 per-file SHA-256 merkle trees, or a hybrid of both")
 
     args = parser.parse_args()
-    generate_torrent(args.file_path, args.tracker_url, args.out_path)
+    if os.path.isdir(args.file_path):
+        size = sum(size for _, _, size in collect_files(args.file_path, args.exclude))
+    else:
+        size = os.path.getsize(args.file_path)
+    if args.piece_length:
+        piece_length = choose_piece_length(size, 1, args.piece_length * 1024, args.piece_length * 1024)
+    else:
+        piece_length = choose_piece_length(size, args.target_pieces,
+                                           args.min_piece_length * 1024, args.max_piece_length * 1024)
+    piece_count, metadata_size = estimate_metadata(size, piece_length)
+    print(f"[*] {format_size(size)} in {piece_count:,} pieces of {format_size(piece_length)}, "
+          f"~{format_size(metadata_size)} of metadata")
+
+    summary = generate_torrent(args.file_path, args.tracker_url, args.out_path, piece_length,
+                               workers=args.workers, progress=print_progress, exclude=args.exclude,
+                               meta_version=args.meta_version)
+    print(f"[+] {summary['piece_count']:,} pieces of {format_size(summary['piece_length'])}, "
+          f"metadata {format_size(summary['metadata_size'])}")
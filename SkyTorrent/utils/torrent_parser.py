@@ -1,29 +1,104 @@
 # torrent_parser.py
 
-import bencodepy
 import hashlib
+from SkyTorrent.utils import bencode
 
 
 def parse_torrent_file(path):
     with open(path, 'rb') as f:
         raw = f.read()
+    return parse_torrent(raw, path)
 
-    # Decode using bencode
-    meta = bencodepy.decode(raw)
+
+def parse_torrent(raw, source='<torrent>', locate_pieces=False):
+    """
+    Parse the bytes of a .torrent file.
+
+    v2 and hybrid torrents (BEP 52) also get 'info_hash_v2' (full SHA-256),
+    'piece_layers' ({pieces root: concatenated piece hashes}) and a
+    'pieces_root' on every file; 'pieces' is b'' for a v2-only torrent, whose
+    'info_hash' is the truncated v2 hash used in handshakes and announces.
+
+    :param source: Name used in error messages
+    :param locate_pieces: Also return 'pieces_offset', the byte offset of the piece hashes in `raw`
+    """
+    # Decode using bencode; large strings (pieces) stay views into `raw`
+    meta, info_span = bencode.decode_with_span(raw, b'info', keep_views=True)
+    if info_span is None:
+        raise ValueError(f"{source} has no info dictionary")
 
     # Extract fields
     info = meta[b'info']
-    info_encoded = bencodepy.encode(info)  # for info_hash
-    info_hash = hashlib.sha1(info_encoded).digest()
+    start, end = info_span
+    info_hash = hashlib.sha1(memoryview(raw)[start:end]).digest()  # Hash the bytes as written, not a re-encoding
+    meta_version = info.get(b'meta version', 1)
+    info_hash_v2 = hashlib.sha256(memoryview(raw)[start:end]).digest() if meta_version == 2 else None
+    if b'pieces' not in info:
+        if info_hash_v2 is None:
+            raise ValueError(f"{source} has neither v1 pieces nor a v2 file tree")
+        info_hash = info_hash_v2[:20]
+
+    # Multi-file torrents list their files; the payload is their concatenation
+    files = None
+    if b'files' in info:
+        files = [
+            {'length': f[b'length'], 'path': [_text(part) for part in f[b'path']]}
+            for f in info[b'files']
+        ]
+        for entry, f in zip(files, info[b'files']):
+            if b'p' in bytes(f.get(b'attr', b'')):
+                entry['pad'] = True  # BEP 47 padding, present only to align hybrid pieces
+
+    pieces_root = length = None
+    if info_hash_v2 is not None:
+        tree = _walk_file_tree(info[b'file tree'])
+        roots = {tuple(path): root for path, _, root in tree}
+        single = len(tree) == 1 and tree[0][0] == [_text(info[b'name'])]
+        if single:
+            pieces_root, length = tree[0][2], tree[0][1]
+        elif files is None:  # v2-only multi-file torrent
+            files = [{'length': size, 'path': path} for path, size, _ in tree]
+        for entry in files or ():
+            entry['pieces_root'] = roots.get(tuple(entry['path']))
+    if b'length' in info:
+        length = info[b'length']
+    elif files is not None:
+        length = sum(f['length'] for f in files)
 
     # Basic fields
     parsed = {
-        'announce': meta.get(b'announce', b'').decode(),
+        'announce': _text(meta.get(b'announce', b'')),
         'info_hash': info_hash,
-        'name': info[b'name'].decode(),
+        'name': _text(info[b'name']),
         'piece_length': info[b'piece length'],
-        'pieces': info[b'pieces'],
-        'length': info.get(b'length')  # single-file torrent
+        'pieces': info.get(b'pieces', b''),
+        'length': length,
+        'files': files,  # None for a single-file torrent
+        'meta_version': meta_version,
+        'info_hash_v2': info_hash_v2,
+        'pieces_root': pieces_root,  # Single-file v2 torrents; multi-file ones have one per file
+        'piece_layers': meta.get(b'piece layers', {}) if info_hash_v2 is not None else {},
     }
 
+    if locate_pieces and b'pieces' in info:
+        # The pieces string ends where its span ends; its length prefix comes before
+        _, (_, pieces_end) = bencode.decode_with_span(memoryview(raw)[start:end], b'pieces', keep_views=True)
+        parsed['pieces_offset'] = start + pieces_end - len(parsed['pieces'])
+
     return parsed
+
+
+def _text(value):
+    """A bencoded string as str; strings of VIEW_THRESHOLD bytes or more come back as memoryviews."""
+    return bytes(value).decode()
+
+
+def _walk_file_tree(tree, prefix=()):
+    """BEP 52 file tree → [(path components, length, pieces root or None)] in tree order."""
+    files = []
+    for name, node in tree.items():
+        if name == b'':
+            files.append((list(prefix), node[b'length'], node.get(b'pieces root')))
+        else:
+            files.extend(_walk_file_tree(node, prefix + (name.decode(),)))
+    return files